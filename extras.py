@@ -10,6 +10,12 @@ import gym
 import numpy as np
 
 from tpg.trainer import Trainer
+from tpg.evaluation import EvaluationPool, evaluateLockstep, outOfRace, COMPLETED
+from tpg.envs import VectorEnv, StartStateCache, processEnvPool, processStartStateCache
+from tpg.fitness_cache import FitnessCache
+from tpg.cost_model import CostModel
+from tpg.islands import IslandModel
+from tpg.checkpoint import CheckpointStore, CheckpointWriter, resume
 from tpg.utils import getLearners, getTeams, learnerInstructionStats, actionInstructionStats, pathDepths
 
 """
@@ -25,6 +31,51 @@ def getStateALE(inState):
     return np.add(np.left_shift(rgbRows[0], 16),
         np.add(np.left_shift(rgbRows[1], 8), rgbRows[2]))
 
+"""
+Plays the agent in the environment for numEpisodes episodes of at most numFrames
+frames, the first nRandFrames of each being random actions. Returns the average
+score over the episodes. With a cutoff (see Trainer.getSurvivalCutoff), stops
+once the agent is out of the race and returns the average so far. With a
+startCache (tpg.envs.StartStateCache), episodes start from cached post warmup
+states instead of playing the random frames.
+"""
+def playAgent(agent, env, numEpisodes, numFrames, nRandFrames, do_real, agentNum=None,
+        cutoff=None, minEpisodes=2, confidence=2.0, startCache=None):
+    acts = env.action_space.n
+
+    episodeScores = []
+    for ep in range(numEpisodes): # episode loop
+        if outOfRace(episodeScores, cutoff, minEpisodes, confidence):
+            break # no chance of surviving selection
+        if startCache is None:
+            state = env.reset()
+            firstFrame = 0
+        else:
+            state = startCache.start(env)
+            firstFrame = nRandFrames
+        scoreEp = 0
+        for i in range(firstFrame, numFrames): # frame loop
+            if i < nRandFrames:
+                env.step(env.action_space.sample())
+                continue
+
+            act = agent.act(getStateALE(np.array(state, dtype=np.int32)))
+            if do_real:
+                act = int(math.floor(act[1]) % acts)
+
+            # feedback from env
+            state, reward, isDone, debug = env.step(act)
+            scoreEp += reward # accumulate reward in score
+            if isDone:
+                break # end early if losing state
+
+        if do_real:
+            print('Agent #' + str(agentNum) +
+                ' | Ep #' + str(ep) + ' | Score: ' + str(scoreEp))
+        episodeScores.append(scoreEp)
+
+    return sum(episodeScores)/len(episodeScores)
+
 """
 Run each agent in this method for parallization.
 See example in tpg_examples.ipynb.
@@ -49,73 +100,83 @@ def runAgentParallel(args):
             scoreList.append((agent.team.id, agent.team.outcomes))
             return
 
-        env = gym.make(envName)
-        valActs = range(env.action_space.n) # valid actions, some envs are less
-        acts = env.action_space.n
-
-
-        scoreTotal = 0 # score accumulates over all episodes
-
-        if do_real:
-            for ep in range(numEpisodes): # episode loop
-                state = env.reset()
-                scoreEp = 0
-                for i in range(numFrames): # frame loop
-                    if i < nRandFrames:
-                        env.step(env.action_space.sample())
-                        continue
-
-                    act = agent.act(getStateALE(np.array(state, dtype=np.int32)))
-                    act = int(math.floor(act[1]) % acts)
-                    #print(act)
-
-                    # feedback from env
-                    state, reward, isDone, debug = env.step(act)
-                    scoreEp += reward # accumulate reward in score
-                    if isDone:
-                        break # end early if losing state
-
-                print('Agent #' + str(agent.agentNum) +
-                    ' | Ep #' + str(ep) + ' | Score: ' + str(scoreEp))
-                scoreTotal += scoreEp
-        else:
-            for ep in range(numEpisodes): # episode loop
-                state = env.reset()
-                scoreEp = 0
-                for i in range(numFrames): # frame loop
-                    if i < nRandFrames:
-                        env.step(env.action_space.sample())
-                        continue
-
-                    act = agent.act(getStateALE(np.array(state, dtype=np.int32)))
-
-                    # feedback from env
-                    state, reward, isDone, debug = env.step(act)
-                    scoreEp += reward # accumulate reward in score
-                    if isDone:
-                        break # end early if losing state
-
-                #print('Agent #' + str(agent.agentNum) +
-                    #' | Ep #' + str(ep) + ' | Score: ' + str(scoreEp))
-                scoreTotal += scoreEp
-
-        scoreTotal /= numEpisodes
-        env.close()
+        envPool = processEnvPool(gym.make)
+        env = envPool.acquire(envName)
+        try:
+            scoreTotal = playAgent(agent, env, numEpisodes, numFrames, nRandFrames,
+                            do_real, agentNum=agent.agentNum)
+        except Exception:
+            envPool.discard(env)
+            raise
+        envPool.release(envName, env)
         agent.reward(scoreTotal, envName)
         scoreList.append((agent.team.id, agent.team.outcomes))
 
     except Exception as playException:
         print("Exception occured while Agent {} was playing {}".format(args[0].agentNum, args[1] ))
         raise playException
+
+"""
+Evaluation function for tpg.evaluation.EvaluationPool workers, plays the agent
+on the environment and returns its outcomes. Environments come from the
+worker's pool, so they are created once and reused across agents and
+generations. envFactory(envName) creates them, gym.make by default. If
+startStates, the worker keeps that many post warmup start states to sample
+episode starts from.
+"""
+def evaluateAgent(agent, envName, numEpisodes, numFrames, nRandFrames, do_real,
+        cutoff=None, envFactory=gym.make, startStates=0):
+    envPool = processEnvPool(envFactory)
+    startCache = None
+    if startStates > 0 and nRandFrames > 0:
+        startCache = processStartStateCache(envName, nRandFrames, size=startStates)
+    env = envPool.acquire(envName)
+    try:
+        score = playAgent(agent, env, numEpisodes, numFrames, nRandFrames,
+                    do_real, agentNum=agent.agentNum, cutoff=cutoff, startCache=startCache)
+    except Exception:
+        envPool.discard(env)
+        raise
+    envPool.release(envName, env)
+
+    return {envName: score}
+
+"""
+Reports evaluations from the pool that timed out or failed.
+"""
+def printFailures(scoreList):
+    for result in scoreList:
+        if result.status != COMPLETED:
+            print("Evaluation of team {} {}".format(result.teamId, result.status))
+            if result.detail is not None:
+                print(result.detail)
+
 """
-Uses the runAgentParallel function to run a whole population of TPG agents
-for however many generations on the supplied environmental parameters.
-On an OpenAI gym environment.
+Uses a pool of persistent evaluation workers to run a whole population of TPG
+agents for however many generations on the supplied environmental parameters.
+On an OpenAI gym environment. If race, agents that clearly can't survive
+selection stop playing their remaining episodes early. With a fitnessCacheSize,
+agents identical to ones already evaluated inherit their scores. With
+startStates, each worker samples episode starts from that many cached post
+warmup states instead of playing nRandFrames random frames every episode. If
+costAware, the agents expected to take longest are started first. Agents still
+playing after agentTimeout seconds get cut off with the lowest score, agents
+playing stragglerFactor times longer than usual get a second copy started.
+With an address and authkey (bytes, required with an address), also waits for
+remoteWorkers to connect from other machines (tpg.evaluation.runRemoteWorker
+with the same authkey) to evaluate with. With a checkpointDir, the trainer is
+checkpointed there every generation in the background, keeping the
+checkpointKeep latest, and resumes from the latest checkpoint if there is one,
+going on with its generation up to gens. With pruneHitchhikers, the workers
+count learner wins and learners that never win on a team are pruned from it
+each generation.
 """
 def runPopulationParallel(envName="Boxing-v0", gens=1000, popSize=360, reps=3,
         frames=18000, processes=4, nRandFrames=30, rootBasedPop=True,
         memType=None, operationSet="full", rampancy=(5,5,5), traversal="team",
-        do_real=False):
+        do_real=False, race=False, fitnessCacheSize=0, startStates=0, costAware=False,
+        agentTimeout=None, stragglerFactor=None, address=None, authkey=None,
+        remoteWorkers=0, checkpointDir=None, checkpointKeep=3, pruneHitchhikers=False):
     tStart = time.time()
 
     '''
@@ -143,40 +204,59 @@ def runPopulationParallel(envName="Boxing-v0", gens=1000, popSize=360, reps=3,
     trainer.configFunctions()
     #print(1/0)
 
-    man = mp.Manager()
-    pool = mp.Pool(processes=processes, maxtasksperchild=1)
+    checkpoints = None
+    if checkpointDir is not None:
+        resumed = resume(checkpointDir)
+        if resumed is not None:
+            print("resuming from checkpoint of generation {}".format(resumed.generation))
+            trainer = resumed
+        checkpoints = CheckpointWriter(CheckpointStore(checkpointDir),
+                                        keepLast=checkpointKeep)
+
+    if pruneHitchhikers:
+        # before the pool, so the workers count too
+        trainer.setCounting(pruneHitchhikers=True)
+
+    pool = EvaluationPool(trainer, evaluateAgent,
+        evalArgs=(envName, reps, frames, nRandFrames, do_real), processes=processes,
+        costModel=CostModel() if costAware else None, timeout=agentTimeout,
+        stragglerFactor=stragglerFactor, address=address, authkey=authkey)
+    if remoteWorkers > 0:
+        print("waiting for {} remote workers on {}".format(remoteWorkers, pool.address))
+        pool.acceptWorkers(remoteWorkers)
+
+    cache = FitnessCache(fitnessCacheSize) if fitnessCacheSize > 0 else None
 
     allScores = [] # track all scores each generation
 
     print("running generations")
-    for gen in range(gens): # do generations of training
+    for gen in range(trainer.generation, gens): # do generations of training
         print("doing generation {}".format(gen))
-        scoreList = man.list()
-
-        agents = trainer.getAgents() # swap out agents only at start of generation
-        agent = agents[0]
+        # only root teams without a score yet need to play
+        teams = [agent.team for agent in trainer.getAgents(skipTasks=[envName])]
+        if cache is not None:
+            teams = cache.inherit(teams, [envName])
 
-        try:
-            
-            # run the agents
-            pool.map(runAgentParallel,
-                [(agent, envName, scoreList, reps, frames, nRandFrames, do_real)
-                for agent in agents]
-            )
-
-
-        except Exception as mpException:
-            print("Exception occured while running multiprocessing via pool.map!")
-            print(mpException)
-            raise mpException
+        # run the agents
+        evalKwargs = {"cutoff": trainer.getSurvivalCutoff(envName) if race else None,
+                      "startStates": startStates}
+        scoreList = pool.evaluate(teams, evalKwargs=evalKwargs)
+        printFailures(scoreList)
 
         # prepare population for next gen
         print("Applying gen {} scores to agents".format(gen))
-        teams = trainer.applyScores(scoreList)
+        teams = trainer.applyScores(scoreList, tasks=[envName])
+        if cache is not None:
+            # duplicates within this generation inherit from the ones just played
+            cache.store(trainer.rootTeams, [envName])
+            cache.inherit([agent.team for agent in trainer.getAgents(skipTasks=[envName])],
+                            [envName])
         print("Getting champion")
         champ = trainer.getAgents(sortTasks=[envName])[0].team
         print("Evolving population")
         trainer.evolve(tasks=[envName]) # go into next gen
+        if checkpoints is not None:
+            checkpoints.submit(trainer)
 
         # track stats
         scoreStats = trainer.fitnessStats
@@ -195,6 +275,10 @@ def runPopulationParallel(envName="Boxing-v0", gens=1000, popSize=360, reps=3,
         print(f"Gen: {gen}, Best Score: {scoreStats['max']}, Avg Score: {scoreStats['average']}, Time: {str((time.time() - tStart)/3600)}")
         
 
+    pool.close()
+    if checkpoints is not None:
+        checkpoints.close()
+
     print(pathDepths(champ))
 
     print('Time Taken (Hours): ' + str((time.time() - tStart)/3600))
@@ -204,6 +288,157 @@ def runPopulationParallel(envName="Boxing-v0", gens=1000, popSize=360, reps=3,
 
     return trainer, allScores[-1]
 
+"""
+Steady state version of runPopulationParallel. Workers are kept busy with new
+offspring instead of waiting for each generation to finish, every time
+numReplace evaluations arrive the worst numReplace evaluated root teams are
+replaced. Runs until numEvaluations agents have been evaluated. agentTimeout
+and stragglerFactor are as for runPopulationParallel.
+"""
+def runPopulationSteadyState(envName="Boxing-v0", numEvaluations=100000,
+        numReplace=8, popSize=360, reps=3, frames=18000, processes=4, nRandFrames=30,
+        rootBasedPop=True, memType=None, operationSet="full", rampancy=(5,5,5),
+        traversal="team", do_real=False, agentTimeout=None, stragglerFactor=None):
+    tStart = time.time()
+
+    set_start_method("spawn")
+
+    env = gym.make(envName)
+    acts = env.action_space.n
+    del env
+
+    trainer = Trainer(actions=[1,1] if do_real else acts, teamPopSize=popSize,
+        rootBasedPop=rootBasedPop, memType=memType, operationSet=operationSet,
+        rampancy=rampancy, traversal=traversal)
+    trainer.configFunctions()
+
+    pool = EvaluationPool(trainer, evaluateAgent,
+        evalArgs=(envName, reps, frames, nRandFrames, do_real), processes=processes,
+        timeout=agentTimeout, stragglerFactor=stragglerFactor)
+
+    allScores = [] # track scores after each replacement
+    pool.submit(trainer.rootTeams)
+    evaluations = 0
+    arrived = 0 # evaluations since the last replacement
+    while evaluations < numEvaluations and pool.numPending() > 0:
+        scoreList = pool.collect()
+        printFailures(scoreList)
+        trainer.applyScores(scoreList, tasks=[envName])
+        evaluations += len(scoreList)
+        arrived += len(scoreList)
+
+        if arrived >= numReplace:
+            newTeams = trainer.evolveSteadyState(tasks=[envName], numReplace=numReplace)
+            if len(newTeams) > 0:
+                arrived = 0
+                pool.submit(newTeams)
+
+                scoreStats = trainer.fitnessStats
+                allScores.append((scoreStats['min'], scoreStats['max'], scoreStats['average']))
+                print(f"Evaluations: {evaluations}, Best Score: {scoreStats['max']}, Avg Score: {scoreStats['average']}, Time: {str((time.time() - tStart)/3600)}")
+
+    pool.close()
+
+    print('Time Taken (Hours): ' + str((time.time() - tStart)/3600))
+    print('Results:\nMin, Max, Avg')
+    for score in allScores:
+        print(score[0],score[1],score[2])
+
+    return trainer, allScores[-1]
+
+"""
+Island model version of runPopulationParallel, one process per island each
+evolving its own population of popSize root teams (islandKwargs can override
+the trainer parameters of each island). Every migrationInterval generations
+the best numMigrants root teams of each island migrate along the topology.
+"""
+def runPopulationIslands(envName="Boxing-v0", epochs=100, numIslands=4,
+        migrationInterval=5, numMigrants=2, topology="ring", islandKwargs=None,
+        popSize=90, reps=3, frames=18000, nRandFrames=30, rootBasedPop=True,
+        memType=None, operationSet="full", rampancy=(5,5,5), traversal="team",
+        do_real=False):
+    tStart = time.time()
+
+    set_start_method("spawn")
+
+    env = gym.make(envName)
+    acts = env.action_space.n
+    del env
+
+    trainerKwargs = []
+    for i in range(numIslands):
+        kwargs = {"actions": [1,1] if do_real else acts, "teamPopSize": popSize,
+            "rootBasedPop": rootBasedPop, "memType": memType,
+            "operationSet": operationSet, "rampancy": rampancy, "traversal": traversal}
+        if islandKwargs is not None:
+            kwargs.update(islandKwargs[i])
+        trainerKwargs.append(kwargs)
+
+    with IslandModel(trainerKwargs, evaluateAgent,
+            evalArgs=(envName, reps, frames, nRandFrames, do_real), tasks=[envName],
+            topology=topology, migrationInterval=migrationInterval,
+            numMigrants=numMigrants) as model:
+        for epoch in range(epochs):
+            stats = model.run(1)
+            best = max(islandStats[-1]["max"] for islandStats in stats)
+            print(f"Epoch: {epoch}, Best Score: {best}, Time: {str((time.time() - tStart)/3600)}")
+
+        champion, outcomes = model.getChampion()
+
+    print('Time Taken (Hours): ' + str((time.time() - tStart)/3600))
+    print('Results:\nIsland, Min, Max, Avg')
+    for i, islandStats in enumerate(stats):
+        print(i, islandStats[-1]["min"], islandStats[-1]["max"], islandStats[-1]["average"])
+
+    return champion, outcomes
+
+"""
+Runs a whole population of TPG agents for however many generations in this
+process, evaluating numEnvs agents at a time in lockstep on copies of an OpenAI
+gym environment with batched acting. Discrete actions without memory only. If
+race, agents that clearly can't survive selection stop early. With startStates,
+episodes start from that many cached post warmup states.
+"""
+def runPopulationLockstep(envName="Boxing-v0", gens=1000, popSize=360, reps=3,
+        frames=18000, numEnvs=16, nRandFrames=30, rootBasedPop=True,
+        operationSet="full", rampancy=(5,5,5), traversal="team", race=False,
+        startStates=0):
+    tStart = time.time()
+
+    vecEnv = VectorEnv([lambda: gym.make(envName)]*numEnvs)
+    startCache = None
+    if startStates > 0 and nRandFrames > 0:
+        startCache = StartStateCache(nRandFrames, size=startStates)
+    trainer = Trainer(actions=vecEnv.action_space.n, teamPopSize=popSize,
+        rootBasedPop=rootBasedPop, memType=None, operationSet=operationSet,
+        rampancy=rampancy, traversal=traversal)
+
+    allScores = [] # track all scores each generation
+    for gen in range(gens): # do generations of training
+        teams = [agent.team for agent in trainer.getAgents(skipTasks=[envName])]
+        scoreList = evaluateLockstep(trainer, teams, vecEnv, reps, frames, envName,
+            nRandFrames=nRandFrames,
+            stateFunc=lambda state: getStateALE(np.array(state, dtype=np.int32)),
+            cutoff=trainer.getSurvivalCutoff(envName) if race else None,
+            startCache=startCache)
+
+        trainer.applyScores(scoreList, tasks=[envName])
+        trainer.evolve(tasks=[envName]) # go into next gen
+
+        # track stats
+        scoreStats = trainer.fitnessStats
+        allScores.append((scoreStats['min'], scoreStats['max'], scoreStats['average']))
+        print(f"Gen: {gen}, Best Score: {scoreStats['max']}, Avg Score: {scoreStats['average']}, Time: {str((time.time() - tStart)/3600)}")
+
+    vecEnv.close()
+
+    print('Time Taken (Hours): ' + str((time.time() - tStart)/3600))
+    print('Results:\nMin, Max, Avg')
+    for score in allScores:
+        print(score[0],score[1],score[2])
+
+    return trainer, allScores[-1]
+
 def runPopulation(envName="Boxing-v0", gens=1000, popSize=360, reps=3,
         frames=18000, nRandFrames=30):
     # get num actions
@@ -1,4 +1,5 @@
 from tpg.program import Program
+from tpg.serialization import saveFile, loadFile
 import pickle
 from random import random
 import time, math, random
@@ -21,9 +22,15 @@ class Agent:
     Gets an action from the root team of this agent / this agent.
     """
     def act(self, state, path_trace=None):
-        start_execution_time = time.time()*1000.0
+        start_execution_time = time.perf_counter()*1000.0
         self.actVars["frameNum"] = random()
         visited = list() #Create a new list to track visited team/learners each time
+
+        # A tpg.trace.DecisionTracer records the path itself, on sampled frames
+        if path_trace != None and not isinstance(path_trace, dict):
+            if not path_trace.startFrame():
+                path_trace = None
+            return self.team.act(state, visited=visited, actVars=self.actVars, path_trace=path_trace)
         
         result = None
         path = None
@@ -33,7 +40,7 @@ class Agent:
         else:
             result = self.team.act(state, visited=visited, actVars=self.actVars)
 
-        end_execution_time = time.time()*1000.0
+        end_execution_time = time.perf_counter()*1000.0
         execution_time = end_execution_time - start_execution_time
         if path_trace != None:
 
@@ -112,12 +119,24 @@ class Agent:
     Save the agent to the file, saving any relevant class values to the instance.
     """
     def saveToFile(self, fileName):
-        pickle.dump(self, open(fileName, 'wb'))
+        saveFile(self, fileName)
+
+    """
+    Save the agent as a snapshot file of its team's graph, see openSnapshot
+    (tpg.snapshot).
+    """
+    def saveSnapshot(self, fileName):
+        from tpg.snapshot import PopulationSnapshot
+        snapshot = PopulationSnapshot.fromTeams([self.team], [self.team],
+                        tasks=list(self.team.outcomes.keys()))
+        snapshot.saveToFile(fileName, meta={"functionsDict": self.functionsDict,
+            "actVars": self.actVars})
 
 """
 Load some agent from the file, returning it and repopulate class values.
+With useMmap instructions are mapped from the file rather than read.
 """
-def loadAgent(fileName):
-    agent = pickle.load(open(fileName, 'rb'))
+def loadAgent(fileName, useMmap=False):
+    agent = loadFile(fileName, useMmap=useMmap)
     agent.configFunctionsSelf()
     return agent
@@ -0,0 +1,199 @@
+from tpg.configuration.conf_program import ConfProgram
+from numba import njit
+import numpy as np
+
+"""
+Batched inference over many agents at once. A BatchActor holds one slot per
+agent, all reading the same population snapshot (see tpg.snapshot), and gets
+the actions of every slot for a batch of states in a single numba call, instead
+of going through Agent.act one agent and one python call at a time.
+"""
+
+"""
+Program execution functions usable for batched acting, by the name the trainer
+configured. Memory variants need the shared memory matrix, so aren't batched.
+"""
+EXECUTE_FUNCTIONS = {
+    "def": ConfProgram.execute_def,
+    "full": ConfProgram.execute_full,
+    "robo": ConfProgram.execute_robo,
+}
+
+"""
+Gets the action of each active slot by traversing the graph from its root team,
+like Team.act / Learner.bid do for a single agent. Each slot has its own
+registers for every learner, and a learner bids at most once per slot per call.
+Bids and visited teams (or learners if learnerTrav) are marked with stamp
+rather than cleared each call. Returns -1 for a slot that runs out of valid
+learners. If count, the bids computed by each learner are added to bidCounts,
+and the wins of each learner on each team to winCounts, by position in
+teamLearners.
+"""
+@njit
+def _batchAct(execute, roots, states, active, registers, bidStamps, visitedStamps,
+        stamp, learnerTrav, teamLearnerPtr, teamLearners, learnerActionCode,
+        learnerActionTeam, learnerNRegisters, learnerProgram, programPtr,
+        modes, ops, dsts, srcs, count, bidCounts, winCounts):
+    nSlots = len(roots)
+    actions = np.full(nSlots, -1, dtype=np.int64)
+
+    for k in range(nSlots):
+        if not active[k]:
+            continue
+
+        state = states[k]
+        team = roots[k]
+        while True:
+            if not learnerTrav:
+                visitedStamps[k, team] = stamp
+
+            # highest bidding valid learner, first one wins ties
+            best = -1
+            bestEdge = -1
+            bestBid = 0.0
+            for e in range(teamLearnerPtr[team], teamLearnerPtr[team+1]):
+                l = teamLearners[e]
+                actionTeam = learnerActionTeam[l]
+                if actionTeam >= 0:
+                    if learnerTrav:
+                        if visitedStamps[k, l] == stamp:
+                            continue
+                    elif visitedStamps[k, actionTeam] == stamp:
+                        continue
+
+                regs = registers[k, l, :learnerNRegisters[l]]
+                if bidStamps[k, l] != stamp:
+                    bidStamps[k, l] = stamp
+                    p = learnerProgram[l]
+                    start = programPtr[p]
+                    end = programPtr[p+1]
+                    execute(state, regs, modes[start:end], ops[start:end],
+                            dsts[start:end], srcs[start:end])
+                    if count:
+                        bidCounts[l] += 1
+
+                if best < 0 or regs[0] > bestBid:
+                    best = l
+                    bestEdge = e
+                    bestBid = regs[0]
+
+            if best < 0:
+                break # no valid learners, action stays -1
+
+            if count:
+                winCounts[bestEdge] += 1
+            if learnerTrav:
+                visitedStamps[k, best] = stamp
+
+            if learnerActionTeam[best] >= 0:
+                team = learnerActionTeam[best]
+            else:
+                actions[k] = learnerActionCode[best]
+                break
+
+    return actions
+
+"""
+Acts for a fixed number of agent slots over a population snapshot. Slots are
+assigned root teams by id, and keep their registers between calls to act until
+reassigned or zeroed, just like an agent's learners do. With counters (a
+tpg.counters.ExecutionCounters) the kernel counts bids and wins, which
+flushCounts adds to the counters.
+"""
+class BatchActor:
+
+    def __init__(self, snapshot, numSlots, functionsDict, counters=None):
+        if (functionsDict["Learner"]["bid"] not in ["def", "def_counted"]
+                or functionsDict["ActionObject"]["getAction"] != "def"
+                or functionsDict["Program"]["execute"] not in EXECUTE_FUNCTIONS):
+            raise Exception("Batched acting does not support memory or real actions",
+                functionsDict)
+
+        self.snapshot = snapshot
+        self.execute = EXECUTE_FUNCTIONS[functionsDict["Program"]["execute"]]
+        self.learnerTrav = functionsDict["Team"]["act"] == "learnerTrav"
+        self.numSlots = numSlots
+
+        instructions = snapshot.instructions
+        self.modes = np.ascontiguousarray(instructions[:,0])
+        self.ops = np.ascontiguousarray(instructions[:,1])
+        self.dsts = np.ascontiguousarray(instructions[:,2])
+        self.srcs = np.ascontiguousarray(instructions[:,3])
+
+        nLearners = snapshot.numLearners
+        maxRegisters = max(1, int(snapshot.learnerNRegisters.max(initial=0)))
+        self.roots = np.full(numSlots, -1, dtype=np.int64)
+        self.registers = np.zeros((numSlots, nLearners, maxRegisters))
+        self.bidStamps = np.zeros((numSlots, nLearners), dtype=np.int64)
+        self.visitedStamps = np.zeros((numSlots,
+            nLearners if self.learnerTrav else snapshot.numTeams), dtype=np.int64)
+        self.stamp = 0
+
+        self.counters = counters
+        self.bidCounts = np.zeros(nLearners if counters is not None else 0, dtype=np.int64)
+        self.winCounts = np.zeros(len(snapshot.teamLearners) if counters is not None else 0,
+                                  dtype=np.int64)
+
+    """
+    Puts the root team with the given id in the slot, with fresh registers.
+    """
+    def assign(self, slot, teamId):
+        root = self.snapshot.teamIndex(teamId)
+        if root < 0:
+            raise Exception("Team not in snapshot", teamId)
+        self.roots[slot] = root
+        self.zeroRegisters(slot)
+
+    def zeroRegisters(self, slot=None):
+        if slot is None:
+            self.registers[:] = 0
+        else:
+            self.registers[slot] = 0
+
+    """
+    Actions of every active slot (defaults to all assigned slots) for the
+    states, one row per slot. Inactive slots get -1.
+    """
+    def act(self, states, active=None):
+        if active is None:
+            active = self.roots >= 0
+        states = np.ascontiguousarray(states, dtype=np.float64)
+        self.stamp += 1
+
+        s = self.snapshot
+        actions = _batchAct(self.execute, self.roots, states,
+            np.asarray(active, dtype=np.bool_), self.registers, self.bidStamps,
+            self.visitedStamps, self.stamp, self.learnerTrav, s.teamLearnerPtr,
+            s.teamLearners, s.learnerActionCode, s.learnerActionTeam,
+            s.learnerNRegisters, s.learnerProgram, s.programPtr,
+            self.modes, self.ops, self.dsts, self.srcs,
+            self.counters is not None, self.bidCounts, self.winCounts)
+
+        if (actions[active] < 0).any():
+            raise Exception("No valid learners to act with", self.roots[actions < 0])
+
+        return actions
+
+    """
+    Adds the counts since the last flush to the counters.
+    """
+    def flushCounts(self):
+        if self.counters is None:
+            return
+
+        from tpg.snapshot import idFromBytes
+        s = self.snapshot
+        wins = np.bincount(s.teamLearners, weights=self.winCounts,
+                           minlength=s.numLearners).astype(np.int64)
+        won = np.flatnonzero(self.winCounts)
+        teams = np.searchsorted(s.teamLearnerPtr, won, side="right") - 1
+        teamWins = {(idFromBytes(s.teamIds[t]), idFromBytes(s.learnerIds[s.teamLearners[e]])):
+                        int(self.winCounts[e]) for t, e in zip(teams, won)}
+
+        counted = np.flatnonzero(self.bidCounts + wins)
+        self.counters.addCounts([idFromBytes(s.learnerIds[l]) for l in counted],
+            [s.instructions[s.programPtr[s.learnerProgram[l]]:s.programPtr[s.learnerProgram[l]+1]]
+                for l in counted],
+            self.bidCounts[counted], wins[counted], teamWins)
+        self.bidCounts[:] = 0
+        self.winCounts[:] = 0
@@ -0,0 +1,537 @@
+from tpg.evaluation import reachableTeams, buildProgram, buildLearner, buildTeam
+from tpg.snapshot import idFromBytes
+from tpg.trainer import Trainer
+from tpg.timings import PhaseTimer
+from tpg.counters import ExecutionCounters
+from tpg.graph_check import GraphChecker
+from tpg.graph_export import GraphRecorder
+from collections import namedtuple
+import numpy as np
+import hashlib
+import json
+import os
+import pickle
+import queue
+import threading
+import uuid
+
+"""
+Incremental checkpoints of a trainer. Programs are stored by the hash of their
+instructions, learners and teams by the hash of their whole record (so a team
+that changed gets stored again). Each checkpoint writes one segment, an npz
+file of flat arrays with only the objects no earlier segment has, plus the
+trainer itself without its population, and a small json manifest naming the
+objects the checkpoint is made of. Where each stored object is (segment and
+row) is kept in an index file next to them.
+"""
+
+NO_ID = bytes(16)
+
+"""
+What a checkpoint is made of, see CheckpointStore.capture.
+"""
+Capture = namedtuple("Capture", ["name", "generation", "shell", "learners", "teams",
+    "teamIds", "rootTeamIds", "learnerIds", "eliteIds"])
+
+def idBytes(objectId):
+    return NO_ID if objectId is None else objectId.bytes
+
+def digest(*parts):
+    h = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        h.update(part if isinstance(part, bytes) else repr(part).encode())
+    return h.digest()
+
+"""
+Flattens lists of 16 byte ids into CSR arrays.
+"""
+def idLists(lists):
+    ptr = np.zeros(len(lists) + 1, dtype=np.int64)
+    ptr[1:] = np.cumsum([len(ids) for ids in lists])
+    ids = np.array([i for ids in lists for i in ids], dtype="S16").reshape(-1)
+    return ptr, ids
+
+"""
+The trainer's state without its population, for the segment. Its diagnostics
+(graph checker, graph recorder, execution counters and phase timings) go in as
+freshly set up, their history would cost a pass over the population at every
+capture and isn't needed to go on evolving.
+"""
+def shellState(trainer):
+    state = dict(trainer.__dict__)
+    for key in ["teams", "rootTeams", "learners", "elites"]:
+        state[key] = []
+
+    if state.get("graphChecker") is not None:
+        state["graphChecker"] = GraphChecker()
+    recorder = state.get("graphRecorder")
+    if recorder is not None:
+        state["graphRecorder"] = GraphRecorder(recorder.prefix, fullEvery=recorder.fullEvery)
+    timings = state.get("timings")
+    if timings is not None:
+        state["timings"] = PhaseTimer(timings.enabled, maxHistory=timings.history.maxlen)
+    counters = state.get("counters")
+    if counters is not None:
+        state["counters"] = ExecutionCounters(counters.memOpCodes,
+            capacity=counters.counts.shape[1], maxHistory=counters.history.maxlen)
+        if "counters" in trainer.actVars:
+            state["actVars"] = dict(trainer.actVars, counters=state["counters"])
+
+    return state
+
+# the kinds of objects stored, with the segment array of their hashes
+INDEX_KEYS = [("programs", "programHash"), ("learners", "learnerHash"), ("teams", "teamHash")]
+
+def programHash(instructions):
+    instructions = np.ascontiguousarray(instructions, dtype=np.int32)
+    return digest(instructions.tobytes(), instructions.shape)
+
+"""
+Arrays of a segment file, each read from it the first time it is used.
+"""
+class SegmentArrays:
+
+    def __init__(self, path):
+        self.file = np.load(path)
+        self.arrays = {}
+
+    def __getitem__(self, key):
+        if key not in self.arrays:
+            self.arrays[key] = self.file[key]
+        return self.arrays[key]
+
+    def close(self):
+        self.file.close()
+
+class CheckpointStore:
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(os.path.join(directory, "segments"), exist_ok=True)
+        os.makedirs(os.path.join(directory, "manifests"), exist_ok=True)
+
+        # hash -> (segment name, row), of everything stored so far
+        self.index = {"programs": {}, "learners": {}, "teams": {}}
+        segmentNames = sorted(name[:-4] for name in
+            os.listdir(os.path.join(directory, "segments")) if name.endswith(".npz"))
+        if os.path.exists(self.indexPath()):
+            self.readIndex(set(segmentNames))
+        elif len(segmentNames) > 0:
+            # no index written yet, gathered from the segments once
+            for name in segmentNames:
+                with np.load(self.segmentPath(name)) as segment:
+                    for kind, key in INDEX_KEYS:
+                        for row, objectHash in enumerate(segment[key]):
+                            self.index[kind][bytes(objectHash).ljust(16, b"\0")] = (name, row)
+            self.writeIndex()
+
+    def segmentPath(self, name):
+        return os.path.join(self.directory, "segments", name + ".npz")
+
+    def manifestPath(self, name):
+        return os.path.join(self.directory, "manifests", name + ".json")
+
+    def indexPath(self):
+        return os.path.join(self.directory, "index.npz")
+
+    """
+    Reads the index, leaving out objects of segments no longer there.
+    """
+    def readIndex(self, segmentNames):
+        with np.load(self.indexPath()) as index:
+            names = [str(name) for name in index["segmentNames"]]
+            for kind, key in INDEX_KEYS:
+                for objectHash, segment, row in zip(index[key], index[key + "Segment"],
+                                                    index[key + "Row"]):
+                    if names[segment] in segmentNames:
+                        self.index[kind][bytes(objectHash).ljust(16, b"\0")] = (
+                            names[segment], int(row))
+
+    """
+    Writes the index, replacing the old one only once complete.
+    """
+    def writeIndex(self):
+        names = sorted(set(name for kind in self.index
+                            for name, row in self.index[kind].values()))
+        numbers = {name: i for i, name in enumerate(names)}
+        arrays = {"segmentNames": np.array(names, dtype=str)}
+        for kind, key in INDEX_KEYS:
+            entries = list(self.index[kind].items())
+            arrays[key] = np.array([h for h, where in entries], dtype="S16")
+            arrays[key + "Segment"] = np.array([numbers[where[0]] for h, where in entries],
+                                                dtype=np.int64)
+            arrays[key + "Row"] = np.array([where[1] for h, where in entries], dtype=np.int64)
+
+        tmpPath = self.indexPath() + ".tmp"
+        with open(tmpPath, "wb") as f:
+            np.savez(f, **arrays)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmpPath, self.indexPath())
+
+    """
+    Names of the stored checkpoints, oldest first by the generation they were
+    taken at (then by when they were written, for the same generation).
+    """
+    def manifests(self):
+        names = [name[:-5] for name in os.listdir(os.path.join(self.directory, "manifests"))
+                    if name.endswith(".json")]
+
+        def age(name):
+            with open(self.manifestPath(name)) as f:
+                generation = json.load(f)["generation"]
+            return generation, os.path.getmtime(self.manifestPath(name))
+
+        return sorted(names, key=age)
+
+    """
+    Checkpoints the trainer under the name (defaults to its generation), only
+    writing the programs, learners and teams not stored yet. Returns the name.
+    """
+    def save(self, trainer, name=None):
+        return self.write(self.capture(trainer, name))
+
+    """
+    Copies out what a checkpoint of the trainer needs, cheap enough to do at the
+    end of each generation. Instructions aren't copied, existing programs never
+    change (mutated programs are new ones). Nothing is hashed or written until
+    write, which may run in another thread while the trainer carries on.
+    """
+    def capture(self, trainer, name=None):
+        if name is None:
+            name = "gen-{}".format(trainer.generation)
+
+        teams = reachableTeams(trainer.teams + trainer.rootTeams + trainer.elites)
+        learners = {}
+        for learner in trainer.learners:
+            learners[learner.id] = learner
+        for team in teams:
+            for learner in team.learners:
+                learners[learner.id] = learner
+
+        learnerRecords = []
+        for learner in learners.values():
+            actionObj = learner.actionObj
+            actionProgram = getattr(actionObj, "program", None)
+            learnerRecords.append((idBytes(learner.id), idBytes(learner.program.id),
+                learner.program.instructions,
+                -1 if actionObj.actionCode is None else int(actionObj.actionCode),
+                NO_ID if actionObj.teamAction is None else idBytes(actionObj.teamAction.id),
+                len(learner.registers), learner.genCreate,
+                -1 if getattr(actionObj, "actionLength", None) is None else actionObj.actionLength,
+                NO_ID if actionProgram is None else idBytes(actionProgram.id),
+                None if actionProgram is None else actionProgram.instructions,
+                len(actionObj.registers) if hasattr(actionObj, "registers") else -1,
+                tuple(uuid.UUID(teamId).bytes for teamId in learner.inTeams)))
+
+        teamRecords = [(idBytes(team.id), team.genCreate,
+                np.nan if team.fitness is None else float(team.fitness),
+                tuple(idBytes(learner.id) for learner in team.learners),
+                tuple(uuid.UUID(learnerId).bytes for learnerId in team.inLearners))
+            for team in teams]
+
+        return Capture(name, trainer.generation, pickle.dumps(shellState(trainer)), learnerRecords,
+            teamRecords, [team.id.hex for team in trainer.teams],
+            [team.id.hex for team in trainer.rootTeams],
+            [learner.id.hex for learner in trainer.learners],
+            [team.id.hex for team in trainer.elites])
+
+    """
+    Writes a captured checkpoint, syncing it to disk. The manifest goes last, so
+    a checkpoint is either complete or not there at all.
+    """
+    def write(self, capture):
+        name = capture.name
+        newPrograms = {}
+        programHashes = set()
+        learnerHashes = []
+        newLearners = []
+        for captured in capture.learners:
+            pHash = programHash(captured[2])
+            aHash = NO_ID if captured[9] is None else programHash(captured[9])
+            for objectHash, instructions in [(pHash, captured[2]), (aHash, captured[9])]:
+                if instructions is None:
+                    continue
+                programHashes.add(objectHash)
+                if objectHash not in self.index["programs"]:
+                    newPrograms[objectHash] = instructions
+
+            record = captured[:2] + (pHash,) + captured[3:9] + (aHash,) + captured[10:]
+            learnerHash = digest(*record)
+            learnerHashes.append(learnerHash)
+            if learnerHash not in self.index["learners"]:
+                newLearners.append((learnerHash, record))
+
+        teamHashes = []
+        newTeams = []
+        for record in capture.teams:
+            teamHash = digest(*record)
+            teamHashes.append(teamHash)
+            if teamHash not in self.index["teams"]:
+                newTeams.append((teamHash, record))
+
+        shell = np.frombuffer(capture.shell, dtype=np.uint8)
+
+        segmentName = "{}-{}".format(name, uuid.uuid4().hex[:8])
+        programs = list(newPrograms.items())
+        programPtr = np.zeros(len(programs) + 1, dtype=np.int64)
+        programPtr[1:] = np.cumsum([len(p) for h, p in programs])
+        learnerInTeamsPtr, learnerInTeams = idLists([r[11] for h, r in newLearners])
+        teamLearnerPtr, teamLearners = idLists([r[3] for h, r in newTeams])
+        teamInLearnersPtr, teamInLearners = idLists([r[4] for h, r in newTeams])
+        segmentFile = open(self.segmentPath(segmentName), "wb")
+        np.savez(segmentFile, trainer=shell,
+            programHash=np.array([h for h, p in programs], dtype="S16"),
+            programPtr=programPtr,
+            instructions=np.concatenate([np.asarray(p, dtype=np.int32)
+                for h, p in programs] + [np.zeros((0, 4), dtype=np.int32)]),
+            learnerHash=np.array([h for h, r in newLearners], dtype="S16"),
+            learnerId=np.array([r[0] for h, r in newLearners], dtype="S16"),
+            learnerProgramId=np.array([r[1] for h, r in newLearners], dtype="S16"),
+            learnerProgramHash=np.array([r[2] for h, r in newLearners], dtype="S16"),
+            learnerActionCode=np.array([r[3] for h, r in newLearners], dtype=np.int64),
+            learnerActionTeam=np.array([r[4] for h, r in newLearners], dtype="S16"),
+            learnerNRegisters=np.array([r[5] for h, r in newLearners], dtype=np.int64),
+            learnerGen=np.array([r[6] for h, r in newLearners], dtype=np.int64),
+            learnerActionLength=np.array([r[7] for h, r in newLearners], dtype=np.int64),
+            learnerActionProgramId=np.array([r[8] for h, r in newLearners], dtype="S16"),
+            learnerActionProgramHash=np.array([r[9] for h, r in newLearners], dtype="S16"),
+            learnerNActRegisters=np.array([r[10] for h, r in newLearners], dtype=np.int64),
+            learnerInTeamsPtr=learnerInTeamsPtr, learnerInTeams=learnerInTeams,
+            teamHash=np.array([h for h, r in newTeams], dtype="S16"),
+            teamId=np.array([r[0] for h, r in newTeams], dtype="S16"),
+            teamGen=np.array([r[1] for h, r in newTeams], dtype=np.int64),
+            teamFitness=np.array([r[2] for h, r in newTeams], dtype=np.float64),
+            teamLearnerPtr=teamLearnerPtr, teamLearners=teamLearners,
+            teamInLearnersPtr=teamInLearnersPtr, teamInLearners=teamInLearners)
+        segmentFile.flush()
+        os.fsync(segmentFile.fileno())
+        segmentFile.close()
+
+        for row, (objectHash, program) in enumerate(programs):
+            self.index["programs"][objectHash] = (segmentName, row)
+        for row, (learnerHash, record) in enumerate(newLearners):
+            self.index["learners"][learnerHash] = (segmentName, row)
+        for row, (teamHash, record) in enumerate(newTeams):
+            self.index["teams"][teamHash] = (segmentName, row)
+        self.writeIndex()
+
+        segments = set([segmentName])
+        segments.update(self.index["programs"][h][0] for h in programHashes)
+        segments.update(self.index["learners"][h][0] for h in learnerHashes)
+        segments.update(self.index["teams"][h][0] for h in teamHashes)
+        manifest = {
+            "generation": capture.generation,
+            "trainer": segmentName,
+            "segments": sorted(segments),
+            "learners": [h.hex() for h in learnerHashes],
+            "teams": [h.hex() for h in teamHashes],
+            "teamIds": capture.teamIds,
+            "rootTeamIds": capture.rootTeamIds,
+            "learnerIds": capture.learnerIds,
+            "eliteIds": capture.eliteIds,
+        }
+        tmpPath = self.manifestPath(name) + ".tmp"
+        with open(tmpPath, "w") as f:
+            json.dump(manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmpPath, self.manifestPath(name))
+
+        return name
+
+    """
+    Deletes all but the keepLast newest checkpoints, except those of every
+    keepEvery-th generation, then any segments no remaining checkpoint uses.
+    """
+    def prune(self, keepLast=None, keepEvery=None):
+        names = self.manifests()
+        keep = set(names if keepLast is None else names[len(names)-keepLast:])
+        used = set()
+        for name in names:
+            with open(self.manifestPath(name)) as f:
+                manifest = json.load(f)
+            if name in keep or (keepEvery is not None
+                    and manifest["generation"] % keepEvery == 0):
+                used.update(manifest["segments"])
+            else:
+                os.remove(self.manifestPath(name))
+
+        removed = set()
+        for fileName in os.listdir(os.path.join(self.directory, "segments")):
+            segmentName = fileName[:-4]
+            if segmentName not in used:
+                os.remove(self.segmentPath(segmentName))
+                removed.add(segmentName)
+        if len(removed) > 0:
+            for kind in self.index:
+                self.index[kind] = {objectHash: where for objectHash, where
+                    in self.index[kind].items() if where[0] not in removed}
+            self.writeIndex()
+
+    """
+    Loads the trainer from the checkpoint with the name (defaults to the latest
+    one), with its functions configured.
+    """
+    def load(self, name=None):
+        if name is None:
+            names = self.manifests()
+            if len(names) == 0:
+                raise Exception("No checkpoints in", self.directory)
+            name = names[-1]
+
+        with open(self.manifestPath(name)) as f:
+            manifest = json.load(f)
+
+        # segments are only opened, and their arrays read, once needed
+        segments = {}
+
+        def openSegment(segmentName):
+            if segmentName not in segments:
+                segments[segmentName] = SegmentArrays(self.segmentPath(segmentName))
+            return segments[segmentName]
+
+        try:
+            return self.build(manifest, openSegment)
+        finally:
+            for arrays in segments.values():
+                arrays.close()
+
+    """
+    Builds the trainer of the manifest, openSegment giving the arrays of a
+    segment by name.
+    """
+    def build(self, manifest, openSegment):
+        def locate(kind, objectHash):
+            segmentName, row = self.index[kind][objectHash]
+            return openSegment(segmentName), row
+
+        def instructions(programHash):
+            segment, row = locate("programs", programHash)
+            start, end = segment["programPtr"][row], segment["programPtr"][row+1]
+            return np.array(segment["instructions"][start:end])
+
+        def idList(segment, ptrKey, idsKey, row):
+            start, end = segment[ptrKey][row], segment[ptrKey][row+1]
+            return [str(idFromBytes(i)) for i in segment[idsKey][start:end]]
+
+        teamRecords = []
+        teams = {}
+        for teamHash in manifest["teams"]:
+            segment, row = locate("teams", bytes.fromhex(teamHash))
+            team = buildTeam(idFromBytes(segment["teamId"][row]), int(segment["teamGen"][row]))
+            fitness = segment["teamFitness"][row]
+            team.fitness = None if np.isnan(fitness) else float(fitness)
+            team.inLearners = idList(segment, "teamInLearnersPtr", "teamInLearners", row)
+            teams[team.id] = team
+            teamRecords.append((team, segment, row))
+
+        learners = {}
+        for learnerHash in manifest["learners"]:
+            segment, row = locate("learners", bytes.fromhex(learnerHash))
+            get = lambda key: segment[key][row]
+            actionProgram = None
+            if bytes(get("learnerActionProgramHash")) != b"":
+                actionProgram = buildProgram(idFromBytes(get("learnerActionProgramId")),
+                    instructions(bytes(get("learnerActionProgramHash")).ljust(16, b"\0")))
+            learner = buildLearner(idFromBytes(get("learnerId")),
+                buildProgram(idFromBytes(get("learnerProgramId")),
+                    instructions(bytes(get("learnerProgramHash")).ljust(16, b"\0"))),
+                None if get("learnerActionCode") < 0 else int(get("learnerActionCode")),
+                int(get("learnerNRegisters")), int(get("learnerGen")),
+                None if get("learnerActionLength") < 0 else int(get("learnerActionLength")),
+                actionProgram,
+                None if get("learnerNActRegisters") < 0 else int(get("learnerNActRegisters")))
+            if bytes(get("learnerActionTeam")) != b"":
+                learner.actionObj.teamAction = teams[idFromBytes(get("learnerActionTeam"))]
+            learner.inTeams = idList(segment, "learnerInTeamsPtr", "learnerInTeams", row)
+            learners[learner.id] = learner
+
+        for team, segment, row in teamRecords:
+            start, end = segment["teamLearnerPtr"][row], segment["teamLearnerPtr"][row+1]
+            team.learners = [learners[idFromBytes(i)] for i in segment["teamLearners"][start:end]]
+
+        trainer = Trainer.__new__(Trainer)
+        trainer.__dict__.update(pickle.loads(openSegment(manifest["trainer"])["trainer"].tobytes()))
+        trainer.teams = [teams[uuid.UUID(i)] for i in manifest["teamIds"]]
+        trainer.rootTeams = [teams[uuid.UUID(i)] for i in manifest["rootTeamIds"]]
+        trainer.learners = [learners[uuid.UUID(i)] for i in manifest["learnerIds"]]
+        trainer.elites = [teams[uuid.UUID(i)] for i in manifest["eliteIds"]]
+        for team in trainer.teams:
+            trainer.outcomeStore.addTeam(team)
+        trainer.configFunctions()
+
+        return trainer
+
+"""
+Writes checkpoints in a background thread, so the generation loop only pays
+for capturing them. At-most maxPending captured checkpoints wait to be written,
+submit blocks beyond that. After each write, the store is pruned with keepLast
+and keepEvery (see CheckpointStore.prune). A failed write is raised from the
+next submit, flush or close.
+"""
+class CheckpointWriter:
+
+    def __init__(self, store, keepLast=None, keepEvery=None, maxPending=2):
+        self.store = store
+        self.keepLast = keepLast
+        self.keepEvery = keepEvery
+        self.queue = queue.Queue(maxsize=maxPending)
+        self.error = None
+        self.thread = threading.Thread(target=self.writeLoop, daemon=True)
+        self.thread.start()
+
+    def writeLoop(self):
+        while True:
+            capture = self.queue.get()
+            try:
+                if capture is None:
+                    return
+                if self.error is None:
+                    self.store.write(capture)
+                    self.store.prune(self.keepLast, self.keepEvery)
+            except Exception as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def raiseError(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise Exception("Checkpoint write failed", error)
+
+    """
+    Captures a checkpoint of the trainer now, to be written in the background.
+    """
+    def submit(self, trainer, name=None):
+        self.raiseError()
+        self.queue.put(self.store.capture(trainer, name))
+
+    """
+    Waits for every submitted checkpoint to be written.
+    """
+    def flush(self):
+        self.queue.join()
+        self.raiseError()
+
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        self.raiseError()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+"""
+Entry point for resuming a run, the trainer from the latest checkpoint in the
+directory, or None if there is none yet.
+"""
+def resume(directory):
+    store = CheckpointStore(directory)
+    if len(store.manifests()) == 0:
+        return None
+    return store.load()
@@ -1,4 +1,5 @@
 from tpg.program import Program
+from tpg.serialization import saveFile
 import pickle
 from random import random
 import time, math
@@ -22,9 +23,15 @@ class ConfAgent:
     """
     def act_def(self, state, path_trace=None):
 
-        start_execution_time = time.time()*1000.0
+        start_execution_time = time.perf_counter()*1000.0
         self.actVars["frameNum"] = random()
         visited = list() #Create a new list to track visited team/learners each time
+
+        # A tpg.trace.DecisionTracer records the path itself, on sampled frames
+        if path_trace != None and not isinstance(path_trace, dict):
+            if not path_trace.startFrame():
+                path_trace = None
+            return self.team.act(state, visited=visited, actVars=self.actVars, path_trace=path_trace)
         
         result = None
         path = None
@@ -34,7 +41,7 @@ class ConfAgent:
         else:
             result = self.team.act(state, visited=visited, actVars=self.actVars)
 
-        end_execution_time = time.time()*1000.0
+        end_execution_time = time.perf_counter()*1000.0
         execution_time = end_execution_time - start_execution_time
         if path_trace != None:
 
@@ -62,4 +69,4 @@ class ConfAgent:
     Save the agent to the file, saving any relevant class values to the instance.
     """
     def saveToFile_def(self, fileName):
-        pickle.dump(self, open(fileName, 'wb'))
+        saveFile(self, fileName)
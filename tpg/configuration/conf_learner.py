@@ -94,6 +94,20 @@ class ConfLearner:
     def getAction_def(self, state, visited, actVars=None, path_trace=None):
         return self.actionObj.getAction(state, visited, actVars=actVars, path_trace=path_trace)
 
+    """
+    Bid variants that also count the bid in actVars["counters"] (a
+    tpg.counters.ExecutionCounters), when the program actually runs.
+    """
+    def bid_def_counted(self, state, actVars=None):
+        if self.frameNum != actVars["frameNum"]:
+            actVars["counters"].countBid(self)
+        return ConfLearner.bid_def(self, state, actVars=actVars)
+
+    def bid_mem_counted(self, state, actVars=None):
+        if self.frameNum != actVars["frameNum"]:
+            actVars["counters"].countBid(self)
+        return ConfLearner.bid_mem(self, state, actVars=actVars)
+
 
 
     """
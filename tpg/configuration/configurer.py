@@ -230,3 +230,19 @@ Switch to learner traversal.
 def configureLearnerTraversal(trainer, Agent, Team, actVarKeys, actVarVals):
     Team.act = ConfTeam.act_learnerTrav
     trainer.functionsDict["Team"]["act"] = "learnerTrav"
+
+"""
+Switch counting learner executions (see tpg.counters) on or off. The counters
+are passed to the learners through actVars, teams count the wins in act.
+"""
+def configureCounting(trainer, Learner, doCount):
+    functionsDict = trainer.functionsDict["Learner"]
+    bid = functionsDict["bid"].replace("_counted", "")
+    if doCount:
+        functionsDict["bid"] = bid + "_counted"
+        trainer.actVars["counters"] = trainer.counters
+    else:
+        functionsDict["bid"] = bid
+        trainer.actVars.pop("counters", None)
+
+    Learner.configFunctions(functionsDict)
@@ -0,0 +1,69 @@
+from tpg.utils import getTeams, getLearners
+from collections import OrderedDict, deque
+import numpy as np
+
+"""
+Predicts how long evaluating a root team will take, for scheduling the most
+expensive evaluations first. Predictions come from a least squares fit of past
+evaluation times against the size of each team's reachable graph, or from the
+time the team itself took before if it was evaluated already.
+"""
+
+"""
+Features of the graph reachable from the team that drive the cost of acting:
+a constant, the number of teams, learners and instructions in it.
+"""
+def graphFeatures(team):
+    learners = getLearners(team)
+    numInstructions = sum(len(learner.program.instructions) for learner in learners)
+    return np.array([1.0, len(getTeams(team)), len(learners), numInstructions])
+
+class CostModel:
+
+    def __init__(self, historySize=2000):
+        self.features = deque(maxlen=historySize)
+        self.seconds = deque(maxlen=historySize)
+        self.observed = OrderedDict() # team id -> seconds of its last evaluation
+        self.historySize = historySize
+        self.coefs = None
+
+    """
+    Records how long evaluating a team with the given features took.
+    """
+    def record(self, teamId, features, seconds):
+        self.features.append(features)
+        self.seconds.append(seconds)
+        self.observed[teamId] = seconds
+        self.observed.move_to_end(teamId)
+        while len(self.observed) > self.historySize:
+            self.observed.popitem(last=False)
+
+    """
+    Refits the model to the recorded history. Until there is enough history the
+    instruction count alone stands in as the cost.
+    """
+    def fit(self):
+        if len(self.seconds) == 0 or len(self.seconds) <= len(self.features[0]):
+            self.coefs = None
+            return
+
+        X = np.array(self.features)
+        y = np.array(self.seconds)
+        self.coefs = np.linalg.lstsq(X, y, rcond=None)[0]
+
+    """
+    Predicted seconds to evaluate each of the teams with the given features.
+    """
+    def predict(self, teamIds, features):
+        features = np.asarray(features, dtype=np.float64).reshape(len(teamIds), -1)
+        if self.coefs is None:
+            costs = features[:,3].copy()
+        else:
+            # a cost is never below the cheapest seen
+            costs = np.maximum(features @ self.coefs, min(self.seconds))
+
+        for i, teamId in enumerate(teamIds):
+            if teamId in self.observed:
+                costs[i] = self.observed[teamId]
+
+        return costs
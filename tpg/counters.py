@@ -0,0 +1,146 @@
+from collections import deque
+import numpy as np
+
+"""
+Counts of how learners get executed while acting. Every learner that bids gets
+a row, like in the outcome store, of the counters:
+    bids: bids computed (cached re-bids in the same frame don't count).
+    wins: bids won, i.e. the learner's action was taken.
+    instructions: instructions executed for its bids.
+    memOps: memory reads and writes among those instructions.
+Wins are also counted per team the learner won on, in teamWins.
+"""
+
+FIELDS = ["bids", "wins", "instructions", "memOps"]
+
+class ExecutionCounters:
+
+    def __init__(self, memOpCodes=(), capacity=256, maxHistory=1):
+        self.memOpCodes = np.array(memOpCodes, dtype=np.int32)
+        self.rows = {} # learner id -> row
+        self.ids = [] # learner id of each row
+        self.counts = np.zeros((len(FIELDS), capacity), dtype=np.int64)
+        # instructions and memory ops per bid of each row
+        self.costs = np.zeros((2, capacity), dtype=np.int64)
+        self.teamWins = {} # (team id, learner id) -> wins of the learner on the team
+        self.history = deque(maxlen=maxHistory)
+
+    """
+    Row of the learner, given one if it has none yet.
+    """
+    def row(self, learner):
+        row = self.rows.get(learner.id)
+        if row is None:
+            row = self.addRow(learner.id, learner.program.instructions)
+        return row
+
+    def addRow(self, learnerId, instructions):
+        row = self.newRow(learnerId)
+        self.costs[0, row] = len(instructions)
+        self.costs[1, row] = np.isin(instructions[:,1], self.memOpCodes).sum()
+        return row
+
+    def newRow(self, learnerId):
+        row = self.rows[learnerId] = len(self.ids)
+        self.ids.append(learnerId)
+        if row == self.counts.shape[1]:
+            self.counts = np.hstack((self.counts, np.zeros_like(self.counts)))
+            self.costs = np.hstack((self.costs, np.zeros_like(self.costs)))
+        return row
+
+    def countBid(self, learner):
+        row = self.row(learner)
+        counts = self.counts
+        counts[0, row] += 1
+        counts[2, row] += self.costs[0, row]
+        counts[3, row] += self.costs[1, row]
+
+    def countWin(self, learner, team):
+        self.counts[1, self.row(learner)] += 1
+        key = (team.id, learner.id)
+        self.teamWins[key] = self.teamWins.get(key, 0) + 1
+
+    """
+    Adds counts gathered elsewhere (e.g. by a tpg.batch.BatchActor), one entry
+    per learner id for each of bids and wins, and teamWins like self.teamWins.
+    Instructions and memory ops are derived from the bids.
+    """
+    def addCounts(self, learnerIds, instructions, bids, wins, teamWins=None):
+        for learnerId, program, numBids, numWins in zip(learnerIds, instructions, bids, wins):
+            if numBids == 0 and numWins == 0:
+                continue
+            row = self.rows.get(learnerId)
+            if row is None:
+                row = self.addRow(learnerId, program)
+            self.counts[0, row] += numBids
+            self.counts[1, row] += numWins
+            self.counts[2, row] += numBids*self.costs[0, row]
+            self.counts[3, row] += numBids*self.costs[1, row]
+        if teamWins is not None:
+            self.addTeamWins(teamWins)
+
+    def addTeamWins(self, teamWins):
+        for key, wins in teamWins.items():
+            self.teamWins[key] = self.teamWins.get(key, 0) + wins
+
+    """
+    The counts so far in a picklable form, for merge to add to other counters
+    (e.g. from an evaluation worker to the trainer's).
+    """
+    def export(self):
+        numRows = len(self.ids)
+        return (list(self.ids), self.costs[:, :numRows].copy(),
+                self.counts[:, :numRows].copy(), dict(self.teamWins))
+
+    def merge(self, exported):
+        learnerIds, costs, counts, teamWins = exported
+        for i, learnerId in enumerate(learnerIds):
+            row = self.rows.get(learnerId)
+            if row is None:
+                row = self.newRow(learnerId)
+                self.costs[:, row] = costs[:, i]
+            self.counts[:, row] += counts[:, i]
+        self.addTeamWins(teamWins)
+
+    """
+    Counts of each of the learners as a matrix, one row per learner and one
+    column per field (see FIELDS). Learners that never bid count 0.
+    """
+    def read(self, learners):
+        counts = np.zeros((len(learners), len(FIELDS)), dtype=np.int64)
+        for i, learner in enumerate(learners):
+            row = self.rows.get(learner.id)
+            if row is not None:
+                counts[i] = self.counts[:, row]
+        return counts
+
+    """
+    Counts of the learners at one of FIELDS.
+    """
+    def column(self, learners, field):
+        return self.read(learners)[:, FIELDS.index(field)]
+
+    """
+    Wins of each of the team's learners on that team.
+    """
+    def teamWinCounts(self, team):
+        return np.array([self.teamWins.get((team.id, learner.id), 0)
+                            for learner in team.learners], dtype=np.int64)
+
+    """
+    Zeroes all counts and forgets all learners.
+    """
+    def reset(self):
+        self.rows = {}
+        self.ids = []
+        self.counts[:] = 0
+        self.teamWins = {}
+
+    """
+    Keeps the counts of the learners over the generation in history, as
+    (generation, learner ids, counts as in read), then resets.
+    """
+    def endGeneration(self, generation, learners):
+        self.history.append((generation, [learner.id for learner in learners],
+            self.read(learners)))
+        self.reset()
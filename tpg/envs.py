@@ -0,0 +1,246 @@
+import numpy as np
+import os
+import random
+
+"""
+Small environment helpers that don't need gym. Environments follow the same
+(old gym) interface as used in extras.py: reset() returns the state, and
+step(action) returns (state, reward, isDone, debug).
+"""
+
+"""
+Discrete action space with n actions.
+"""
+class Discrete:
+
+    def __init__(self, n, seed=None):
+        self.n = n
+        self.rng = np.random.default_rng(seed)
+
+    def sample(self):
+        return int(self.rng.integers(self.n))
+
+"""
+Cheap stand-in environment for testing and benchmarking evaluation. Every
+episode is the same fixed stream of random states (given the seed), each
+action is written into the next state so the agent affects what it sees, and
+the reward is 1 whenever the action matches the index of the largest of the
+first numActions inputs.
+"""
+class SyntheticEnv:
+
+    def __init__(self, inputSize=16, numActions=4, episodeLength=100, seed=0):
+        self.inputSize = inputSize
+        self.episodeLength = episodeLength
+        self.action_space = Discrete(numActions, seed=seed)
+        self.stream = np.random.default_rng(seed).random((episodeLength + 1, inputSize))
+        self.targets = np.argmax(self.stream[:, :numActions], axis=1)
+        self.frame = 0
+        self.state = None
+
+    def reset(self):
+        self.frame = 0
+        self.state = self.stream[0].copy()
+        return self.state
+
+    def step(self, action):
+        reward = 1.0 if action == self.targets[self.frame] else 0.0
+        self.frame += 1
+        self.state = self.stream[self.frame].copy()
+        self.state[self.frame % self.inputSize] = action
+        return self.state, reward, self.frame >= self.episodeLength, {}
+
+    def cloneState(self):
+        return (self.frame, self.state.copy())
+
+    def restoreState(self, envState):
+        self.frame, state = envState
+        self.state = state.copy()
+
+    def close(self):
+        pass
+
+"""
+Runs a number of environments side by side, stepping any subset of them
+together. envFns are functions each creating one environment, e.g.
+lambda: gym.make(envName).
+"""
+class VectorEnv:
+
+    def __init__(self, envFns):
+        self.envs = [fn() for fn in envFns]
+        self.numEnvs = len(self.envs)
+        self.action_space = self.envs[0].action_space
+
+    """
+    Resets the environment at index, or all of them (returning a list of states).
+    """
+    def reset(self, index=None):
+        if index is None:
+            return [env.reset() for env in self.envs]
+        return self.envs[index].reset()
+
+    """
+    Steps every environment flagged in active (defaults to all) with its action.
+    Returns lists of states and debug info, and arrays of rewards and dones,
+    inactive environments get None states, 0 reward and are not done.
+    """
+    def step(self, actions, active=None):
+        if active is None:
+            active = np.ones(self.numEnvs, dtype=bool)
+
+        states = [None]*self.numEnvs
+        rewards = np.zeros(self.numEnvs)
+        dones = np.zeros(self.numEnvs, dtype=bool)
+        debugs = [None]*self.numEnvs
+        for i in np.flatnonzero(active):
+            states[i], rewards[i], dones[i], debugs[i] = self.envs[i].step(actions[i])
+
+        return states, rewards, dones, debugs
+
+    """
+    Random action for the environment at index.
+    """
+    def sample(self, index):
+        return self.envs[index].action_space.sample()
+
+    def close(self):
+        for env in self.envs:
+            env.close()
+
+"""
+Keeps environments around for reuse instead of creating and closing one for
+every agent, which is slow for things like ALE. factory(key) creates a new
+environment for the key (e.g. gym.make with an environment name). Acquired
+environments are not reset, the caller must reset before each episode as usual.
+At most maxIdle released environments are kept per key, the rest are closed.
+"""
+class EnvPool:
+
+    def __init__(self, factory, maxIdle=1):
+        self.factory = factory
+        self.maxIdle = maxIdle
+        self.idle = {} # key -> released environments
+        self.numCreated = 0
+
+    """
+    Gets an environment for the key, reusing a released one if possible.
+    """
+    def acquire(self, key):
+        idle = self.idle.get(key)
+        if idle:
+            return idle.pop()
+
+        self.numCreated += 1
+        return self.factory(key)
+
+    """
+    Gives the environment back for reuse. Environments in an unknown state (e.g.
+    after an error) should be discarded instead.
+    """
+    def release(self, key, env):
+        idle = self.idle.setdefault(key, [])
+        if len(idle) < self.maxIdle:
+            idle.append(env)
+        else:
+            env.close()
+
+    def discard(self, env):
+        env.close()
+
+    """
+    Closes all of the idle environments.
+    """
+    def close(self):
+        for idle in self.idle.values():
+            for env in idle:
+                env.close()
+        self.idle = {}
+
+_processPools = {} # factory -> EnvPool, for this process
+_processPoolsPid = None
+
+"""
+The environment pool of this process for the factory, created the first time.
+Forked processes get their own rather than sharing the parent's environments.
+"""
+def processEnvPool(factory):
+    global _processPools, _processPoolsPid
+    if _processPoolsPid != os.getpid():
+        _processPools = {}
+        _processPoolsPid = os.getpid()
+
+    if factory not in _processPools:
+        _processPools[factory] = EnvPool(factory)
+
+    return _processPools[factory]
+
+"""
+Snapshot of the emulator state of env, or None if it can't be cloned. Supports
+ALE's clone_state / restore_state and the older cloneState / restoreState.
+"""
+def cloneEnvState(env):
+    base = getattr(env, "unwrapped", env)
+    if hasattr(base, "clone_state"):
+        return base.clone_state()
+    if hasattr(base, "cloneState"):
+        return base.cloneState()
+    return None
+
+def restoreEnvState(env, envState):
+    base = getattr(env, "unwrapped", env)
+    if hasattr(base, "restore_state"):
+        base.restore_state(envState)
+    else:
+        base.restoreState(envState)
+
+"""
+Pool of episode start states after nRandFrames random warmup frames. The first
+size episodes do the warmup for real and save where they ended up, later
+episodes start from a randomly chosen saved state, skipping the warmup. For
+environments that can't be cloned every episode just does the warmup.
+"""
+class StartStateCache:
+
+    def __init__(self, nRandFrames, size=32, seed=None):
+        self.nRandFrames = nRandFrames
+        self.size = size
+        self.starts = [] # (env state, state observed)
+        self.rng = random.Random(seed)
+
+    """
+    Resets env and brings it to a post warmup state, returning the state to act on.
+    """
+    def start(self, env):
+        state = env.reset() # also resets any wrapper bookkeeping
+        if len(self.starts) >= self.size:
+            envState, state = self.rng.choice(self.starts)
+            restoreEnvState(env, envState)
+            return np.array(state)
+
+        for i in range(self.nRandFrames):
+            state, reward, isDone, debug = env.step(env.action_space.sample())
+            if isDone:
+                return env.reset() # don't keep dead starts
+
+        envState = cloneEnvState(env)
+        if envState is not None:
+            self.starts.append((envState, np.array(state)))
+        return state
+
+_processStartCaches = {} # (key, nRandFrames) -> StartStateCache, for this process
+_processStartCachesPid = None
+
+"""
+The start state cache of this process for the key (e.g. environment name).
+"""
+def processStartStateCache(key, nRandFrames, size=32):
+    global _processStartCaches, _processStartCachesPid
+    if _processStartCachesPid != os.getpid():
+        _processStartCaches = {}
+        _processStartCachesPid = os.getpid()
+
+    if (key, nRandFrames) not in _processStartCaches:
+        _processStartCaches[(key, nRandFrames)] = StartStateCache(nRandFrames, size)
+
+    return _processStartCaches[(key, nRandFrames)]
@@ -0,0 +1,989 @@
+from tpg.agent import Agent
+from tpg.team import Team
+from tpg.learner import Learner
+from tpg.action_object import ActionObject
+from tpg.program import Program
+from tpg.utils import getLearners
+from tpg.cost_model import graphFeatures
+from tpg.serialization import sendObject, recvObject, pickleForSend
+from collections import namedtuple, deque
+from multiprocessing.connection import wait, Listener, Client
+from multiprocessing import resource_tracker
+import multiprocessing as mp
+import numpy as np
+import time
+import traceback
+
+"""
+Evaluation engine with long lived worker processes. Each worker holds a replica
+of the population, after each generation the workers only receive the delta
+(new and removed teams, learners and programs), and evaluation tasks are just
+root team ids. Alternatively the workers attach to a shared memory snapshot of
+the population (see tpg.snapshot) and build agents from it on demand.
+"""
+
+"""
+Flat records of the population objects, references to other objects are ids.
+"""
+ProgramRecord = namedtuple("ProgramRecord", ["id", "instructions"])
+LearnerRecord = namedtuple("LearnerRecord", ["id", "programId", "actionCode",
+    "actionTeamId", "nRegisters", "genCreate", "actionLength", "actionInstructions",
+    "nActRegisters"])
+TeamRecord = namedtuple("TeamRecord", ["id", "learnerIds", "genCreate"])
+PopulationDelta = namedtuple("PopulationDelta", ["programs", "learners", "teams",
+    "removedPrograms", "removedLearners", "removedTeams"])
+
+"""
+Result of evaluating one root team, outcomes is a dict of task to score. Status
+is COMPLETED, or TIMED_OUT / FAILED with empty outcomes, detail saying why.
+With counting on (see Trainer.setCounting), counts are the worker's execution
+counts for the evaluation (from ExecutionCounters.export).
+"""
+COMPLETED = "completed"
+TIMED_OUT = "timed out"
+FAILED = "failed"
+EvalResult = namedtuple("EvalResult", ["teamId", "outcomes", "seconds", "status",
+    "detail", "counts"], defaults=(COMPLETED, None, None))
+
+"""
+Returns all teams reachable from the given teams (including them).
+"""
+def reachableTeams(teams):
+    result = {}
+    stack = list(teams)
+    while len(stack) > 0:
+        team = stack.pop()
+        if team.id in result:
+            continue
+        result[team.id] = team
+        for learner in team.learners:
+            if not learner.isActionAtomic():
+                stack.append(learner.getActionTeam())
+
+    return list(result.values())
+
+def encodeProgram(program):
+    return ProgramRecord(program.id, program.instructions)
+
+def encodeLearner(learner):
+    actionObj = learner.actionObj
+    actionProgram = getattr(actionObj, "program", None)
+    return LearnerRecord(learner.id, learner.program.id,
+        actionObj.actionCode if actionObj.isAtomic() else None,
+        None if actionObj.isAtomic() else actionObj.teamAction.id,
+        len(learner.registers), learner.genCreate,
+        getattr(actionObj, "actionLength", None),
+        None if actionProgram is None else actionProgram.instructions,
+        len(actionObj.registers) if hasattr(actionObj, "registers") else None)
+
+def encodeTeam(team):
+    return TeamRecord(team.id, tuple(learner.id for learner in team.learners),
+        team.genCreate)
+
+"""
+Creates bare population objects without going through the (configurable)
+constructors, which assign new ids and wire up references. Only the attributes
+needed to act are set.
+"""
+def buildProgram(programId, instructions):
+    program = Program.__new__(Program)
+    program.instructions = instructions
+    program.id = programId
+    return program
+
+def buildLearner(learnerId, program, actionCode, nRegisters, genCreate,
+        actionLength=None, actionProgram=None, nActRegisters=None):
+    actionObj = ActionObject.__new__(ActionObject)
+    actionObj.actionCode = actionCode
+    actionObj.teamAction = None # linked up after all teams exist
+    if actionProgram is not None:
+        actionObj.actionLength = actionLength
+        actionObj.program = actionProgram
+        actionObj.registers = np.zeros(nActRegisters)
+
+    learner = Learner.__new__(Learner)
+    learner.program = program
+    learner.actionObj = actionObj
+    learner.registers = np.zeros(nRegisters, dtype=float)
+    learner.ancestor = None
+    learner.states = []
+    learner.inTeams = []
+    learner.genCreate = genCreate
+    learner.frameNum = 0
+    learner.id = learnerId
+    return learner
+
+def buildTeam(teamId, genCreate):
+    team = Team.__new__(Team)
+    team.learners = []
+    team.outcomes = {}
+    team.fitness = None
+    team.inLearners = []
+    team.id = teamId
+    team.genCreate = genCreate
+    return team
+
+"""
+Whether an agent is statistically out of the race against the survival cutoff
+(see Trainer.getSurvivalCutoff) after the episodes so far, so the rest of its
+episodes can be skipped. Out once at-least minEpisodes were played and the
+mean episode score plus confidence standard errors is still below the cutoff.
+"""
+def outOfRace(episodeScores, cutoff, minEpisodes=2, confidence=2.0):
+    n = len(episodeScores)
+    if cutoff is None or n < max(1, minEpisodes):
+        return False
+
+    scores = np.asarray(episodeScores, dtype=np.float64)
+    stdErr = scores.std(ddof=1)/np.sqrt(n) if n > 1 else 0.0
+    return scores.mean() + confidence*stdErr < cutoff
+
+"""
+Sets the functions of all tpg classes, as configured by some trainer.
+"""
+def configFunctions(functionsDict):
+    Agent.configFunctions(functionsDict["Agent"])
+    Team.configFunctions(functionsDict["Team"])
+    Learner.configFunctions(functionsDict["Learner"])
+    ActionObject.configFunctions(functionsDict["ActionObject"])
+    Program.configFunctions(functionsDict["Program"])
+
+"""
+Trainer side bookkeeping of what the workers already have, to produce the
+delta for the next sync.
+"""
+class PopulationSync:
+
+    def __init__(self):
+        self.programIds = set()
+        self.learnerIds = set()
+        self.teamLearners = {} # team id -> learner ids last sent
+
+    """
+    Returns the delta bringing a replica from the last synced population to the
+    population reachable from the given teams, and marks it as synced.
+    """
+    def delta(self, teams):
+        teams = reachableTeams(teams)
+        learners = {}
+        for team in teams:
+            for learner in team.learners:
+                learners[learner.id] = learner
+
+        # learners and programs never change once in the population, teams can
+        # lose learners (e.g. hitchhiker removal) so get resent if changed
+        newTeams = [encodeTeam(team) for team in teams
+            if self.teamLearners.get(team.id) != tuple(learner.id for learner in team.learners)]
+        newLearners = [encodeLearner(learner) for learner in learners.values()
+            if learner.id not in self.learnerIds]
+        newPrograms = [encodeProgram(learner.program) for learner in learners.values()
+            if learner.program.id not in self.programIds]
+
+        teamIds = set(team.id for team in teams)
+        learnerIds = set(learners)
+        programIds = set(learner.program.id for learner in learners.values())
+
+        delta = PopulationDelta(newPrograms, newLearners, newTeams,
+            list(self.programIds - programIds), list(self.learnerIds - learnerIds),
+            list(set(self.teamLearners) - teamIds))
+
+        self.programIds = programIds
+        self.learnerIds = learnerIds
+        for teamId in delta.removedTeams:
+            del self.teamLearners[teamId]
+        for record in newTeams:
+            self.teamLearners[record.id] = record.learnerIds
+
+        return delta
+
+"""
+Worker side copy of the population, built up from deltas.
+"""
+class PopulationReplica:
+
+    def __init__(self):
+        self.programs = {}
+        self.learners = {}
+        self.teams = {}
+
+    def applyDelta(self, delta):
+        for programId in delta.removedPrograms:
+            self.programs.pop(programId, None)
+        for learnerId in delta.removedLearners:
+            self.learners.pop(learnerId, None)
+        for teamId in delta.removedTeams:
+            self.teams.pop(teamId, None)
+
+        for record in delta.programs:
+            self.programs[record.id] = buildProgram(record.id, record.instructions)
+
+        for record in delta.teams:
+            if record.id not in self.teams:
+                self.teams[record.id] = buildTeam(record.id, record.genCreate)
+
+        for record in delta.learners:
+            actionProgram = None
+            if record.actionInstructions is not None:
+                actionProgram = buildProgram(None, record.actionInstructions)
+            self.learners[record.id] = buildLearner(record.id,
+                self.programs[record.programId], record.actionCode, record.nRegisters,
+                record.genCreate, record.actionLength, actionProgram, record.nActRegisters)
+
+        # link everything up now that all objects exist
+        for record in delta.learners:
+            if record.actionTeamId is not None:
+                self.learners[record.id].actionObj.teamAction = self.teams[record.actionTeamId]
+        for record in delta.teams:
+            self.teams[record.id].learners = [self.learners[learnerId]
+                                                for learnerId in record.learnerIds]
+
+    """
+    Gets an agent for the root team, with fresh registers as if it had just
+    been sent over from the trainer.
+    """
+    def getAgent(self, teamId, functionsDict, actVars, num=0):
+        team = self.teams[teamId]
+        for learner in getLearners(team):
+            learner.zeroRegisters()
+            learner.frameNum = 0
+
+        return Agent(team, functionsDict, num=num, actVars=freshActVars(actVars))
+
+"""
+Copy of actVars with its own copy of any arrays (e.g. the memory matrix), so
+agents evaluated in the same process don't share state.
+"""
+def freshActVars(actVars):
+    return {key: (np.array(val) if isinstance(val, np.ndarray) else val)
+                for key, val in actVars.items()}
+
+"""
+Evaluates the root teams on the environments of vecEnv (a tpg.envs.VectorEnv) in
+lockstep, one team per environment at a time. Each step the states of all
+environments are batched into a single act call, then all environments step
+together. A team plays numEpisodes episodes of at most numFrames frames, the
+first nRandFrames of each being random actions, and scores its average episode
+reward at task. With a cutoff, teams that are out of the race (see outOfRace)
+stop early with the average of the episodes played. With a startCache
+(tpg.envs.StartStateCache) episodes start from cached post warmup states
+instead of playing the random frames. States go through stateFunc first if
+given. Returns a list of EvalResult in completion order,
+usable with Trainer.applyScores.
+"""
+def evaluateLockstep(trainer, teams, vecEnv, numEpisodes, numFrames, task,
+        nRandFrames=0, stateFunc=None, cutoff=None, minEpisodes=2, confidence=2.0,
+        startCache=None):
+    from tpg.batch import BatchActor
+
+    snapshot = trainer.publishSnapshot(shared=False)
+    numSlots = vecEnv.numEnvs
+    actor = BatchActor(snapshot, numSlots, trainer.functionsDict,
+                       counters=trainer.actVars.get("counters"))
+    prepare = (lambda state: state) if stateFunc is None else stateFunc
+
+    pending = list(teams)
+    pending.reverse() # pop from the end in the original order
+    slotTeams = [None]*numSlots
+    active = np.zeros(numSlots, dtype=bool)
+    frames = np.zeros(numSlots, dtype=np.int64) # frames into current episode
+    scores = np.zeros(numSlots) # reward in the current episode
+    episodeScores = [[] for slot in range(numSlots)]
+    starts = np.zeros(numSlots)
+    states = None
+    results = []
+
+    # reset the slot's environment for a new episode, returning the first state
+    def startEpisode(slot):
+        scores[slot] = 0
+        if startCache is None:
+            frames[slot] = 0
+            return prepare(vecEnv.reset(slot))
+        frames[slot] = nRandFrames
+        return prepare(startCache.start(vecEnv.envs[slot]))
+
+    # give the slot the next team and start its first episode
+    def nextTeam(slot):
+        nonlocal states
+        if len(pending) == 0:
+            active[slot] = False
+            return
+        slotTeams[slot] = pending.pop()
+        actor.assign(slot, slotTeams[slot].id)
+        active[slot] = True
+        episodeScores[slot] = []
+        starts[slot] = time.perf_counter()
+        state = startEpisode(slot)
+        if states is None:
+            states = np.zeros((numSlots, len(state)))
+        states[slot] = state
+
+    for slot in range(numSlots):
+        nextTeam(slot)
+
+    while active.any():
+        # agents don't see the random frames
+        randoms = active & (frames < nRandFrames)
+        actions = actor.act(states, active & ~randoms)
+        for slot in np.flatnonzero(randoms):
+            actions[slot] = vecEnv.sample(slot)
+
+        newStates, rewards, dones, _ = vecEnv.step(actions.tolist(), active)
+        frames[active] += 1
+        # random frames don't count towards the score or end the episode
+        scores[active & ~randoms] += rewards[active & ~randoms]
+        dones &= ~randoms
+
+        for slot in np.flatnonzero(active):
+            states[slot] = prepare(newStates[slot])
+            if not dones[slot] and frames[slot] < numFrames:
+                continue
+
+            episodeScores[slot].append(scores[slot])
+            if (len(episodeScores[slot]) < numEpisodes
+                    and not outOfRace(episodeScores[slot], cutoff, minEpisodes, confidence)):
+                states[slot] = startEpisode(slot)
+                continue
+
+            results.append(EvalResult(slotTeams[slot].id,
+                {task: float(np.mean(episodeScores[slot]))}, time.perf_counter() - starts[slot]))
+            nextTeam(slot)
+
+    actor.flushCounts()
+    return results
+
+"""
+Main loop of an evaluation worker, talks to the trainer side through conn.
+Messages are tuples starting with their kind:
+    ("setup", functionsDict, actVars, evalFunc, evalArgs)
+    ("kwargs", evalKwargs)
+    ("delta",) followed by a PopulationDelta sent with sendObject
+    ("snapshot", snapshot descriptor)
+    ("eval", [team ids])
+    ("stop",)
+and each evaluated team is answered with ("result", EvalResult) or
+("error", team id, traceback string). A snapshot is answered with ("attached",
+its shared memory name) once attached to, an eval without a population to play
+with (its snapshot was freed first) with ("retry", [team ids]).
+"""
+def workerLoop(conn):
+    from tpg.snapshot import PopulationSnapshot
+
+    replica = PopulationReplica()
+    source = replica # where agents come from, the replica or a snapshot
+    functionsDict = None
+    actVars = None
+    evalFunc = None
+    evalArgs = ()
+    evalKwargs = {}
+
+    while True:
+        try:
+            msg = conn.recv()
+        except EOFError:
+            break # trainer side went away
+
+        kind = msg[0]
+        if kind == "setup":
+            functionsDict, actVars, evalFunc, evalArgs = msg[1:]
+            configFunctions(functionsDict)
+        elif kind == "kwargs":
+            evalKwargs = msg[1]
+        elif kind == "delta":
+            replica.applyDelta(recvObject(conn))
+            source = replica
+        elif kind == "snapshot":
+            if source is not replica and source is not None:
+                source.close()
+            try:
+                source = PopulationSnapshot.attach(msg[1])
+            except FileNotFoundError:
+                # freed already, evaluations wait for the next one
+                source = None
+            conn.send(("attached", msg[1][0]))
+        elif kind == "eval":
+            if source is None:
+                conn.send(("retry", msg[1]))
+                continue
+            counters = actVars.get("counters")
+            for teamId in msg[1]:
+                try:
+                    if counters is not None:
+                        counters.reset()
+                    agent = source.getAgent(teamId, functionsDict, actVars)
+                    start = time.perf_counter()
+                    outcomes = evalFunc(agent, *evalArgs, **evalKwargs)
+                    conn.send(("result", EvalResult(teamId, outcomes,
+                        time.perf_counter() - start, COMPLETED, None,
+                        None if counters is None else counters.export())))
+                except Exception:
+                    conn.send(("error", teamId, traceback.format_exc()))
+            agent = None # let go of any snapshot memory
+        elif kind == "stop":
+            break
+
+    if source is not replica and source is not None:
+        source.close()
+    conn.close()
+
+"""
+Runs an evaluation worker for a pool on another process or machine, connecting
+to the pool's address until it is told to stop. Call the pool's acceptWorkers
+to take it on. authkey must be the pool's. evalFunc gets pickled by reference,
+so must be importable here.
+"""
+def runRemoteWorker(address, authkey):
+    workerLoop(Client(address, authkey=authkey))
+
+"""
+Pool of long lived evaluation workers for a trainer. evalFunc(agent, *evalArgs,
+**evalKwargs) must be a picklable (module level) function returning a dict of
+task to score for the agent, evalKwargs can change with each submission (e.g. a
+racing cutoff). If shared, the population is handed to the workers as a shared
+memory snapshot each generation instead of as deltas. With a costModel (see
+tpg.cost_model) the teams predicted to take longest are handed out first, and
+cheap teams get handed out in chunks sized to a share of the remaining work.
+With a timeout, a worker taking longer than that many seconds on one team is
+replaced and the team times out. With a stragglerFactor, teams running that
+many times longer than the median evaluation get copied to idle workers, the
+first copy to finish counts. With an address, the pool listens there for
+remote workers on top of its local processes, see acceptWorkers. An authkey
+(bytes) is then required, whoever connects with it can run code on this host.
+"""
+class EvaluationPool:
+
+    def __init__(self, trainer, evalFunc, evalArgs=(), processes=4, shared=False,
+            costModel=None, timeout=None, stragglerFactor=None, address=None,
+            authkey=None):
+        self.trainer = trainer
+        self.evalFunc = evalFunc
+        self.evalArgs = tuple(evalArgs)
+        self.shared = shared
+        self.sync = PopulationSync()
+        self.syncedTeams = [] # population the workers have, if not shared
+        self.snapshot = None # currently published snapshot, if shared
+        self.snapshots = {} # shared memory name -> published snapshot not freed yet
+        self.attaching = {} # connection -> names of snapshots sent it, not attached yet
+        self.workers = []
+        self.conns = []
+        self.queue = deque() # submitted team ids not handed out yet
+        self.busy = {} # connection -> team ids in progress
+        self.held = {} # connection -> broadcasts held back while it is busy
+        self.started = {} # connection -> when its current team started
+        self.copies = {} # team id -> number of workers evaluating it
+        self.answered = set() # duplicated team ids with a result out already
+        self.recentSeconds = deque(maxlen=100)
+        self.evalKwargs = {}
+        self.costModel = costModel
+        self.features = {} # team id -> graph features, of teams pending
+        self.costs = {} # team id -> predicted seconds, of teams queued
+        self.timeout = timeout
+        self.stragglerFactor = stragglerFactor
+        self.listener = None
+        self.address = None
+
+        if address is not None:
+            if shared:
+                raise Exception("Remote workers can't attach to shared memory snapshots")
+            if not authkey:
+                # results get unpickled, anyone connecting could run code here
+                raise Exception("Listening for remote workers needs an authkey", address)
+            self.listener = Listener(address, authkey=authkey)
+            self.address = self.listener.address
+
+        if shared:
+            # workers must share our resource tracker, one of their own would
+            # free the shared memory when they exit
+            resource_tracker.ensure_running()
+
+        for i in range(processes):
+            self.workers.append(None)
+            self.conns.append(None)
+            self.spawnWorker(i)
+
+    """
+    Starts a local worker in slot i.
+    """
+    def spawnWorker(self, i):
+        parentConn, childConn = mp.Pipe()
+        worker = mp.Process(target=workerLoop, args=(childConn,), daemon=True)
+        worker.start()
+        childConn.close()
+        self.setupWorker(parentConn)
+        self.workers[i] = worker
+        self.conns[i] = parentConn
+
+    """
+    Waits for numWorkers remote workers (see runRemoteWorker) to connect to the
+    pool's address, and sets them up like the local ones. Can be called again
+    later to grow the pool.
+    """
+    def acceptWorkers(self, numWorkers):
+        if self.listener is None:
+            raise Exception("Pool has no address for remote workers to connect to")
+
+        for i in range(numWorkers):
+            conn = self.listener.accept()
+            self.setupWorker(conn)
+            self.workers.append(None) # no process of ours to manage
+            self.conns.append(conn)
+        self.dispatch()
+
+    """
+    Sends a new worker what it needs to evaluate. The population and keyword
+    arguments only go out if the pool already sent them to the others, new
+    pools send them on the first submit.
+    """
+    def setupWorker(self, conn):
+        conn.send(("setup", self.trainer.functionsDict, self.trainer.actVars,
+                    self.evalFunc, self.evalArgs))
+        if self.evalKwargs:
+            conn.send(("kwargs", self.evalKwargs))
+        if self.snapshot is not None:
+            self.sendMessage(conn, ("snapshot", self.snapshot.descriptor))
+        elif len(self.syncedTeams) > 0:
+            conn.send(("delta",))
+            sendObject(conn, PopulationSync().delta(self.syncedTeams))
+
+    """
+    Kills a hung or dead worker and starts a fresh one in its place, remote
+    workers are just dropped. The team it was on gets a result with the given
+    status, the rest of its chunk goes back to the front of the queue. Returns
+    the result, None if the team has another copy still going.
+    """
+    def replaceWorker(self, conn, status, detail=None):
+        i = self.conns.index(conn)
+        chunk = self.busy.pop(conn)
+        started = self.started.pop(conn)
+        self.forgetWorker(conn)
+        conn.close()
+        if self.workers[i] is None:
+            del self.workers[i]
+            del self.conns[i]
+            if len(self.conns) == 0:
+                raise Exception("Lost every evaluation worker")
+        else:
+            self.workers[i].terminate()
+            self.workers[i].join()
+            self.spawnWorker(i)
+
+        self.requeue(chunk[1:])
+        return self.resolve(EvalResult(chunk[0], {}, time.perf_counter() - started,
+                                        status, detail))
+
+    """
+    Puts team ids handed out but not played back at the front of the queue.
+    """
+    def requeue(self, teamIds):
+        for teamId in reversed(teamIds):
+            self.copies[teamId] -= 1
+            if self.copies[teamId] == 0:
+                del self.copies[teamId]
+            self.queue.appendleft(teamId)
+            if self.costModel is not None:
+                self.costs[teamId] = self.costModel.predict([teamId],
+                                        [self.features[teamId]])[0]
+
+    """
+    Drops what is kept for a worker that is going away: held broadcasts (a fresh
+    worker gets set up up to date) and the snapshots it was yet to attach to.
+    """
+    def forgetWorker(self, conn):
+        self.held.pop(conn, None)
+        self.attaching.pop(conn, None)
+        self.freeSnapshots()
+
+    """
+    Notes that the worker attached to the snapshot with the given shared memory
+    name (or found it gone).
+    """
+    def attached(self, conn, name):
+        names = self.attaching.get(conn, [])
+        if name in names:
+            names.remove(name)
+        self.freeSnapshots()
+
+    """
+    Frees the superseded snapshots no worker is still to attach to. Workers
+    attached to one keep it mapped until they move on.
+    """
+    def freeSnapshots(self):
+        pending = set(name for names in self.attaching.values() for name in names)
+        for name in list(self.snapshots):
+            if name not in pending and self.snapshots[name] is not self.snapshot:
+                self.snapshots.pop(name).close()
+
+    """
+    Reads the attach notes idle workers sent since they went idle, the only
+    thing they send.
+    """
+    def readAttached(self):
+        for conn in self.conns:
+            if conn in self.busy:
+                continue
+            try:
+                while conn.poll():
+                    self.attached(conn, conn.recv()[1])
+            except (EOFError, OSError):
+                pass # dead, restarted on the next send
+
+    """
+    Sends the population delta since the last sync to every worker, or a new
+    snapshot if shared.
+    """
+    def syncPopulation(self):
+        if self.shared:
+            self.snapshot = self.trainer.publishSnapshot()
+            self.snapshots[self.snapshot.descriptor[0]] = self.snapshot
+            self.readAttached()
+            self.broadcast(("snapshot", self.snapshot.descriptor))
+            # older ones go once the workers they were sent to attached to them
+            self.freeSnapshots()
+            return
+
+        self.syncedTeams = self.trainer.teams + self.trainer.rootTeams
+        # pickled once for all workers, instructions out of band
+        self.broadcast(("delta",), pickleForSend(self.sync.delta(self.syncedTeams)))
+
+    """
+    Evaluates the teams (defaults to all root teams) on the workers, returning a
+    list of EvalResult in completion order, usable with Trainer.applyScores.
+    """
+    def evaluate(self, teams=None, evalKwargs=None):
+        if teams is None:
+            teams = self.trainer.rootTeams
+        self.submit(teams, evalKwargs)
+
+        results = []
+        while self.numPending() > 0:
+            results += self.collect()
+
+        return results
+
+    """
+    Queues the teams for evaluation without waiting for them, after syncing the
+    workers with the current population. Workers are handed teams as they free
+    up, collect gets the results. If given, evalKwargs replace the keyword
+    arguments to evalFunc from here on.
+    """
+    def submit(self, teams, evalKwargs=None):
+        self.syncPopulation()
+        if evalKwargs is not None and evalKwargs != self.evalKwargs:
+            self.evalKwargs = dict(evalKwargs)
+            self.broadcast(("kwargs", self.evalKwargs))
+        self.queue.extend(team.id for team in teams)
+        if self.costModel is not None:
+            self.costModel.fit()
+            for team in teams:
+                self.features[team.id] = graphFeatures(team)
+            teamIds = list(self.queue)
+            costs = self.costModel.predict(teamIds,
+                        [self.features[teamId] for teamId in teamIds])
+            self.costs = dict(zip(teamIds, costs))
+            # longest expected first, so none are left running alone at the end
+            self.queue = deque(sorted(teamIds, key=lambda teamId: -self.costs[teamId]))
+        self.dispatch()
+
+    """
+    Hands queued teams to any idle workers. With a cost model, a worker gets the
+    next teams up to a predicted cost of half its share of the queued work
+    (always at-least one team), so chunks shrink as the queue runs out. Once the
+    queue is empty, workers left idle take on copies of stragglers.
+    """
+    def dispatch(self):
+        for conn in list(self.conns):
+            if len(self.queue) == 0:
+                break
+            if conn in self.busy:
+                continue
+
+            chunk = [self.queue.popleft()]
+            if self.costModel is not None:
+                cost = self.costs[chunk[0]]
+                target = sum(self.costs.values()) / (2*len(self.conns))
+                while len(self.queue) > 0 and cost + self.costs[self.queue[0]] <= target:
+                    chunk.append(self.queue.popleft())
+                    cost += self.costs[chunk[-1]]
+
+            if self.send(conn, chunk):
+                if self.costModel is not None:
+                    for teamId in chunk:
+                        del self.costs[teamId]
+            else:
+                # lost remote worker, the chunk waits for another one
+                self.queue.extendleft(reversed(chunk))
+
+        if self.stragglerFactor is not None and len(self.queue) == 0:
+            self.speculate()
+
+    """
+    Sends a chunk of team ids to an idle worker, replacing the worker first if
+    it turns out to be dead. Returns whether it was sent, which it isn't if the
+    worker was a remote one and got dropped.
+    """
+    def send(self, conn, chunk):
+        try:
+            self.sendHeld(conn)
+            conn.send(("eval", chunk))
+        except (BrokenPipeError, OSError):
+            conn = self.restartWorker(conn)
+            if conn is None:
+                return False
+            conn.send(("eval", chunk))
+
+        self.busy[conn] = list(chunk)
+        self.started[conn] = time.perf_counter()
+        for teamId in chunk:
+            self.copies[teamId] = self.copies.get(teamId, 0) + 1
+        return True
+
+    """
+    Starts a fresh worker in place of an idle one found dead, returning its
+    connection. Remote workers are dropped instead, returning None.
+    """
+    def restartWorker(self, conn):
+        i = self.conns.index(conn)
+        self.forgetWorker(conn)
+        conn.close()
+        if self.workers[i] is None:
+            del self.workers[i]
+            del self.conns[i]
+            return None
+
+        self.workers[i].join(timeout=1)
+        self.spawnWorker(i)
+        return self.conns[i]
+
+    """
+    Sends the message to every idle worker, followed by the object if pickled
+    (from pickleForSend) is given. Busy workers get it once they are idle again
+    (see sendHeld), so sending never waits on a running evaluation. Only the
+    latest snapshot is held back, older ones are of no use. Idle workers found
+    dead are restarted, which brings them up to date anyway.
+    """
+    def broadcast(self, msg, pickled=None):
+        for conn in list(self.conns):
+            if conn in self.busy:
+                held = self.held.setdefault(conn, [])
+                if msg[0] == "snapshot":
+                    held[:] = [(m, p) for m, p in held if m[0] != "snapshot"]
+                held.append((msg, pickled))
+                continue
+
+            try:
+                self.sendMessage(conn, msg, pickled)
+            except (BrokenPipeError, OSError):
+                self.restartWorker(conn)
+
+    """
+    Sends a worker the broadcasts held back while it was busy, in order.
+    """
+    def sendHeld(self, conn):
+        for msg, pickled in self.held.pop(conn, []):
+            self.sendMessage(conn, msg, pickled)
+
+    """
+    Sends a worker the message, followed by the object if pickled is given,
+    keeping track of the snapshots it is yet to attach to.
+    """
+    def sendMessage(self, conn, msg, pickled=None):
+        conn.send(msg)
+        if pickled is not None:
+            sendObject(conn, pickled=pickled)
+        if msg[0] == "snapshot":
+            self.attaching.setdefault(conn, []).append(msg[1][0])
+
+    """
+    Gives idle workers a copy of the team running longest, if it has been
+    running over stragglerFactor times the median evaluation time and has no
+    copy yet. Whichever copy finishes first is the result.
+    """
+    def speculate(self):
+        if len(self.recentSeconds) == 0:
+            return
+
+        limit = self.stragglerFactor*np.median(self.recentSeconds)
+        now = time.perf_counter()
+        for conn in list(self.conns):
+            if conn in self.busy:
+                continue
+
+            stragglers = [(now - self.started[c], self.busy[c][0]) for c in self.busy
+                            if self.copies[self.busy[c][0]] == 1
+                                and self.busy[c][0] not in self.answered]
+            if len(stragglers) == 0:
+                break
+            elapsed, teamId = max(stragglers)
+            if elapsed <= limit:
+                break
+            self.send(conn, [teamId])
+
+    """
+    When the next running team turns into a straggler that speculate would copy,
+    None if none could be copied (no idle worker, teams still queued, or no
+    evaluation times to go by yet).
+    """
+    def nextStraggler(self):
+        if (self.stragglerFactor is None or len(self.recentSeconds) == 0
+                or len(self.queue) > 0 or len(self.busy) == len(self.conns)):
+            return None
+
+        limit = self.stragglerFactor*np.median(self.recentSeconds)
+        deadlines = [self.started[c] + limit for c in self.busy
+                        if self.copies[self.busy[c][0]] == 1
+                            and self.busy[c][0] not in self.answered]
+        return min(deadlines) if len(deadlines) > 0 else None
+
+    """
+    Settles a result from one copy of a team. Returns None if another copy
+    already answered, or if this one didn't complete but another copy is still
+    going.
+    """
+    def resolve(self, result):
+        teamId = result.teamId
+        self.copies[teamId] -= 1
+        remaining = self.copies[teamId]
+        if remaining == 0:
+            del self.copies[teamId]
+
+        if teamId in self.answered:
+            if remaining == 0:
+                self.answered.remove(teamId)
+            return None
+        if result.status != COMPLETED and remaining > 0:
+            return None
+        if remaining > 0:
+            self.answered.add(teamId)
+
+        features = self.features.pop(teamId, None)
+        if result.status == COMPLETED:
+            self.recentSeconds.append(result.seconds)
+            if self.costModel is not None:
+                self.costModel.record(teamId, features, result.seconds)
+        return result
+
+    """
+    Number of submitted teams without a result yet.
+    """
+    def numPending(self):
+        return len(self.queue) + len(self.copies) - len(self.answered)
+
+    """
+    Waits up to timeout seconds (forever if None) for at-least one submitted
+    team to finish, and returns the list of EvalResult of all finished so far.
+    Teams whose evaluation raised get a failed result. Workers that die, or
+    that run over the pool's per team timeout, are replaced, their team gets a
+    failed or timed out result. Freed workers immediately get the next queued
+    team, and with a stragglerFactor idle workers get copies of stragglers as
+    soon as they become stragglers. Raises if every worker was lost with teams
+    still to evaluate.
+    """
+    def collect(self, timeout=None):
+        if len(self.conns) == 0 and self.numPending() > 0:
+            raise Exception("Lost every evaluation worker", self.numPending())
+
+        results = []
+        end = None if timeout is None else time.perf_counter() + timeout
+        while len(self.busy) > 0 and self.numPending() > 0:
+            now = time.perf_counter()
+            waitTime = None if end is None else max(0, end - now)
+            if self.timeout is not None:
+                untilTimeout = max(0, min(self.started.values()) + self.timeout - now)
+                waitTime = untilTimeout if waitTime is None else min(waitTime, untilTimeout)
+            straggler = self.nextStraggler()
+            if straggler is not None:
+                untilStraggler = max(0, straggler - now)
+                waitTime = untilStraggler if waitTime is None else min(waitTime, untilStraggler)
+
+            for conn in wait(list(self.busy), timeout=waitTime):
+                try:
+                    msg = conn.recv()
+                except (EOFError, OSError):
+                    results.append(self.replaceWorker(conn, FAILED, "Worker died"))
+                    continue
+
+                if msg[0] == "attached":
+                    self.attached(conn, msg[1])
+                    continue
+                if msg[0] == "retry":
+                    # it had no population, goes again once it has the current one
+                    self.requeue(self.busy.pop(conn))
+                    del self.started[conn]
+                    try:
+                        self.sendMessage(conn, ("snapshot", self.snapshot.descriptor))
+                    except (BrokenPipeError, OSError):
+                        self.restartWorker(conn)
+                    continue
+
+                if msg[0] == "error":
+                    result = EvalResult(msg[1], {}, 0.0, FAILED, msg[2])
+                else:
+                    result = msg[1]
+                chunk = self.busy[conn]
+                chunk.remove(result.teamId)
+                if len(chunk) == 0:
+                    del self.busy[conn]
+                    del self.started[conn]
+                    try:
+                        self.sendHeld(conn)
+                    except (BrokenPipeError, OSError):
+                        self.restartWorker(conn)
+                else:
+                    self.started[conn] = time.perf_counter()
+                results.append(self.resolve(result))
+
+            if self.timeout is not None:
+                now = time.perf_counter()
+                for conn in list(self.busy):
+                    if now - self.started[conn] > self.timeout:
+                        results.append(self.replaceWorker(conn, TIMED_OUT))
+
+            results = [result for result in results if result is not None]
+            self.dispatch()
+            if self.stragglerFactor is not None:
+                self.speculate()
+            if len(results) > 0 or (end is not None and time.perf_counter() >= end):
+                break
+
+        return results
+
+    """
+    Stops all of the workers.
+    """
+    def close(self):
+        for conn in self.conns:
+            try:
+                conn.send(("stop",))
+                conn.close()
+            except (OSError, BrokenPipeError):
+                pass
+        for worker in self.workers:
+            if worker is None:
+                continue
+            worker.join(timeout=5)
+            if worker.is_alive():
+                worker.terminate()
+        self.workers = []
+        self.conns = []
+        self.queue.clear()
+        self.busy = {}
+        self.held = {}
+        self.started = {}
+        self.copies = {}
+        self.answered = set()
+        self.features = {}
+        self.costs = {}
+
+        for snapshot in self.snapshots.values():
+            snapshot.close()
+        self.snapshots = {}
+        self.attaching = {}
+        self.snapshot = None
+        if self.listener is not None:
+            self.listener.close()
+            self.listener = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
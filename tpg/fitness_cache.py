@@ -0,0 +1,64 @@
+from tpg.utils import graphHash
+from collections import OrderedDict
+
+"""
+Outcomes of evaluated graphs, keyed by the structural hash of the graph reachable
+from a root team (see utils.graphHash), so a new root team identical to one
+already evaluated can take its outcomes instead of being evaluated again. Least
+recently used entries are dropped past capacity. With stochastic environments an
+inherited outcome is just the one sample the original got.
+"""
+class FitnessCache:
+
+    def __init__(self, capacity=10000):
+        self.capacity = capacity
+        self.entries = OrderedDict() # graph hash -> outcomes dict
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    """
+    Cached outcomes of a graph hash, or None.
+    """
+    def get(self, key):
+        outcomes = self.entries.get(key)
+        if outcomes is not None:
+            self.entries.move_to_end(key)
+        return outcomes
+
+    """
+    Stores the team's outcomes at the tasks, if it has all of them.
+    """
+    def store(self, teams, tasks):
+        for team in teams:
+            if all(task in team.outcomes for task in tasks):
+                key = graphHash(team)
+                self.entries[key] = {task: team.outcomes[task] for task in tasks}
+                self.entries.move_to_end(key)
+
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    """
+    Gives teams whose graph is cached the cached outcomes at the tasks, and
+    returns the teams that still need to be evaluated. Only one of any teams
+    sharing a graph is returned, the rest can inherit from it once it is stored.
+    """
+    def inherit(self, teams, tasks):
+        toEvaluate = []
+        seen = set()
+        for team in teams:
+            key = graphHash(team)
+            outcomes = self.get(key)
+            if outcomes is not None and all(task in outcomes for task in tasks):
+                self.hits += 1
+                for task in tasks:
+                    team.outcomes[task] = outcomes[task]
+            elif key not in seen:
+                self.misses += 1
+                seen.add(key)
+                toEvaluate.append(team)
+
+        return toEvaluate
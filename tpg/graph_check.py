@@ -0,0 +1,178 @@
+import uuid
+
+"""
+Checking the invariants of a trainer's team/learner graph, incrementally. Each
+check looks only at the teams and learners that are new or whose edges changed
+since the last check, and at the neighbours of any that were removed, using id
+indexes rather than searching the population. The invariants are:
+    - ids are unique in the population.
+    - a learner is on a team exactly when the team is in its inTeams, once.
+    - a learner points to a team exactly when it is in the team's inLearners,
+      once, and points to a team of the population.
+    - every learner has an action, and is on some team.
+    - every team has at least one learner with an atomic action.
+    - a team is a root team exactly when nothing points to it (or it is an
+      elite), so every other team is reachable from some learner on a team.
+"""
+
+"""
+What a check compares between generations, the edges of a node.
+"""
+def teamSignature(team):
+    return (tuple(learner.id for learner in team.learners), tuple(team.inLearners))
+
+def learnerSignature(learner):
+    actionObj = learner.actionObj
+    action = actionObj.actionCode if actionObj.teamAction is None else actionObj.teamAction.id
+    return (action, tuple(learner.inTeams))
+
+"""
+Ids of the learners / teams linked to in a team's / learner's signature.
+"""
+def teamNeighbours(signature):
+    learnerIds, inLearners = signature
+    return set(str(i) for i in learnerIds) | set(inLearners)
+
+def learnerNeighbours(signature):
+    action, inTeams = signature
+    if isinstance(action, uuid.UUID):
+        return set(inTeams) | {str(action)}
+    return set(inTeams)
+
+class GraphChecker:
+
+    def __init__(self):
+        # signatures of the nodes as of the last check, by id string
+        self.teams = {}
+        self.learners = {}
+        # ids of the root teams and elites as of the last check
+        self.rootIds = set()
+        self.eliteIds = set()
+
+    """
+    Checks the trainer's graph, returning a list of the problems found. With
+    full every node is checked, not just those touched since the last check.
+    """
+    def check(self, trainer, full=False):
+        problems = []
+
+        teams = {}
+        for team in trainer.teams:
+            teamId = str(team.id)
+            if teamId in teams:
+                problems.append("Duplicate team {}".format(teamId))
+            teams[teamId] = team
+        learners = {}
+        for learner in trainer.learners:
+            learnerId = str(learner.id)
+            if learnerId in learners:
+                problems.append("Duplicate learner {}".format(learnerId))
+            learners[learnerId] = learner
+        rootIds = set(str(team.id) for team in trainer.rootTeams)
+        eliteIds = set(str(team.id) for team in trainer.elites)
+
+        # what changed since the last check
+        teamSignatures = {teamId: teamSignature(team) for teamId, team in teams.items()}
+        learnerSignatures = {learnerId: learnerSignature(learner)
+                                for learnerId, learner in learners.items()}
+        dirtyTeams = set()
+        dirtyLearners = set()
+        for signatures, previous, dirty, neighbours, dirtyNeighbours in [
+                (teamSignatures, self.teams, dirtyTeams, teamNeighbours, dirtyLearners),
+                (learnerSignatures, self.learners, dirtyLearners, learnerNeighbours, dirtyTeams)]:
+            for nodeId, signature in signatures.items():
+                old = previous.get(nodeId)
+                if full or old != signature:
+                    dirty.add(nodeId)
+                    # a neighbour no longer (or newly) linked may still link back (or not)
+                    if old is not None:
+                        dirtyNeighbours.update(neighbours(old) ^ neighbours(signature))
+            # neighbours of removed nodes may still point at them
+            for nodeId in previous.keys() - signatures.keys():
+                dirtyNeighbours.update(neighbours(previous[nodeId]))
+        # teams that became or stopped being roots or elites
+        dirtyTeams.update(rootIds ^ self.rootIds, eliteIds ^ self.eliteIds)
+        dirtyTeams &= teams.keys()
+        dirtyLearners &= learners.keys()
+
+        for teamId in dirtyTeams:
+            problems.extend(self.checkTeam(teams[teamId], teams, learners, rootIds, eliteIds))
+        for learnerId in dirtyLearners:
+            problems.extend(self.checkLearner(learners[learnerId], teams, learners))
+        for teamId in rootIds - teams.keys():
+            problems.append("Root team {} not in the population".format(teamId))
+
+        self.teams = teamSignatures
+        self.learners = learnerSignatures
+        self.rootIds = rootIds
+        self.eliteIds = eliteIds
+
+        return problems
+
+    def checkTeam(self, team, teams, learners, rootIds, eliteIds):
+        teamId = str(team.id)
+        problems = []
+
+        learnerIds = [str(learner.id) for learner in team.learners]
+        if len(set(learnerIds)) != len(learnerIds):
+            problems.append("Team {} has a learner more than once".format(teamId))
+        for learnerId, learner in zip(learnerIds, team.learners):
+            if learners.get(learnerId) is not learner:
+                problems.append("Team {} has learner {} not in the population".format(
+                    teamId, learnerId))
+            if learner.inTeams.count(teamId) != 1:
+                problems.append("Learner {} has team {} in inTeams {} times".format(
+                    learnerId, teamId, learner.inTeams.count(teamId)))
+
+        if not any(learner.isActionAtomic() for learner in team.learners):
+            problems.append("Team {} has no atomic action".format(teamId))
+
+        if len(set(team.inLearners)) != len(team.inLearners):
+            problems.append("Team {} has a learner in inLearners more than once".format(teamId))
+        for learnerId in team.inLearners:
+            learner = learners.get(learnerId)
+            if learner is None:
+                problems.append("Team {} has learner {} in inLearners not in the population".format(
+                    teamId, learnerId))
+            elif learner.actionObj.teamAction is not team:
+                problems.append("Team {} has learner {} in inLearners not pointing to it".format(
+                    teamId, learnerId))
+
+        isRoot = teamId in rootIds
+        if isRoot != (len(team.inLearners) == 0 or teamId in eliteIds):
+            problems.append("Team {} {} a root team with {} learners pointing to it".format(
+                teamId, "is" if isRoot else "is not", len(team.inLearners)))
+
+        return problems
+
+    def checkLearner(self, learner, teams, learners):
+        learnerId = str(learner.id)
+        problems = []
+
+        actionObj = learner.actionObj
+        if actionObj.teamAction is None:
+            if actionObj.actionCode is None:
+                problems.append("Learner {} has no action".format(learnerId))
+        else:
+            targetId = str(actionObj.teamAction.id)
+            if teams.get(targetId) is not actionObj.teamAction:
+                problems.append("Learner {} points to team {} not in the population".format(
+                    learnerId, targetId))
+            if actionObj.teamAction.inLearners.count(learnerId) != 1:
+                problems.append("Team {} has learner {} in inLearners {} times".format(
+                    targetId, learnerId, actionObj.teamAction.inLearners.count(learnerId)))
+
+        if len(learner.inTeams) == 0:
+            problems.append("Learner {} is on no team".format(learnerId))
+        if len(set(learner.inTeams)) != len(learner.inTeams):
+            problems.append("Learner {} has a team in inTeams more than once".format(learnerId))
+        for teamId in learner.inTeams:
+            team = teams.get(teamId)
+            if team is None:
+                problems.append("Learner {} has team {} in inTeams not in the population".format(
+                    learnerId, teamId))
+            elif not any(cursor is learner for cursor in team.learners):
+                problems.append("Learner {} has team {} in inTeams without being on it".format(
+                    learnerId, teamId))
+
+        return problems
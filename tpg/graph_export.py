@@ -0,0 +1,220 @@
+from tpg.snapshot import idFromBytes
+import numpy as np
+import itertools
+import json
+
+"""
+Compact export of a population's team/learner graph. The graph is taken as a
+handful of arrays (a node table and CSR edges), which can be saved as is, or
+streamed out a node / link at a time as JSON lines or GraphML without building
+the whole document in memory. Graphs of consecutive generations can be saved as
+diffs of each other.
+"""
+
+NODE_TEAM = 0
+NODE_ROOT_TEAM = 1
+NODE_LEARNER = 2
+NODE_TYPES = ["team", "rootTeam", "learner"]
+
+"""
+The graph of the trainer's teams and learners as arrays:
+    nodeIds: uuid bytes of each node, the teams first then the learners.
+    nodeType: NODE_TEAM, NODE_ROOT_TEAM or NODE_LEARNER for each node.
+    nodeGen: generation each node was created in.
+    nodeAction: action code of each learner with an atomic action, else -1.
+    edgePtr, edges: CSR of the out edges of each node, from a team to each of
+        its learners and from a learner to the team it points to (if any).
+    actionCodes: the trainer's action codes.
+    generation: the trainer's generation.
+The graph is expected to be whole (see tpg.graph_check).
+"""
+def graphArrays(trainer):
+    teams = trainer.teams
+    learners = trainer.learners
+    rootIds = set(team.id for team in trainer.rootTeams)
+    index = {node.id: i for i, node in enumerate(itertools.chain(teams, learners))}
+
+    nTeams = len(teams)
+    nodeAction = np.full(len(index), -1, dtype=np.int64)
+    edgePtr = np.zeros(len(index)+1, dtype=np.int64)
+    edges = []
+    for i, team in enumerate(teams):
+        edges.extend(index[learner.id] for learner in team.learners)
+        edgePtr[i+1] = len(edges)
+    for i, learner in enumerate(learners, nTeams):
+        actionObj = learner.actionObj
+        if actionObj.teamAction is None:
+            nodeAction[i] = actionObj.actionCode
+        else:
+            edges.append(index[actionObj.teamAction.id])
+        edgePtr[i+1] = len(edges)
+
+    nodeType = np.full(len(index), NODE_LEARNER, dtype=np.uint8)
+    nodeType[:nTeams] = [NODE_ROOT_TEAM if team.id in rootIds else NODE_TEAM
+                            for team in teams]
+
+    return {
+        "nodeIds": np.array([node.id.bytes for node in itertools.chain(teams, learners)],
+                            dtype="S16"),
+        "nodeType": nodeType,
+        "nodeGen": np.array([node.genCreate for node in itertools.chain(teams, learners)],
+                            dtype=np.int32),
+        "nodeAction": nodeAction,
+        "edgePtr": edgePtr,
+        "edges": np.array(edges, dtype=np.int32),
+        "actionCodes": np.array(trainer.actionCodes, dtype=np.int64),
+        "generation": np.array(trainer.generation, dtype=np.int64),
+    }
+
+"""
+Saves arrays (a graph or a diff) to an npz file, and loads them back.
+"""
+def saveArrays(arrays, fileName):
+    with open(fileName, "wb") as f:
+        np.savez(f, **arrays)
+
+def loadArrays(fileName):
+    with np.load(fileName) as data:
+        return {name: data[name] for name in data.files}
+
+"""
+Nodes of the graph as in Trainer.get_graph, the action codes included as
+nodes.
+"""
+def graphNodes(graph):
+    for actionCode in graph["actionCodes"].tolist():
+        yield {"id": str(actionCode), "type": "action"}
+    for nodeId, nodeType in zip(graph["nodeIds"], graph["nodeType"].tolist()):
+        yield {"id": str(idFromBytes(nodeId)), "type": NODE_TYPES[nodeType]}
+
+"""
+Links of the graph as in Trainer.get_graph, from each team to its learners,
+from each learner to the team or action code it points to.
+"""
+def graphLinks(graph):
+    ids = [str(idFromBytes(nodeId)) for nodeId in graph["nodeIds"]]
+    edgePtr = graph["edgePtr"].tolist()
+    edges = graph["edges"].tolist()
+    for i, (nodeId, action) in enumerate(zip(ids, graph["nodeAction"].tolist())):
+        for j in edges[edgePtr[i]:edgePtr[i+1]]:
+            yield {"source": nodeId, "target": ids[j]}
+        if action != -1:
+            yield {"source": nodeId, "target": str(action)}
+
+"""
+Writes the graph one JSON object per line, the nodes then the links (see
+graphNodes and graphLinks).
+"""
+def writeJsonLines(graph, fileName):
+    with open(fileName, "w") as f:
+        for record in itertools.chain(graphNodes(graph), graphLinks(graph)):
+            f.write(json.dumps(record))
+            f.write("\n")
+
+"""
+Writes the graph as GraphML, with the type of each node and the generation
+teams and learners were created in.
+"""
+def writeGraphML(graph, fileName):
+    with open(fileName, "w") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<graphml xmlns="http://graphml.graphdrawing.org/xmlns">\n'
+            '  <key id="type" for="node" attr.name="type" attr.type="string"/>\n'
+            '  <key id="gen" for="node" attr.name="genCreate" attr.type="int"/>\n'
+            '  <graph id="generation{}" edgedefault="directed">\n'.format(
+                int(graph["generation"])))
+        for actionCode in graph["actionCodes"].tolist():
+            f.write('    <node id="{}"><data key="type">action</data></node>\n'.format(
+                actionCode))
+        for nodeId, nodeType, gen in zip(graph["nodeIds"], graph["nodeType"].tolist(),
+                                         graph["nodeGen"].tolist()):
+            f.write('    <node id="{}"><data key="type">{}</data><data key="gen">{}</data>'
+                '</node>\n'.format(idFromBytes(nodeId), NODE_TYPES[nodeType], gen))
+        for link in graphLinks(graph):
+            f.write('    <edge source="{}" target="{}"/>\n'.format(link["source"], link["target"]))
+        f.write('  </graph>\n</graphml>\n')
+
+"""
+Edges of the graph as a set of (source id, target id) bytes.
+"""
+def edgeSet(graph):
+    ids = graph["nodeIds"].tolist()
+    edgePtr = graph["edgePtr"].tolist()
+    edges = graph["edges"].tolist()
+    return set((ids[i], ids[j]) for i in range(len(ids)) for j in edges[edgePtr[i]:edgePtr[i+1]])
+
+"""
+Difference from graph old to graph new, as arrays:
+    addedIds, addedType, addedGen, addedAction: the nodes only in new, with
+        their attributes.
+    removedIds: the ids of the nodes only in old.
+    changedIds, changedType, changedAction: nodes in both whose type (root
+        team or not) or action code changed, with their new attributes.
+    addedEdges, removedEdges: (source id, target id) of each edge only in new
+        / old.
+    generation, fromGeneration: the generations of new and old.
+"""
+def graphDiff(old, new):
+    oldIds = old["nodeIds"].tolist()
+    newIds = new["nodeIds"].tolist()
+    oldIndex = {nodeId: i for i, nodeId in enumerate(oldIds)}
+    newIndex = set(newIds)
+
+    added = []
+    changed = []
+    for i, nodeId in enumerate(newIds):
+        j = oldIndex.get(nodeId)
+        if j is None:
+            added.append(i)
+        elif (old["nodeType"][j] != new["nodeType"][i]
+                or old["nodeAction"][j] != new["nodeAction"][i]):
+            changed.append(i)
+    added = np.array(added, dtype=np.int64)
+    changed = np.array(changed, dtype=np.int64)
+
+    oldEdges = edgeSet(old)
+    newEdges = edgeSet(new)
+
+    return {
+        "addedIds": new["nodeIds"][added],
+        "addedType": new["nodeType"][added],
+        "addedGen": new["nodeGen"][added],
+        "addedAction": new["nodeAction"][added],
+        "removedIds": np.array([nodeId for nodeId in oldIds if nodeId not in newIndex],
+                               dtype="S16"),
+        "changedIds": new["nodeIds"][changed],
+        "changedType": new["nodeType"][changed],
+        "changedAction": new["nodeAction"][changed],
+        "addedEdges": np.array(sorted(newEdges - oldEdges), dtype="S16").reshape(-1, 2),
+        "removedEdges": np.array(sorted(oldEdges - newEdges), dtype="S16").reshape(-1, 2),
+        "generation": new["generation"],
+        "fromGeneration": old["generation"],
+    }
+
+"""
+Records the trainer's graph each time record is called (e.g. each generation),
+to prefix + generation + ".npz" for the first graph and each fullEvery
+generations if given, else as the diff from the last graph recorded to
+prefix + generation + ".diff.npz".
+"""
+class GraphRecorder:
+
+    def __init__(self, prefix, fullEvery=None):
+        self.prefix = prefix
+        self.fullEvery = fullEvery
+        self.last = None # graph last recorded
+
+    """
+    Records the graph, returning the name of the file written.
+    """
+    def record(self, trainer):
+        graph = graphArrays(trainer)
+        generation = trainer.generation
+        if self.last is None or (self.fullEvery is not None and generation % self.fullEvery == 0):
+            fileName = "{}{}.npz".format(self.prefix, generation)
+            saveArrays(graph, fileName)
+        else:
+            fileName = "{}{}.diff.npz".format(self.prefix, generation)
+            saveArrays(graphDiff(self.last, graph), fileName)
+        self.last = graph
+        return fileName
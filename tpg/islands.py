@@ -0,0 +1,223 @@
+from tpg.trainer import Trainer
+from tpg.team import Team
+from tpg.learner import Learner
+from tpg.graph_check import GraphChecker
+import multiprocessing as mp
+import numpy as np
+import random
+
+"""
+Island model training. Each island is a process with its own Trainer (and its
+own configuration, since functions are configured per process), evolving in
+parallel with the others. Every so often the best root teams of each island
+migrate to its neighbours, where copies of them are handed to evolve as
+extraTeams: the next offspring may use them as team actions, and unused ones
+are dropped.
+Islands must share the action space and input size so migrants fit in.
+"""
+
+"""
+Source islands for each island under the topology: "ring" (from the previous
+island), "complete" (from every other island), or a list giving the sources of
+each island.
+"""
+def migrationSources(topology, numIslands):
+    if topology == "ring":
+        return [[(i - 1) % numIslands] if numIslands > 1 else []
+                for i in range(numIslands)]
+    elif topology == "complete":
+        return [[j for j in range(numIslands) if j != i] for i in range(numIslands)]
+    elif len(topology) != numIslands:
+        raise Exception("Topology needs the sources of every island", topology)
+
+    return [list(sources) for sources in topology]
+
+"""
+Plays every root team of the trainer without outcomes at all tasks, in this
+process.
+"""
+def evaluateIsland(trainer, tasks, evalFunc, evalArgs):
+    for agent in trainer.getAgents(skipTasks=tasks):
+        agent.zeroRegisters()
+        outcomes = evalFunc(agent, *evalArgs)
+        for task, outcome in outcomes.items():
+            agent.team.outcomes[task] = outcome
+
+"""
+Fresh copies of the immigrants that fit into the trainer's population. A copy
+keeps the learners (copied too) with atomic actions and those pointing to teams
+of the population, the others point into the source island's population so are
+left out. Immigrants already in the population (e.g. back home) are skipped.
+"""
+def importMigrants(trainer, immigrants):
+    localTeams = {team.id: team for team in trainer.teams}
+    copies = []
+    for immigrant in immigrants:
+        if immigrant.id in localTeams:
+            continue
+
+        copy = Team(initParams=trainer.mutateParams)
+        for learner in immigrant.learners:
+            if learner.isActionAtomic():
+                action = learner.actionObj
+            elif learner.actionObj.teamAction.id in localTeams:
+                action = localTeams[learner.actionObj.teamAction.id]
+            else:
+                continue
+            copy.addLearner(Learner(trainer.mutateParams, learner.program, action,
+                                    len(learner.registers)))
+        copies.append(copy)
+
+    return copies
+
+"""
+Main loop of an island process. Answers ("generations", n, immigrants) by
+evolving n generations, the immigrants going in as extraTeams of the first, and
+sends back the fitness stats of each generation and its best numMigrants root
+teams as emigrants.
+"""
+def islandLoop(conn, trainerKwargs, tasks, evalFunc, evalArgs, numMigrants, seed):
+    # forked islands would all start with the same random state
+    random.seed(seed)
+    np.random.seed(None if seed is None else seed % 2**32)
+
+    trainer = Trainer(**trainerKwargs)
+    trainer.configFunctions()
+
+    while True:
+        try:
+            msg = conn.recv()
+        except EOFError:
+            break
+
+        kind = msg[0]
+        if kind == "generations":
+            numGenerations, immigrants = msg[1:]
+            extraTeams = importMigrants(trainer, immigrants)
+
+            stats = []
+            emigrants = []
+            for gen in range(numGenerations):
+                evaluateIsland(trainer, tasks, evalFunc, evalArgs)
+                if gen == numGenerations - 1:
+                    emigrants = [agent.team for agent in
+                                    trainer.getAgents(sortTasks=tasks)[:numMigrants]]
+                trainer.evolve(tasks, extraTeams=extraTeams if gen == 0 else None)
+                stats.append(dict(trainer.fitnessStats))
+
+            conn.send(("done", stats, emigrants))
+        elif kind == "champion":
+            evaluateIsland(trainer, tasks, evalFunc, evalArgs)
+            champion = trainer.getAgents(sortTasks=tasks)[0].team
+            conn.send(("champion", champion, dict(champion.outcomes)))
+        elif kind == "teamIds":
+            conn.send(("teamIds", set(team.id for team in trainer.teams)))
+        elif kind == "checkGraph":
+            conn.send(("checkGraph", GraphChecker().check(trainer, full=True)))
+        elif kind == "stop":
+            break
+
+    trainer.cleanup()
+    conn.close()
+
+"""
+Runs one island process per entry of trainerKwargs (keyword arguments of each
+island's Trainer). evalFunc(agent, *evalArgs) must be a picklable (module level)
+function returning a dict of task to score. Every migrationInterval generations
+each island sends its best numMigrants root teams to the islands it is a
+source of in the topology (see migrationSources).
+"""
+class IslandModel:
+
+    def __init__(self, trainerKwargs, evalFunc, evalArgs=(), tasks=['task'],
+            topology="ring", migrationInterval=5, numMigrants=2, seed=None):
+        self.tasks = list(tasks)
+        self.sources = migrationSources(topology, len(trainerKwargs))
+        self.migrationInterval = migrationInterval
+        self.numMigrants = numMigrants
+        self.immigrants = [[] for kwargs in trainerKwargs] # for the next epoch
+        self.stats = [[] for kwargs in trainerKwargs] # fitness stats per generation
+        self.workers = []
+        self.conns = []
+
+        for i, kwargs in enumerate(trainerKwargs):
+            parentConn, childConn = mp.Pipe()
+            worker = mp.Process(target=islandLoop, args=(childConn, kwargs, self.tasks,
+                evalFunc, tuple(evalArgs), numMigrants,
+                None if seed is None else seed*len(trainerKwargs) + i), daemon=True)
+            worker.start()
+            childConn.close()
+            self.workers.append(worker)
+            self.conns.append(parentConn)
+
+    """
+    Evolves every island for numEpochs times migrationInterval generations, with
+    migration after each migrationInterval generations. Returns the fitness
+    stats of each island so far, one dict per generation.
+    """
+    def run(self, numEpochs):
+        for epoch in range(numEpochs):
+            for conn, immigrants in zip(self.conns, self.immigrants):
+                conn.send(("generations", self.migrationInterval, immigrants))
+
+            emigrants = []
+            for i, conn in enumerate(self.conns):
+                msg = conn.recv()
+                self.stats[i] += msg[1]
+                emigrants.append(msg[2])
+
+            self.immigrants = [[team for source in sources for team in emigrants[source]]
+                                for sources in self.sources]
+
+        return self.stats
+
+    """
+    The best root team over all islands and its outcomes, going by the first
+    task.
+    """
+    def getChampion(self):
+        for conn in self.conns:
+            conn.send(("champion",))
+        champions = [conn.recv()[1:] for conn in self.conns]
+
+        return max(champions, key=lambda champion: champion[1][self.tasks[0]])
+
+    """
+    Ids of the teams currently in each island's population.
+    """
+    def getTeamIds(self):
+        for conn in self.conns:
+            conn.send(("teamIds",))
+        return [conn.recv()[1] for conn in self.conns]
+
+    """
+    Problems with the graph of each island's population (see tpg.graph_check),
+    an empty list for each island whose graph is sound.
+    """
+    def checkGraphs(self):
+        for conn in self.conns:
+            conn.send(("checkGraph",))
+        return [conn.recv()[1] for conn in self.conns]
+
+    """
+    Stops all of the islands.
+    """
+    def close(self):
+        for conn in self.conns:
+            try:
+                conn.send(("stop",))
+                conn.close()
+            except (OSError, BrokenPipeError):
+                pass
+        for worker in self.workers:
+            worker.join(timeout=5)
+            if worker.is_alive():
+                worker.terminate()
+        self.workers = []
+        self.conns = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
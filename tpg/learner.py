@@ -266,6 +266,10 @@ inTeams:\n""".format(
             cls.bid = ConfLearner.bid_def
         elif functionsDict["bid"] == "mem":
             cls.bid = ConfLearner.bid_mem
+        elif functionsDict["bid"] == "def_counted":
+            cls.bid = ConfLearner.bid_def_counted
+        elif functionsDict["bid"] == "mem_counted":
+            cls.bid = ConfLearner.bid_mem_counted
 
         if functionsDict["getAction"] == "def":
             cls.getAction = ConfLearner.getAction_def
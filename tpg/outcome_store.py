@@ -0,0 +1,176 @@
+import numpy as np
+from collections.abc import MutableMapping
+
+"""
+Columnar storage of team outcomes. Every team gets a row and every task a column
+of a float matrix, NaN meaning the team has no outcome for that task. Teams keep
+using team.outcomes like a dict, which becomes a view onto their row.
+"""
+class OutcomeStore:
+
+    def __init__(self, capacity=64):
+        self.tasks = {} # task -> column
+        self.rows = {} # team id -> row
+        self.freeRows = []
+        self.nRows = 0 # rows ever handed out, rows past this are unused
+        self.values = np.full((capacity, 0), np.nan, dtype=np.float64)
+
+    """
+    Returns the column of the task, adding a new column if needed.
+    """
+    def addTask(self, task):
+        if task not in self.tasks:
+            self.tasks[task] = len(self.tasks)
+            if len(self.tasks) > self.values.shape[1]:
+                self.values = np.hstack((self.values,
+                    np.full((self.values.shape[0], max(1, self.values.shape[1])), np.nan)))
+
+        return self.tasks[task]
+
+    """
+    Gives the team a row and replaces its outcomes with a view onto that row,
+    keeping any outcomes it already had.
+    """
+    def addTeam(self, team):
+        if team.id in self.rows:
+            # already stored, possibly just needs its view back (e.g. after loading)
+            if not isinstance(team.outcomes, OutcomeView) or team.outcomes.store is not self:
+                team.outcomes = OutcomeView(self, team.id)
+            return
+
+        oldOutcomes = dict(team.outcomes)
+
+        if len(self.freeRows) > 0:
+            row = self.freeRows.pop()
+        else:
+            if self.nRows == self.values.shape[0]:
+                self.values = np.vstack((self.values,
+                    np.full(self.values.shape, np.nan)))
+            row = self.nRows
+            self.nRows += 1
+
+        self.rows[team.id] = row
+        team.outcomes = OutcomeView(self, team.id)
+        for task, outcome in oldOutcomes.items():
+            team.outcomes[task] = outcome
+
+    """
+    Removes the team from the store, leaving it with a plain dict of its outcomes.
+    """
+    def removeTeam(self, team):
+        if team.id not in self.rows:
+            return
+
+        team.outcomes = dict(team.outcomes)
+        row = self.rows.pop(team.id)
+        self.values[row] = np.nan
+        self.freeRows.append(row)
+
+    """
+    Row indices of the teams.
+    """
+    def rowsOf(self, teams):
+        return np.fromiter((self.rows[team.id] for team in teams),
+                            dtype=np.int64, count=len(teams))
+
+    """
+    Column indices of the tasks, -1 for tasks never seen.
+    """
+    def columnsOf(self, tasks):
+        return np.array([self.tasks.get(task, -1) for task in tasks], dtype=np.int64)
+
+    """
+    Outcomes of the teams at the tasks as a (teams, tasks) matrix, NaN where a
+    team has no outcome. Always returns a copy.
+    """
+    def matrix(self, teams, tasks):
+        rows = self.rowsOf(teams)
+        cols = self.columnsOf(tasks)
+        known = cols >= 0
+        result = np.full((len(rows), len(cols)), np.nan)
+        if known.any():
+            result[:, known] = self.values[np.ix_(rows, cols[known])]
+        return result
+
+    """
+    Outcomes of the teams at a single task, NaN where a team has no outcome.
+    """
+    def column(self, teams, task):
+        return self.matrix(teams, [task])[:,0]
+
+    """
+    Whether each team has an outcome for every one of the tasks.
+    """
+    def hasOutcomes(self, teams, tasks):
+        return ~np.isnan(self.matrix(teams, tasks)).any(axis=1)
+
+    """
+    Writes a whole (teams, tasks) matrix of outcomes at once, e.g. results from
+    workers. NaN entries are written too, clearing those outcomes. Team ids not
+    in the store are ignored.
+    """
+    def update(self, teamIds, tasks, values):
+        values = np.asarray(values, dtype=np.float64).reshape(len(teamIds), len(tasks))
+        cols = np.array([self.addTask(task) for task in tasks], dtype=np.int64)
+        keep = [i for i, teamId in enumerate(teamIds) if teamId in self.rows]
+        rows = np.array([self.rows[teamIds[i]] for i in keep], dtype=np.int64)
+        self.values[np.ix_(rows, cols)] = values[keep]
+
+    """
+    Single outcome of the team, NaN if it has none.
+    """
+    def get(self, teamId, task):
+        col = self.tasks.get(task, -1)
+        if col < 0:
+            return np.nan
+        return self.values[self.rows[teamId], col]
+
+    """
+    Sets a single outcome of the team.
+    """
+    def set(self, teamId, task, outcome):
+        col = self.addTask(task) # may grow the matrix
+        self.values[self.rows[teamId], col] = outcome
+
+"""
+Dict like view of one team's outcomes in an OutcomeStore. Pickles as a plain dict
+so agents sent to other processes don't carry the whole store, the trainer binds
+its teams back to the store after loading.
+"""
+class OutcomeView(MutableMapping):
+
+    def __init__(self, store, teamId):
+        self.store = store
+        self.teamId = teamId
+
+    def __getitem__(self, task):
+        outcome = self.store.get(self.teamId, task)
+        if np.isnan(outcome):
+            raise KeyError(task)
+        return float(outcome)
+
+    def __setitem__(self, task, outcome):
+        self.store.set(self.teamId, task, outcome)
+
+    def __delitem__(self, task):
+        if task not in self:
+            raise KeyError(task)
+        self.store.set(self.teamId, task, np.nan)
+
+    def __contains__(self, task):
+        return not np.isnan(self.store.get(self.teamId, task))
+
+    def __iter__(self):
+        row = self.store.values[self.store.rows[self.teamId]]
+        return iter([task for task, col in self.store.tasks.items()
+                        if not np.isnan(row[col])])
+
+    def __len__(self):
+        return int(np.count_nonzero(~np.isnan(
+            self.store.values[self.store.rows[self.teamId], :len(self.store.tasks)])))
+
+    def __repr__(self):
+        return repr(dict(self))
+
+    def __reduce__(self):
+        return (dict, (dict(self),))
@@ -4,6 +4,7 @@ from numba import njit
 import math
 import copy
 from tpg.utils import flip
+from tpg.serialization import reduceWithBuffers
 import uuid
 
 """
@@ -26,6 +27,13 @@ class Program:
 
         self.id = uuid.uuid4()
 
+    """
+    With pickle protocol 5 the instructions go out of band (see
+    tpg.serialization).
+    """
+    def __reduce_ex__(self, protocol):
+        return reduceWithBuffers(self, protocol, ["instructions"])
+
     '''
     A program is equal to another object if that object:
         - is an instance of the program class
@@ -0,0 +1,284 @@
+from numba import njit
+import numpy as np
+
+"""
+Vectorized scoring backends for multi-objective fitness. Everything here works
+on an outcome matrix of shape (number of teams, number of tasks) where higher
+outcomes are better, row i being the outcomes of team i.
+"""
+
+"""
+Counts, for each team, how many other teams it is at-least as good as on every
+task (weak dominance).
+"""
+@njit
+def _weakDominanceCounts(outcomes):
+    n, m = outcomes.shape
+    counts = np.zeros(n, dtype=np.int64)
+    for i in range(n):
+        for j in range(i+1, n):
+            iGe = True # i >= j on all tasks so far
+            jGe = True # j >= i on all tasks so far
+            for k in range(m):
+                if outcomes[i,k] < outcomes[j,k]:
+                    iGe = False
+                elif outcomes[i,k] > outcomes[j,k]:
+                    jGe = False
+                if not iGe and not jGe:
+                    break
+            if iGe:
+                counts[i] += 1
+            if jGe:
+                counts[j] += 1
+
+    return counts
+
+"""
+Counts, for each team, how many other teams are strictly better than it on
+every task.
+"""
+@njit
+def _strictlyBeatenCounts(outcomes):
+    n, m = outcomes.shape
+    counts = np.zeros(n, dtype=np.int64)
+    for i in range(n):
+        for j in range(i+1, n):
+            iGt = True # i > j on all tasks so far
+            jGt = True # j > i on all tasks so far
+            for k in range(m):
+                if outcomes[i,k] <= outcomes[j,k]:
+                    iGt = False
+                if outcomes[j,k] <= outcomes[i,k]:
+                    jGt = False
+                if not iGt and not jGt:
+                    break
+            if iGt:
+                counts[j] += 1
+            if jGt:
+                counts[i] += 1
+
+    return counts
+
+"""
+Fast non-dominated sort (Deb et al. 2002). Returns the front index of each team,
+0 being the non-dominated front. Uses an n*n boolean matrix for the domination
+sets, so memory grows quadratically with the number of teams.
+"""
+@njit
+def _nonDominatedRanks(outcomes):
+    n, m = outcomes.shape
+    dominates = np.zeros((n, n), dtype=np.bool_)
+    dominatedCount = np.zeros(n, dtype=np.int64)
+    for i in range(n):
+        for j in range(i+1, n):
+            iGe = True
+            jGe = True
+            for k in range(m):
+                if outcomes[i,k] < outcomes[j,k]:
+                    iGe = False
+                elif outcomes[i,k] > outcomes[j,k]:
+                    jGe = False
+                if not iGe and not jGe:
+                    break
+            # equal on every task means neither dominates
+            if iGe and not jGe:
+                dominates[i,j] = True
+                dominatedCount[j] += 1
+            elif jGe and not iGe:
+                dominates[j,i] = True
+                dominatedCount[i] += 1
+
+    ranks = np.full(n, -1, dtype=np.int64)
+    front = np.flatnonzero(dominatedCount == 0)
+    rank = 0
+    while len(front) > 0:
+        nextFront = np.empty(n, dtype=np.int64)
+        nNext = 0
+        for p in front:
+            ranks[p] = rank
+            for q in range(n):
+                if dominates[p,q]:
+                    dominatedCount[q] -= 1
+                    if dominatedCount[q] == 0:
+                        nextFront[nNext] = q
+                        nNext += 1
+        front = nextFront[:nNext]
+        rank += 1
+
+    return ranks
+
+"""
+Returns the number of other teams each team weakly dominates.
+"""
+def paretoDominateCounts(outcomes):
+    return _weakDominanceCounts(np.ascontiguousarray(outcomes, dtype=np.float64))
+
+"""
+Returns the number of other teams that strictly beat each team on all tasks.
+"""
+def paretoBeatenCounts(outcomes):
+    return _strictlyBeatenCounts(np.ascontiguousarray(outcomes, dtype=np.float64))
+
+"""
+Returns the pareto front index of every team, 0 being the best front.
+"""
+def nonDominatedSort(outcomes):
+    return _nonDominatedRanks(np.ascontiguousarray(outcomes, dtype=np.float64))
+
+"""
+Crowding distance of each team within its own front. Boundary teams of a front
+get infinity, as do teams in fronts of size two or less.
+"""
+def crowdingDistance(outcomes, ranks):
+    outcomes = np.asarray(outcomes, dtype=np.float64)
+    ranks = np.asarray(ranks)
+    n, m = outcomes.shape
+    distances = np.zeros(n, dtype=np.float64)
+    if n == 0:
+        return distances
+
+    for k in range(m):
+        # sort by front first then by this task's outcome
+        order = np.lexsort((outcomes[:,k], ranks))
+        vals = outcomes[order,k]
+        fronts = ranks[order]
+
+        # start and end position of each front in the sorted order
+        starts = np.flatnonzero(np.r_[True, fronts[1:] != fronts[:-1]])
+        ends = np.r_[starts[1:]-1, n-1]
+        spans = np.repeat(vals[ends] - vals[starts], ends - starts + 1)
+
+        # interior points get the normalized gap between their neighbours
+        contrib = np.zeros(n, dtype=np.float64)
+        if n > 2:
+            gaps = vals[2:] - vals[:-2]
+            contrib[1:-1] = np.divide(gaps, spans[1:-1],
+                out=np.zeros(n-2), where=spans[1:-1] > 0)
+        contrib[starts] = np.inf
+        contrib[ends] = np.inf
+
+        distances[order] += contrib
+
+    return distances
+
+"""
+Single fitness value from pareto front and crowding distance, higher is better.
+Teams in better fronts always outrank worse fronts, and within a front the more
+isolated teams rank higher.
+"""
+def paretoRankFitness(outcomes):
+    ranks = nonDominatedSort(outcomes)
+    distances = crowdingDistance(outcomes, ranks)
+    # squash distance into [0, 0.5] so it only breaks ties within a front
+    finite = np.isfinite(distances)
+    crowding = np.full(len(distances), 0.5)
+    crowding[finite] = 0.5*distances[finite]/(1.0 + distances[finite])
+    return (ranks.max(initial=0) - ranks) + crowding
+
+"""
+Runs nSelect lexicase selection events over the outcome matrix, returning the
+index of the team chosen by each event. A team survives a case if its outcome
+is within epsilons[case] of the best remaining outcome on that case, all zeros
+gives standard lexicase. If staticOrder, every event uses the same shuffled
+case order, else each event gets a fresh one.
+"""
+@njit
+def _lexicaseSelect(outcomes, nSelect, epsilons, seed, staticOrder):
+    np.random.seed(seed)
+    n, m = outcomes.shape
+    selected = np.empty(nSelect, dtype=np.int64)
+    candidates = np.empty(n, dtype=np.int64)
+
+    # best on each case over everyone, saves a pass for the first case
+    colMax = np.empty(m, dtype=np.float64)
+    for c in range(m):
+        colMax[c] = outcomes[:,c].max()
+
+    order = np.arange(m)
+    np.random.shuffle(order)
+
+    for s in range(nSelect):
+        if not staticOrder:
+            np.random.shuffle(order)
+
+        for i in range(n):
+            candidates[i] = i
+        nCand = n
+
+        for c in order:
+            if nCand == 1:
+                break
+
+            if nCand == n:
+                best = colMax[c]
+            else:
+                best = outcomes[candidates[0],c]
+                for i in range(1, nCand):
+                    if outcomes[candidates[i],c] > best:
+                        best = outcomes[candidates[i],c]
+
+            # compact the survivors of this case to the front
+            threshold = best - epsilons[c]
+            nKeep = 0
+            for i in range(nCand):
+                if outcomes[candidates[i],c] >= threshold:
+                    candidates[nKeep] = candidates[i]
+                    nKeep += 1
+            nCand = nKeep
+
+        selected[s] = candidates[np.random.randint(nCand)]
+
+    return selected
+
+"""
+Median absolute deviation of each case, the automatic epsilon of epsilon
+lexicase (La Cava et al. 2016).
+"""
+def medianAbsoluteDeviation(outcomes):
+    outcomes = np.asarray(outcomes, dtype=np.float64)
+    return np.median(np.abs(outcomes - np.median(outcomes, axis=0)), axis=0)
+
+"""
+Returns the indices of the teams picked by nSelect lexicase selection events.
+epsilon is None for standard lexicase, "auto" for median absolute deviation
+epsilons, or a number / per case array of epsilons.
+"""
+def lexicaseSelect(outcomes, nSelect, epsilon=None, seed=0, staticOrder=False):
+    outcomes = np.ascontiguousarray(outcomes, dtype=np.float64)
+    if epsilon is None:
+        epsilons = np.zeros(outcomes.shape[1])
+    elif isinstance(epsilon, str) and epsilon == "auto":
+        epsilons = medianAbsoluteDeviation(outcomes)
+    else:
+        epsilons = np.broadcast_to(np.asarray(epsilon, dtype=np.float64),
+                                    (outcomes.shape[1],)).copy()
+
+    if len(outcomes) == 0 or nSelect <= 0:
+        return np.zeros(0, dtype=np.int64)
+
+    return _lexicaseSelect(outcomes, nSelect, epsilons, seed, staticOrder)
+
+"""
+Single fitness value from lexicase selection, higher is better. Each team
+scores the number of times it was selected over nSelect events (defaults to one
+per team), ties are broken by average normalized outcome.
+"""
+def lexicaseFitness(outcomes, nSelect=None, epsilon=None, seed=0, staticOrder=False):
+    outcomes = np.asarray(outcomes, dtype=np.float64)
+    n = len(outcomes)
+    if nSelect is None:
+        nSelect = n
+
+    selected = lexicaseSelect(outcomes, nSelect, epsilon=epsilon, seed=seed,
+                                staticOrder=staticOrder)
+    counts = np.bincount(selected, minlength=n).astype(np.float64)
+
+    # squash average normalized outcome into [0, 0.5] to only break ties
+    if n > 0:
+        mins = outcomes.min(axis=0)
+        spans = outcomes.max(axis=0) - mins
+        normalized = np.divide(outcomes - mins, spans, out=np.zeros(outcomes.shape),
+                                where=spans > 0)
+        counts += 0.5*normalized.mean(axis=1)
+
+    return counts
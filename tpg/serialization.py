@@ -0,0 +1,155 @@
+import numpy as np
+import mmap
+import os
+import pickle
+import struct
+
+"""
+Pickling with protocol 5 out-of-band buffers. Objects holding large numpy
+arrays (programs' instructions) reduce to their other attributes plus a
+PickleBuffer per array, so the arrays aren't copied into the pickle stream.
+Files keep the buffers after the pickle and can be loaded by mapping them,
+connections get the pickle and then all the buffers in one message.
+"""
+
+MAGIC = b"TPGPKL5\0"
+
+"""
+For __reduce_ex__ of objects with numpy array attributes, arrayNames. Protocols
+before 5 fall back to the default reduce.
+"""
+def reduceWithBuffers(obj, protocol, arrayNames):
+    if protocol < 5:
+        return object.__reduce_ex__(obj, protocol)
+
+    state = dict(obj.__dict__)
+    arrays = {}
+    for name in arrayNames:
+        array = np.ascontiguousarray(state.pop(name))
+        arrays[name] = (pickle.PickleBuffer(array), array.dtype.str, array.shape)
+
+    return (rebuildWithBuffers, (type(obj), state, arrays))
+
+"""
+Inverse of reduceWithBuffers. Arrays view the buffers they came in, which are
+read only if the buffers are (e.g. received bytes).
+"""
+def rebuildWithBuffers(cls, state, arrays):
+    obj = cls.__new__(cls)
+    obj.__dict__.update(state)
+    for name, (buffer, dtype, shape) in arrays.items():
+        setattr(obj, name, np.frombuffer(buffer, dtype=dtype).reshape(shape))
+
+    return obj
+
+"""
+Pickles the object, returning the pickle and the list of its out-of-band
+buffers.
+"""
+def dumps(obj):
+    buffers = []
+    payload = pickle.dumps(obj, protocol=5, buffer_callback=buffers.append)
+    return payload, buffers
+
+def loads(payload, buffers):
+    return pickle.loads(payload, buffers=buffers)
+
+"""
+Offsets of the buffers laid out one after the other from start, each aligned
+to 64 bytes, and the end of the last one.
+"""
+def bufferLayout(raws, start=0):
+    layout = []
+    offset = start
+    for raw in raws:
+        offset = (offset + 63) // 64 * 64
+        layout.append((offset, raw.nbytes))
+        offset += raw.nbytes
+
+    return layout, offset
+
+"""
+Saves the object to the file: a header with the layout, the pickle, then each
+buffer aligned to 64 bytes. It is written to a temporary file next to it which
+then replaces it, so the file is never truncated under anything that has it
+mapped (e.g. the object being saved, if loaded from it with useMmap).
+"""
+def saveFile(obj, fileName):
+    payload, buffers = dumps(obj)
+    raws = [buffer.raw() for buffer in buffers]
+    layout, end = bufferLayout(raws, len(MAGIC) + 16 + 16*len(raws) + len(payload))
+
+    tmpName = "{}.{}.tmp".format(fileName, os.getpid())
+    try:
+        with open(tmpName, "wb") as f:
+            f.write(MAGIC)
+            f.write(struct.pack("<QQ", len(payload), len(raws)))
+            for start, size in layout:
+                f.write(struct.pack("<QQ", start, size))
+            f.write(payload)
+            for (start, size), raw in zip(layout, raws):
+                f.write(bytes(start - f.tell()))
+                f.write(raw)
+        os.replace(tmpName, fileName)
+    except BaseException:
+        if os.path.exists(tmpName):
+            os.remove(tmpName)
+        raise
+
+"""
+Loads an object saved by saveFile, or a plain pickle. With useMmap the buffers
+are mapped from the file copy on write rather than read, so arrays cost no
+memory until written to, but the file must not be truncated or rewritten in
+place while the object is in use.
+"""
+def loadFile(fileName, useMmap=False):
+    with open(fileName, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            f.seek(0)
+            return pickle.load(f)
+
+        payloadSize, numBuffers = struct.unpack("<QQ", f.read(16))
+        layout = [struct.unpack("<QQ", f.read(16)) for i in range(numBuffers)]
+        payload = f.read(payloadSize)
+        if numBuffers == 0:
+            return loads(payload, [])
+
+        if useMmap:
+            data = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY))
+        else:
+            f.seek(0)
+            data = memoryview(bytearray(f.read()))
+
+    return loads(payload, [data[start:start+size] for start, size in layout])
+
+"""
+Sends the object over the connection as the pickle and one message with all
+of its buffers, which the receiver (recvObject) uses in place. Pass the result
+of pickleForSend as pickled to send the same object to many connections while
+only pickling it once.
+"""
+def sendObject(conn, obj=None, pickled=None):
+    header, payload, data = pickleForSend(obj) if pickled is None else pickled
+    conn.send_bytes(header)
+    conn.send_bytes(payload)
+    conn.send_bytes(data)
+
+def pickleForSend(obj):
+    payload, buffers = dumps(obj)
+    raws = [buffer.raw() for buffer in buffers]
+    layout, end = bufferLayout(raws)
+    data = bytearray(end)
+    for (start, size), raw in zip(layout, raws):
+        data[start:start+size] = raw
+
+    header = struct.pack("<Q", len(layout)) + b"".join(
+        struct.pack("<QQ", start, size) for start, size in layout)
+    return header, payload, data
+
+def recvObject(conn):
+    header = conn.recv_bytes()
+    numBuffers = struct.unpack("<Q", header[:8])[0]
+    layout = [struct.unpack("<QQ", header[8+16*i:24+16*i]) for i in range(numBuffers)]
+    payload = conn.recv_bytes()
+    data = memoryview(conn.recv_bytes())
+    return loads(payload, [data[start:start+size] for start, size in layout])
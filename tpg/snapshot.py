@@ -0,0 +1,359 @@
+from tpg.agent import Agent
+from tpg.evaluation import reachableTeams, buildProgram, buildLearner, buildTeam, freshActVars
+from multiprocessing import shared_memory
+import numpy as np
+import mmap
+import pickle
+import struct
+import uuid
+
+"""
+Flat, array based snapshot of a population. Programs live in one instruction
+arena, the team -> learner graph is in CSR form and learner actions are in
+action tables, so the whole population is a handful of numpy arrays which can be
+placed in shared memory and read by many processes without copying.
+"""
+
+"""
+Uuid from the bytes stored in an S16 array (numpy drops trailing null bytes).
+"""
+def idFromBytes(idBytes):
+    return uuid.UUID(bytes=bytes(idBytes).ljust(16, b"\0"))
+
+"""
+Population as flat arrays, possibly living in shared memory. The arrays are:
+    teamIds, learnerIds: uuid bytes of each team / learner.
+    teamOrder: argsort of teamIds, for looking up teams by id.
+    teamLearnerPtr, teamLearners: CSR of the learners of each team.
+    learnerProgram, learnerActionProgram: program index of the bid program and
+        the real action program (-1 if none) of each learner.
+    learnerActionCode, learnerActionTeam: action of each learner, either an
+        action code or a team index (the other being -1).
+    programPtr, instructions: instruction arena, program p is
+        instructions[programPtr[p]:programPtr[p+1]].
+    teamOutcomeMatrix: only if taken with tasks, outcome of each team at each task
+        (nan if it has none).
+"""
+class PopulationSnapshot:
+
+    def __init__(self, arrays, shm=None, owner=False, mapped=None, meta=None):
+        self.arrays = arrays
+        self.shm = shm # shared memory the arrays live in, if any
+        self.owner = owner # whether to unlink the shared memory on close
+        self.mapped = mapped # mapped file the arrays live in, if any
+        self.meta = {} if meta is None else meta
+        self.descriptor = None if shm is None else (shm.name, self.layout())
+
+    def __getattr__(self, name):
+        arrays = self.__dict__.get("arrays")
+        if arrays is not None and name in arrays:
+            return arrays[name]
+        raise AttributeError(name)
+
+    """
+    Snapshot of the population reachable from the teams. rootTeams are flagged
+    as roots. With tasks, the teams' outcomes at them are kept too.
+    """
+    @staticmethod
+    def fromTeams(teams, rootTeams=(), tasks=None):
+        teams = reachableTeams(teams)
+        teamIndex = {team.id: i for i, team in enumerate(teams)}
+        rootIds = set(team.id for team in rootTeams)
+
+        learners = []
+        learnerIndex = {}
+        teamLearners = []
+        teamLearnerPtr = [0]
+        for team in teams:
+            for learner in team.learners:
+                if learner.id not in learnerIndex:
+                    learnerIndex[learner.id] = len(learners)
+                    learners.append(learner)
+                teamLearners.append(learnerIndex[learner.id])
+            teamLearnerPtr.append(len(teamLearners))
+
+        nLearners = len(learners)
+        programs = []
+        learnerProgram = np.empty(nLearners, dtype=np.int64)
+        learnerActionCode = np.full(nLearners, -1, dtype=np.int64)
+        learnerActionTeam = np.full(nLearners, -1, dtype=np.int32)
+        learnerActionLength = np.full(nLearners, -1, dtype=np.int32)
+        learnerActionProgram = np.full(nLearners, -1, dtype=np.int64)
+        learnerNActRegisters = np.zeros(nLearners, dtype=np.int32)
+        for i, learner in enumerate(learners):
+            learnerProgram[i] = len(programs)
+            programs.append(learner.program.instructions)
+
+            actionObj = learner.actionObj
+            if actionObj.isAtomic():
+                learnerActionCode[i] = actionObj.actionCode
+            else:
+                learnerActionTeam[i] = teamIndex[actionObj.teamAction.id]
+
+            # real actions carry their own program
+            if getattr(actionObj, "program", None) is not None:
+                learnerActionProgram[i] = len(programs)
+                programs.append(actionObj.program.instructions)
+                learnerNActRegisters[i] = len(actionObj.registers)
+                if actionObj.actionLength is not None:
+                    learnerActionLength[i] = actionObj.actionLength
+
+        teamIds = np.array([team.id.bytes for team in teams], dtype="S16")
+        arrays = {
+            "teamIds": teamIds,
+            "teamOrder": np.argsort(teamIds, kind="stable"),
+            "teamGen": np.array([team.genCreate for team in teams], dtype=np.int32),
+            "teamRoot": np.array([team.id in rootIds for team in teams], dtype=np.bool_),
+            "teamLearnerPtr": np.array(teamLearnerPtr, dtype=np.int64),
+            "teamLearners": np.array(teamLearners, dtype=np.int32),
+            "learnerIds": np.array([learner.id.bytes for learner in learners], dtype="S16"),
+            "learnerGen": np.array([learner.genCreate for learner in learners], dtype=np.int32),
+            "learnerNRegisters": np.array([len(learner.registers) for learner in learners],
+                                            dtype=np.int32),
+            "learnerProgram": learnerProgram,
+            "learnerActionCode": learnerActionCode,
+            "learnerActionTeam": learnerActionTeam,
+            "learnerActionLength": learnerActionLength,
+            "learnerActionProgram": learnerActionProgram,
+            "learnerNActRegisters": learnerNActRegisters,
+            "programPtr": np.concatenate(([0], np.cumsum([len(p) for p in programs],
+                                                            dtype=np.int64))).astype(np.int64),
+            "instructions": (np.concatenate(programs).astype(np.int32) if len(programs) > 0
+                                else np.zeros((0, 4), dtype=np.int32)),
+        }
+        if tasks is not None:
+            arrays["teamOutcomeMatrix"] = np.array([[team.outcomes[task] if task in team.outcomes
+                else np.nan for task in tasks] for team in teams],
+                dtype=np.float64).reshape(len(teams), len(tasks))
+
+        return PopulationSnapshot(arrays, meta={"tasks": None if tasks is None else list(tasks)})
+
+    @property
+    def numTeams(self):
+        return len(self.arrays["teamIds"])
+
+    @property
+    def numLearners(self):
+        return len(self.arrays["learnerIds"])
+
+    """
+    Index of the team with the given id (uuid), or -1 if not in the snapshot.
+    """
+    def teamIndex(self, teamId):
+        teamIds = self.arrays["teamIds"]
+        order = self.arrays["teamOrder"]
+        key = np.array([teamId.bytes], dtype="S16")
+        pos = np.searchsorted(teamIds, key, sorter=order)[0]
+        if pos < len(order) and teamIds[order[pos]] == key[0]:
+            return int(order[pos])
+        return -1
+
+    """
+    Team ids of the root teams.
+    """
+    def rootIds(self):
+        return [idFromBytes(b) for b in self.arrays["teamIds"][self.arrays["teamRoot"]]]
+
+    """
+    Outcomes of the team with the given id, by task (only if the snapshot was
+    taken with tasks).
+    """
+    def teamOutcomes(self, teamId):
+        t = self.teamIndex(teamId)
+        if t < 0:
+            raise Exception("Team not in snapshot", teamId)
+        return {task: float(outcome) for task, outcome
+                    in zip(self.meta["tasks"], self.arrays["teamOutcomeMatrix"][t])
+                    if not np.isnan(outcome)}
+
+    """
+    Indices of all teams reachable from the team at index root (including it).
+    """
+    def reachableTeamIndices(self, root):
+        ptr = self.arrays["teamLearnerPtr"]
+        teamLearners = self.arrays["teamLearners"]
+        actionTeam = self.arrays["learnerActionTeam"]
+
+        seen = {root}
+        stack = [root]
+        while len(stack) > 0:
+            t = stack.pop()
+            for l in teamLearners[ptr[t]:ptr[t+1]]:
+                child = actionTeam[l]
+                if child >= 0 and child not in seen:
+                    seen.add(child)
+                    stack.append(child)
+
+        return sorted(seen)
+
+    """
+    Builds fresh team, learner and program objects for the graph reachable from
+    the team with the given id. Programs are views into the instruction arena,
+    so nothing but the small python objects gets copied.
+    """
+    def buildTeam(self, teamId):
+        root = self.teamIndex(teamId)
+        if root < 0:
+            raise Exception("Team not in snapshot", teamId)
+
+        a = self.arrays
+        teamIdxs = self.reachableTeamIndices(root)
+        teams = {t: buildTeam(idFromBytes(a["teamIds"][t]), int(a["teamGen"][t]))
+                    for t in teamIdxs}
+
+        learners = {}
+        for t in teamIdxs:
+            for l in a["teamLearners"][a["teamLearnerPtr"][t]:a["teamLearnerPtr"][t+1]]:
+                if l not in learners:
+                    learners[l] = self.buildLearner(l)
+                    actionTeam = a["learnerActionTeam"][l]
+                    if actionTeam >= 0:
+                        learners[l].actionObj.teamAction = teams[actionTeam]
+                teams[t].learners.append(learners[l])
+
+        return teams[root]
+
+    def buildLearner(self, l):
+        a = self.arrays
+        program = self.buildProgram(a["learnerProgram"][l])
+        actionProgram = None
+        if a["learnerActionProgram"][l] >= 0:
+            actionProgram = self.buildProgram(a["learnerActionProgram"][l])
+        actionCode = int(a["learnerActionCode"][l]) if a["learnerActionCode"][l] >= 0 else None
+        actionLength = int(a["learnerActionLength"][l]) if a["learnerActionLength"][l] >= 0 else None
+
+        return buildLearner(idFromBytes(a["learnerIds"][l]), program, actionCode,
+            int(a["learnerNRegisters"][l]), int(a["learnerGen"][l]), actionLength,
+            actionProgram, int(a["learnerNActRegisters"][l]))
+
+    def buildProgram(self, p):
+        ptr = self.arrays["programPtr"]
+        return buildProgram(None, self.arrays["instructions"][ptr[p]:ptr[p+1]])
+
+    """
+    Gets an agent for the root team with the given id. functionsDict and actVars
+    default to those saved with the snapshot (see Trainer.saveSnapshot).
+    """
+    def getAgent(self, teamId, functionsDict=None, actVars=None, num=0):
+        if functionsDict is None:
+            functionsDict = self.meta["functionsDict"]
+        if actVars is None:
+            actVars = self.meta["actVars"]
+        return Agent(self.buildTeam(teamId), functionsDict, num=num,
+                    actVars=freshActVars(actVars))
+
+    """
+    Offsets, dtypes and shapes of the arrays when packed into one buffer, each
+    aligned to 64 bytes.
+    """
+    def layout(self):
+        layout = {}
+        offset = 0
+        for name, array in self.arrays.items():
+            offset = (offset + 63)//64*64
+            layout[name] = (offset, array.dtype.str, array.shape)
+            offset += array.nbytes
+
+        return layout
+
+    """
+    Copies the snapshot into a new block of shared memory, returning the shared
+    snapshot. Other processes attach to it with PopulationSnapshot.attach and
+    its descriptor. The returned snapshot owns the memory, close it when no
+    longer needed.
+    """
+    def publish(self):
+        layout = self.layout()
+        size = max(1, max([offset + np.dtype(dtype).itemsize*int(np.prod(shape))
+                            for offset, dtype, shape in layout.values()], default=1))
+        shm = shared_memory.SharedMemory(create=True, size=size)
+        arrays = {}
+        for name, (offset, dtype, shape) in layout.items():
+            arrays[name] = np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset)
+            arrays[name][...] = self.arrays[name]
+            arrays[name].flags.writeable = False
+
+        return PopulationSnapshot(arrays, shm=shm, owner=True)
+
+    """
+    Attaches to a snapshot published by another process, read only and without
+    copying.
+    """
+    @staticmethod
+    def attach(descriptor):
+        name, layout = descriptor
+        shm = shared_memory.SharedMemory(name=name)
+        arrays = {}
+        for field, (offset, dtype, shape) in layout.items():
+            arrays[field] = np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset)
+            arrays[field].flags.writeable = False
+
+        return PopulationSnapshot(arrays, shm=shm, owner=False)
+
+    """
+    Saves the snapshot to the file, along with meta (anything picklable), for
+    openSnapshot. The arrays are laid out as in layout after a small header.
+    """
+    def saveToFile(self, fileName, meta=None):
+        meta = dict(self.meta, **({} if meta is None else meta))
+        layout = self.layout()
+        header = pickle.dumps((layout, meta))
+        start = (len(SNAPSHOT_MAGIC) + 8 + len(header) + 63)//64*64
+
+        with open(fileName, "wb") as f:
+            f.write(SNAPSHOT_MAGIC)
+            f.write(struct.pack("<Q", len(header)))
+            f.write(header)
+            for name, (offset, dtype, shape) in layout.items():
+                f.write(bytes(start + offset - f.tell()))
+                f.write(np.ascontiguousarray(self.arrays[name]).tobytes())
+
+    """
+    Detaches from the shared memory or mapped file, and frees the shared memory
+    if this is the publisher. Agents built from the snapshot should be done
+    with by now.
+    """
+    def close(self):
+        if self.mapped is not None:
+            self.arrays = None
+            try:
+                self.mapped.close()
+            except BufferError:
+                pass # still viewed by some agent, unmapped once that is collected
+            self.mapped = None
+            return
+
+        if self.shm is None:
+            return
+
+        self.arrays = None
+        try:
+            self.shm.close()
+        except BufferError:
+            pass # still viewed by some agent, unmapped once that is collected
+        if self.owner:
+            self.shm.unlink()
+        self.shm = None
+
+SNAPSHOT_MAGIC = b"TPGSNAP\0"
+
+"""
+Opens a snapshot saved with PopulationSnapshot.saveToFile. Only the header is
+read, the arrays are mapped read only from the file, so opening is quick
+however large the population and building a team (getAgent, buildTeam) only
+pages in the parts of the arrays its graph uses.
+"""
+def openSnapshot(fileName):
+    with open(fileName, "rb") as f:
+        if f.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+            raise Exception("Not a population snapshot file", fileName)
+        headerSize = struct.unpack("<Q", f.read(8))[0]
+        layout, meta = pickle.loads(f.read(headerSize))
+        start = (len(SNAPSHOT_MAGIC) + 8 + headerSize + 63)//64*64
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    arrays = {}
+    for name, (offset, dtype, shape) in layout.items():
+        arrays[name] = np.ndarray(shape, dtype=dtype, buffer=mapped, offset=start + offset)
+
+    return PopulationSnapshot(arrays, mapped=mapped, meta=meta)
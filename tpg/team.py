@@ -118,11 +118,12 @@ class Team:
                 if lrnr.isActionAtomic() or str(lrnr.getActionTeam().id) not in visited]
 
 
-        top_learner = max(valid_learners,
-            key=lambda lrnr: lrnr.bid(state, actVars=actVars))
-    
+        bids = [lrnr.bid(state, actVars=actVars) for lrnr in valid_learners]
+        top = max(range(len(bids)), key=bids.__getitem__)
+        top_learner = valid_learners[top]
+
         # If we're tracing this path
-        if path_trace != None:
+        if isinstance(path_trace, list):
             
             last_segment = path_trace[-1] if len(path_trace) != 0 else None
 
@@ -130,23 +131,31 @@ class Team:
             path_segment =  {
                 'team_id': str(self.id),
                 'top_learner': str(top_learner.id),
-                'top_bid': top_learner.bid(state, actVars=actVars),
+                'top_bid': bids[top],
                 'top_action': top_learner.actionObj.actionCode if top_learner.isActionAtomic() else str(top_learner.actionObj.teamAction.id),
                 'depth': last_segment['depth'] + 1 if last_segment != None else 0,# Record path depth
                 'bids': []
             }
 
             # Populate bid values
-            for cursor in valid_learners:
+            for cursor, bid in zip(valid_learners, bids):
                 path_segment['bids'].append({
                     'learner_id': str(cursor.id),
-                    'bid': cursor.bid(state, actVars=actVars),
+                    'bid': bid,
                     'action': cursor.actionObj.actionCode if cursor.isActionAtomic() else str(cursor.actionObj.teamAction.id)
                 })
 
             # Append our path segment to the trace
             path_trace.append(path_segment)
 
+        # Or recording it with a tpg.trace.DecisionTracer
+        elif path_trace != None:
+            path_trace.record(self, valid_learners, bids, top)
+
+        # count the win, see tpg.counters
+        if actVars is not None and "counters" in actVars:
+            actVars["counters"].countWin(top_learner, self)
+
         return top_learner.getAction(state, visited=visited, actVars=actVars, path_trace=path_trace) 
 
     """
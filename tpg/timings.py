@@ -0,0 +1,117 @@
+from collections import deque, namedtuple
+import numpy as np
+import time
+
+"""
+Timing of the phases of evolution. Phases are timed with perf_counter_ns spans,
+which can nest (a span named "mutate" inside "generate" is the phase
+"generate/mutate"), and are summed up per generation with a histogram of how
+long each span of the phase took.
+"""
+
+"""
+Timings of one phase over a generation, in nanoseconds. histogram[b] counts the
+spans that took between 2**b and 2**(b+1) nanoseconds.
+"""
+PhaseStats = namedtuple("PhaseStats", ["count", "total", "min", "max", "histogram"])
+
+HISTOGRAM_BINS = 64
+
+class Span:
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.timer.stack.append(self.name)
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *args):
+        elapsed = time.perf_counter_ns() - self.start
+        stack = self.timer.stack
+        self.timer.current.setdefault("/".join(stack), []).append(elapsed)
+        stack.pop()
+
+"""
+Stands in for spans while timing is disabled.
+"""
+class NoSpan:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+NO_SPAN = NoSpan()
+
+"""
+Times phases when enabled, otherwise spans cost one call and a check. history
+holds the per generation stats, the last maxHistory generations of them if
+given, as (generation, {phase: PhaseStats}).
+"""
+class PhaseTimer:
+
+    def __init__(self, enabled=False, maxHistory=None):
+        self.enabled = enabled
+        self.history = deque(maxlen=maxHistory)
+        self.current = {} # phase -> durations of its spans this generation
+        self.stack = [] # names of the open spans
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    """
+    Context manager timing the phase name, within any phase already open.
+    """
+    def span(self, name):
+        if not self.enabled:
+            return NO_SPAN
+        return Span(self, name)
+
+    """
+    Sums up the spans since the last call as the stats of the generation.
+    """
+    def endGeneration(self, generation):
+        if len(self.current) == 0:
+            return
+
+        stats = {}
+        for phase, durations in self.current.items():
+            durations = np.array(durations, dtype=np.int64)
+            bins = np.log2(np.maximum(durations, 1)).astype(np.int64)
+            stats[phase] = PhaseStats(len(durations), int(durations.sum()),
+                int(durations.min()), int(durations.max()),
+                np.bincount(np.minimum(bins, HISTOGRAM_BINS-1), minlength=HISTOGRAM_BINS))
+
+        self.history.append((generation, stats))
+        self.current = {}
+
+    """
+    Total seconds spent in each phase, per generation in history (0 where a
+    generation didn't go through the phase).
+    """
+    def phaseTotals(self):
+        phases = sorted(set(phase for gen, stats in self.history for phase in stats))
+        return {phase: np.array([stats[phase].total/1e9 if phase in stats else 0.0
+                    for gen, stats in self.history]) for phase in phases}
+
+    """
+    Histogram of span durations of the phase, over all generations in history.
+    """
+    def histogram(self, phase):
+        histogram = np.zeros(HISTOGRAM_BINS, dtype=np.int64)
+        for gen, stats in self.history:
+            if phase in stats:
+                histogram += stats[phase].histogram
+        return histogram
+
+    def reset(self):
+        self.history.clear()
+        self.current = {}
+        self.stack = []
@@ -0,0 +1,130 @@
+import numpy as np
+
+"""
+Low overhead tracing of the decisions agents make. Instead of the nested dicts
+of path_trace, a DecisionTracer passed as path_trace to Agent.act writes fixed
+width records into preallocated arrays used as a ring buffer.
+"""
+
+"""
+Fields of the records, see DecisionTracer.records.
+"""
+TRACE_DTYPE = np.dtype([
+    ("frame", np.int64), # frame number, counted by the tracer
+    ("depth", np.int16), # depth of the team in the path taken that frame
+    ("team", np.int32), # team slot, see DecisionTracer.teamIds
+    ("learner", np.int32), # learner slot, see DecisionTracer.learnerIds
+    ("bid", np.float64),
+    ("top", np.bool_), # whether the learner won the bid
+    ("action", np.int64), # action code, -1 if the action is a team
+    ("actionTeam", np.int32), # team slot of the action, -1 if atomic
+])
+
+"""
+Records the path each traced frame takes through the graph: per team visited
+the winning learner, or with allBids every learner that bid. Only every
+sampleEvery-th frame is traced, the others act as if untraced. Once capacity
+records are written, the oldest get overwritten.
+
+Teams and learners are recorded as small integer slots, given out in the order
+they are first seen, teamIds and learnerIds map them back to ids.
+"""
+class DecisionTracer:
+
+    def __init__(self, capacity=100000, sampleEvery=1, allBids=False):
+        self.capacity = capacity
+        self.sampleEvery = sampleEvery
+        self.allBids = allBids
+
+        # one array per field, cheaper to write single values into
+        self.columns = {name: np.zeros(capacity, dtype=TRACE_DTYPE[name])
+                            for name in TRACE_DTYPE.names}
+        self.numWritten = 0 # total records written, including overwritten ones
+        self.frame = -1
+        self.depth = 0
+
+        self.teamSlots = {}
+        self.teamIds = []
+        self.learnerSlots = {}
+        self.learnerIds = []
+
+    """
+    Called by the agent at the start of each act, returns whether the frame is
+    to be traced.
+    """
+    def startFrame(self):
+        self.frame += 1
+        self.depth = 0
+        return self.frame % self.sampleEvery == 0
+
+    def teamSlot(self, team):
+        slot = self.teamSlots.get(team.id)
+        if slot is None:
+            slot = self.teamSlots[team.id] = len(self.teamIds)
+            self.teamIds.append(team.id)
+        return slot
+
+    def learnerSlot(self, learner):
+        slot = self.learnerSlots.get(learner.id)
+        if slot is None:
+            slot = self.learnerSlots[learner.id] = len(self.learnerIds)
+            self.learnerIds.append(learner.id)
+        return slot
+
+    """
+    Called by the team when it acts, with the learners that bid, their bids and
+    the index of the winner.
+    """
+    def record(self, team, learners, bids, top):
+        teamSlot = self.teamSlot(team)
+        for i in (range(len(learners)) if self.allBids else (top,)):
+            learner = learners[i]
+            row = self.numWritten % self.capacity
+            self.numWritten += 1
+
+            c = self.columns
+            c["frame"][row] = self.frame
+            c["depth"][row] = self.depth
+            c["team"][row] = teamSlot
+            c["learner"][row] = self.learnerSlot(learner)
+            c["bid"][row] = bids[i]
+            c["top"][row] = i == top
+            if learner.isActionAtomic():
+                c["action"][row] = learner.actionObj.actionCode
+                c["actionTeam"][row] = -1
+            else:
+                c["action"][row] = -1
+                c["actionTeam"][row] = self.teamSlot(learner.actionObj.teamAction)
+
+        self.depth += 1
+
+    def __len__(self):
+        return min(self.numWritten, self.capacity)
+
+    """
+    The records still in the buffer, oldest first, as a structured array.
+    """
+    def records(self):
+        n = len(self)
+        order = (np.arange(self.numWritten - n, self.numWritten) % self.capacity
+                    if n == self.capacity else np.arange(n))
+        records = np.empty(n, dtype=TRACE_DTYPE)
+        for name, column in self.columns.items():
+            records[name] = column[order]
+        return records
+
+    """
+    Writes the records and the ids of the slots to an npz file, with a field
+    per array (see TRACE_DTYPE) plus teamIds and learnerIds as uuid bytes.
+    """
+    def export(self, fileName):
+        records = self.records()
+        np.savez(fileName, teamIds=np.array([i.bytes for i in self.teamIds], dtype="S16"),
+            learnerIds=np.array([i.bytes for i in self.learnerIds], dtype="S16"),
+            **{name: records[name] for name in TRACE_DTYPE.names})
+
+    """
+    Empties the buffer, keeping the slots.
+    """
+    def clear(self):
+        self.numWritten = 0
@@ -5,6 +5,15 @@ from tpg.learner import Learner
 from tpg.team import Team
 from tpg.agent import Agent
 from tpg.configuration import configurer
+from tpg import scoring
+from tpg.outcome_store import OutcomeStore
+from tpg.snapshot import PopulationSnapshot
+from tpg.evaluation import COMPLETED
+from tpg.serialization import saveFile, loadFile
+from tpg.timings import PhaseTimer
+from tpg.counters import ExecutionCounters
+from tpg.graph_check import GraphChecker
+from tpg import graph_export
 import random
 import numpy as np
 import pickle, math
@@ -192,8 +201,24 @@ class Trainer:
         self.learners = []
         self.elites = [] # save best at each task
 
+        # outcomes of all teams at all tasks, team.outcomes is a view onto this
+        self.outcomeStore = OutcomeStore(capacity=2*teamPopSize)
+
         self.generation = 0 # track this
 
+        # per phase timings of evolution, enable with self.timings.enable()
+        self.timings = PhaseTimer()
+
+        # learner execution counts, once set up with self.setCounting()
+        self.counters = None
+        self.autoPruneHitchhikers = False
+
+        # checks the graph after each generation, once set up with self.setGraphChecking()
+        self.graphChecker = None
+
+        # saves the graph after each generation, once set up with self.setGraphRecording()
+        self.graphRecorder = None
+
         # these are to be filled in by the configurer after
         self.mutateParams = {}
         self.actVars = {}
@@ -305,6 +330,7 @@ class Trainer:
             # save to team populations
             self.teams.append(team)
             self.rootTeams.append(team)
+            self.outcomeStore.addTeam(team)
 
     """
     Gets rootTeams/agents. Sorts decending by sortTasks, and skips individuals
@@ -312,9 +338,11 @@ class Trainer:
     """
     def getAgents(self, sortTasks=[], multiTaskType='min', skipTasks=[]):
         # remove those that get skipped
-        rTeams = [team for team in self.rootTeams
-                if len(skipTasks) == 0
-                        or any(task not in team.outcomes for task in skipTasks)]
+        if len(skipTasks) == 0:
+            rTeams = list(self.rootTeams)
+        else:
+            done = self.outcomeStore.hasOutcomes(self.rootTeams, skipTasks)
+            rTeams = [team for team, isDone in zip(self.rootTeams, done) if not isDone]
 
         if len(sortTasks) == 0: # just get all
             return [Agent(team, self.functionsDict, num=i, actVars=self.actVars)
@@ -322,11 +350,12 @@ class Trainer:
         else:
 
             if len(sortTasks) == 1:
-                rTeams = [t for t in rTeams if sortTasks[0] in t.outcomes]
-                # return teams sorted by the outcome
-                return [Agent(team, self.functionsDict, num=i, actVars=self.actVars)
-                        for i,team in enumerate(sorted(rTeams,
-                                        key=lambda tm: tm.outcomes[sortTasks[0]], reverse=True))]
+                scores = self.outcomeStore.column(rTeams, sortTasks[0])
+                # return teams sorted by the outcome, skipping those without one
+                order = [i for i in np.argsort(-scores, kind='stable')
+                            if not np.isnan(scores[i])]
+                return [Agent(rTeams[j], self.functionsDict, num=i, actVars=self.actVars)
+                        for i,j in enumerate(order)]
 
             else:
                 # apply scores/fitness to root teams
@@ -340,46 +369,236 @@ class Trainer:
     Gets the single best team at the given task, regardless of if its root or not.
     """
     def getEliteAgent(self, task=None):
+        if len(self.teams) == 0:
+            return None
+
         if task is None:
-            # If no task is given, consider all teams.
-            teams = self.teams
+            # If no task is given, consider the sum of all outcomes of all teams.
+            scores = np.nansum(self.outcomeStore.matrix(self.teams,
+                                    list(self.outcomeStore.tasks)), axis=1)
         else:
-            teams = [t for t in self.teams if task in t.outcomes]
+            scores = self.outcomeStore.column(self.teams, task)
+            if np.isnan(scores).all():
+                return None
 
-        if not teams:
-            return None 
-
-        if task:
-            selected_team = max(teams, key=lambda t: t.outcomes[task])
-        else:
-            selected_team = max(teams, key=lambda t: sum(t.outcomes.values())) 
+        selected_team = self.teams[int(np.nanargmax(scores))]
 
         return Agent(selected_team, self.functionsDict, num=0, actVars=self.actVars)
         
     """
-    Apply saved scores from list to the agents.
+    Apply saved scores from list to the agents. Scores that are EvalResult from
+    an evaluation that timed out or failed give the team the worst outcome any
+    root team has at each of tasks (every task with outcomes if not given), so it
+    is first to go in selection. With counting on, execution counts that came with the results are added to
+    self.counters.
     """
-    def applyScores(self, scores): # used when multiprocessing
+    def applyScores(self, scores, tasks=None): # used when multiprocessing
+        rootIds = set(rt.id for rt in self.rootTeams)
+        failedIds = []
         for score in scores:
-            for rt in self.rootTeams:
-                if score[0] == rt.id:
-                    for task, outcome in score[1].items():
-                        rt.outcomes[task] = outcome
-                    break # on to next score
+            if len(score) > 5 and score[5] is not None and "counters" in self.actVars:
+                self.counters.merge(score[5])
+            if score[0] not in rootIds:
+                continue
+            if len(score) > 3 and score[3] != COMPLETED:
+                failedIds.append(score[0])
+                continue
+            for task, outcome in score[1].items():
+                self.outcomeStore.set(score[0], task, outcome)
+
+        if len(failedIds) > 0:
+            if tasks is None:
+                tasks = list(self.outcomeStore.tasks)
+            for task in tasks:
+                outcomes = self.outcomeStore.column(self.rootTeams, task)
+                if not np.isnan(outcomes).all():
+                    for teamId in failedIds:
+                        self.outcomeStore.set(teamId, task, float(np.nanmin(outcomes)))
 
         return self.rootTeams
 
+    """
+    Apply a whole matrix of scores at once, one row per team id and one column
+    per task. NaN entries clear that outcome.
+    """
+    def applyScoreMatrix(self, teamIds, tasks, values):
+        self.outcomeStore.update(teamIds, tasks, values)
+        return self.rootTeams
+
+    """
+    Score at task a root team needs to survive selection, going by the outcomes
+    root teams already have: the worst outcome that would still be kept at the
+    current gap. Teams yet to be evaluated can only raise it, so anything
+    certainly below it won't survive. Negative infinity if too few root teams
+    have outcomes to tell. Only meaningful when evolving on the single task.
+    """
+    def getSurvivalCutoff(self, task):
+        outcomes = self.outcomeStore.column(self.rootTeams, task)
+        known = np.sort(outcomes[~np.isnan(outcomes)])[::-1]
+        numKeep = len(self.rootTeams) - int(len(self.rootTeams)*self.gap)
+        if numKeep == 0 or len(known) < numKeep:
+            return -np.inf
+
+        return float(known[numKeep-1])
+
+    """
+    Flat array snapshot of the current population (see tpg.snapshot). If shared
+    it is published to shared memory, where evaluation workers can attach to it
+    by its descriptor, close it once they are done with it.
+    """
+    def publishSnapshot(self, shared=True):
+        snapshot = PopulationSnapshot.fromTeams(self.teams + self.rootTeams, self.rootTeams)
+        if shared:
+            return snapshot.publish()
+        return snapshot
+
+    """
+    Saves the population as a snapshot file (with the outcomes and what agents
+    need to act), which openSnapshot (tpg.snapshot) opens lazily. Unlike
+    saveToFile, a saved snapshot can't be evolved further.
+    """
+    def saveSnapshot(self, fileName):
+        snapshot = PopulationSnapshot.fromTeams(self.teams + self.rootTeams, self.rootTeams,
+                        tasks=list(self.outcomeStore.tasks))
+        snapshot.saveToFile(fileName, meta={"functionsDict": self.functionsDict,
+            "actVars": self.actVars, "generation": self.generation})
+
+    """
+    Turns counting of learner executions (see tpg.counters) on or off. Counts
+    are kept per generation in self.counters, the last maxHistory generations
+    of them in self.counters.history. With pruneHitchhikers, evolve first
+    prunes the learners that never won (see pruneHitchhikers). Set up before
+    creating an EvaluationPool for its workers to count too.
+    """
+    def setCounting(self, doCount=True, maxHistory=1, pruneHitchhikers=False):
+        self.autoPruneHitchhikers = doCount and pruneHitchhikers
+        if doCount and self.counters is None:
+            self.counters = ExecutionCounters(
+                [i for i, op in enumerate(self.operations) if op.startswith("MEM_")],
+                capacity=max(256, 2*len(self.learners)), maxHistory=maxHistory)
+        configurer.configureCounting(self, Learner, doCount)
+
+    """
+    Turns checking the graph's invariants (see tpg.graph_check) after every
+    generation on or off. Only what changed since the last check is checked,
+    cheap enough to leave on.
+    """
+    def setGraphChecking(self, doCheck=True):
+        self.graphChecker = GraphChecker() if doCheck else None
+        if doCheck:
+            self.checkGraph(full=True)
+
+    """
+    Checks the graph's invariants (see tpg.graph_check), raising an exception
+    listing the problems if any are broken. Without full (and with checking
+    on), only what changed since the last check.
+    """
+    def checkGraph(self, full=False):
+        checker = GraphChecker() if self.graphChecker is None else self.graphChecker
+        problems = checker.check(self, full=full)
+        if len(problems) > 0:
+            raise Exception("Graph invariants violated", self.generation, problems)
+
+    """
+    Records the graph (see tpg.graph_export.GraphRecorder) to files starting
+    with prefix after each generation, as full graphs each fullEvery
+    generations and diffs otherwise. A prefix of None stops recording.
+    """
+    def setGraphRecording(self, prefix=None, fullEvery=None):
+        self.graphRecorder = (None if prefix is None
+            else graph_export.GraphRecorder(prefix, fullEvery=fullEvery))
+
+    """
+    Writes the graph of the population to the file, as arrays (see
+    tpg.graph_export.graphArrays) with format "npz", or streamed out with
+    "jsonl" (in the form of get_graph) or "graphml".
+    """
+    def exportGraph(self, fileName, format="npz"):
+        graph = graph_export.graphArrays(self)
+        if format == "npz":
+            graph_export.saveArrays(graph, fileName)
+        elif format == "jsonl":
+            graph_export.writeJsonLines(graph, fileName)
+        elif format == "graphml":
+            graph_export.writeGraphML(graph, fileName)
+        else:
+            raise Exception("Unknown graph format", format)
+
     """
     Evolve the populations for improvements.
     """
     def evolve(self, tasks=['task'], multiTaskType='min', extraTeams=None):
-        self.scoreIndividuals(tasks, multiTaskType=multiTaskType,
-                doElites=self.doElites) # assign scores to individuals
-        self.saveFitnessStats() # save fitness stats
-        self.select(extraTeams) # select individuals to keep
-        self.generate(extraTeams) # create new individuals from those kept
-        self.nextEpoch() # set up for next generation
-        #self.validate_graph() # validate the tpg (for debug only)
+        if "counters" in self.actVars:
+            if self.autoPruneHitchhikers:
+                with self.timings.span("pruneHitchhikers"):
+                    self.pruneHitchhikers()
+            self.counters.endGeneration(self.generation, self.learners)
+        timings = self.timings
+        with timings.span("score"):
+            self.scoreIndividuals(tasks, multiTaskType=multiTaskType,
+                    doElites=self.doElites) # assign scores to individuals
+        with timings.span("fitnessStats"):
+            self.saveFitnessStats() # save fitness stats
+        with timings.span("select"):
+            self.select(extraTeams) # select individuals to keep
+        with timings.span("generate"):
+            self.generate(extraTeams) # create new individuals from those kept
+        with timings.span("nextEpoch"):
+            self.nextEpoch() # set up for next generation
+        if self.graphChecker is not None:
+            with timings.span("checkGraph"):
+                self.checkGraph() # validate the tpg, see setGraphChecking
+        if self.graphRecorder is not None:
+            with timings.span("recordGraph"):
+                self.graphRecorder.record(self)
+        timings.endGeneration(self.generation - 1)
+
+    """
+    Steady state evolution, for when evaluations keep arriving without waiting
+    for the whole population. Only root teams with outcomes at all tasks are
+    scored, the numReplace worst of those are removed and replaced by offspring
+    of the survivors. Root teams still waiting on outcomes are left alone, and
+    stay root teams as offspring don't point to them. Each call counts as a
+    generation. Returns the root teams that now need to be evaluated, none if
+    fewer than numReplace+1 root teams are evaluated yet.
+    """
+    def evolveSteadyState(self, tasks=['task'], numReplace=1, multiTaskType='min',
+            extraTeams=None):
+        done = self.outcomeStore.hasOutcomes(self.rootTeams, tasks)
+        evaluated = [team for team, isDone in zip(self.rootTeams, done) if isDone]
+        waiting = [team for team, isDone in zip(self.rootTeams, done) if not isDone]
+        if len(evaluated) <= numReplace:
+            return []
+
+        # score and select among the evaluated only, they also parent the offspring
+        self.rootTeams = evaluated
+        if "counters" in self.actVars:
+            self.counters.endGeneration(self.generation, self.learners)
+        timings = self.timings
+        with timings.span("score"):
+            self.scoreIndividuals(tasks, multiTaskType=multiTaskType, doElites=self.doElites)
+        with timings.span("fitnessStats"):
+            self.saveFitnessStats()
+        with timings.span("select"):
+            self.select(extraTeams, numDelete=numReplace)
+        with timings.span("generate"):
+            # waiting teams pointed to would stop being root teams
+            self.generate(extraTeams, excludeTeams=waiting)
+        with timings.span("nextEpoch"):
+            self.nextEpoch()
+        if self.graphChecker is not None:
+            with timings.span("checkGraph"):
+                self.checkGraph()
+        if self.graphRecorder is not None:
+            with timings.span("recordGraph"):
+                self.graphRecorder.record(self)
+        timings.endGeneration(self.generation - 1)
+
+        waitingIds = set(team.id for team in waiting)
+        done = self.outcomeStore.hasOutcomes(self.rootTeams, tasks)
+        return [team for team, isDone in zip(self.rootTeams, done)
+                    if not isDone and team.id not in waitingIds]
+
     """
     Assigns a fitness to each agent based on performance at the tasks. Assigns
     fitness values, or just returns sorted root teams.
@@ -388,131 +607,165 @@ class Trainer:
         # handle generation of new elites, typically just done in evolution
         if doElites:
             # get the best agent at each task
-            self.elites = [] # clear old elites
-            for task in tasks:
-                self.elites.append(max([team for team in self.rootTeams],
-                                        key=lambda t: t.outcomes[task]))
+            best = np.argmax(self.outcomeMatrix(tasks), axis=0)
+            self.elites = [self.rootTeams[i] for i in best]
 
         if len(tasks) == 1: # single fitness
-            for team in self.rootTeams:
-                team.fitness = team.outcomes[tasks[0]]
+            for team, outcome in zip(self.rootTeams, self.outcomeMatrix(tasks)[:,0]):
+                team.fitness = float(outcome)
         else: # multi fitness
             # assign fitness to each agent based on tasks and score type
-            if 'pareto' not in multiTaskType or 'lexicase' not in multiTaskType:
+            if 'pareto' not in multiTaskType and 'lexicase' not in multiTaskType:
                 self.simpleScorer(tasks, multiTaskType=multiTaskType)
             elif multiTaskType == 'paretoDominate':
                 self.paretoDominateScorer(tasks)
             elif multiTaskType == 'paretoNonDominated':
                 self.paretoNonDominatedScorer(tasks)
+            elif multiTaskType == 'paretoRank':
+                self.paretoRankScorer(tasks)
             elif multiTaskType == 'lexicaseStatic':
                 self.lexicaseStaticScorer(tasks)
             elif multiTaskType == 'lexicaseDynamic':
                 self.lexicaseDynamicScorer(tasks)
+            elif multiTaskType == 'lexicaseEpsilon':
+                self.lexicaseEpsilonScorer(tasks)
+            else:
+                raise Exception("Invalid multiTaskType", multiTaskType)
+
+    """
+    Gets the outcomes of the root teams at the tasks as a matrix, one row per
+    root team and one column per task. Every root team must have an outcome
+    for every task.
+    """
+    def outcomeMatrix(self, tasks):
+        outcomes = self.outcomeStore.matrix(self.rootTeams, tasks)
+        if np.isnan(outcomes).any():
+            missing = [str(self.rootTeams[i].id) for i in np.flatnonzero(np.isnan(outcomes).any(axis=1))]
+            raise Exception("Root teams missing outcomes for tasks", tasks, missing)
+
+        return outcomes
 
     """
     Gets either the min, max, or average score from each individual for ranking.
     """
     def simpleScorer(self, tasks, multiTaskType='min'):
-        # first find min and max in each task
-        mins = []
-        maxs = []
-        for task in tasks:
-            mins.append(min([team.outcomes[task] for team in self.rootTeams]))
-            maxs.append(max([team.outcomes[task] for team in self.rootTeams]))
+        outcomes = self.outcomeMatrix(tasks)
+
+        # normalize each task to [0, 1] using its min and max
+        mins = outcomes.min(axis=0)
+        maxs = outcomes.max(axis=0)
+        spans = np.broadcast_to(maxs - mins, outcomes.shape)
+        scores = np.divide(outcomes - mins, spans, out=np.zeros(outcomes.shape),
+                    where=spans > 0)
 
         # assign fitness
         if multiTaskType == 'min':
-            for rt in self.rootTeams:
-                rt.fitness = min([(rt.outcomes[task]-mins[i])/(maxs[i]-mins[i])
-                        for i,task in enumerate(tasks)])
+            fitnesses = scores.min(axis=1)
         elif multiTaskType == 'max':
-            for rt in self.rootTeams:
-                rt.fitness = max([(rt.outcomes[task]-mins[i])/(maxs[i]-mins[i])
-                        for i,task in enumerate(tasks)])
+            fitnesses = scores.max(axis=1)
         elif multiTaskType == 'average':
-            for rt in self.rootTeams:
-                scores = [(rt.outcomes[task]-mins[i])/(maxs[i]-mins[i])
-                            for i,task in enumerate(tasks)]
-                rt.fitness = sum(scores)/len(scores)
+            fitnesses = scores.mean(axis=1)
+        else:
+            raise Exception("Invalid multiTaskType", multiTaskType)
+
+        for rt, fitness in zip(self.rootTeams, fitnesses):
+            rt.fitness = float(fitness)
 
     """
     Rank agents based on how many other agents it dominates
     """
     def paretoDominateScorer(self, tasks):
-        for t1 in self.rootTeams:
-            t1.fitness = 0
-            for t2 in self.rootTeams:
-                if t1 == t2:
-                    continue # don't compare to self
-
-                # compare on all tasks
-                if all([t1.outcomes[task] >= t2.outcomes[task]
-                         for task in tasks]):
-                    t1.fitness += 1
+        counts = scoring.paretoDominateCounts(self.outcomeMatrix(tasks))
+        for rt, count in zip(self.rootTeams, counts):
+            rt.fitness = int(count)
 
     """
     Rank agents based on how many other agents don't dominate it
     """
     def paretoNonDominatedScorer(self, tasks):
-        for t1 in self.rootTeams:
-            t1.fitness = 0
-            for t2 in self.rootTeams:
-                if t1 == t2:
-                    continue # don't compare to self
+        counts = scoring.paretoBeatenCounts(self.outcomeMatrix(tasks))
+        for rt, count in zip(self.rootTeams, counts):
+            rt.fitness = -int(count)
 
-                # compare on all tasks
-                if all([t1.outcomes[task] < t2.outcomes[task]
-                         for task in tasks]):
-                    t1.fitness -= 1
+    """
+    Rank agents by pareto front (fast non-dominated sort), breaking ties within
+    a front by crowding distance.
+    """
+    def paretoRankScorer(self, tasks):
+        fitnesses = scoring.paretoRankFitness(self.outcomeMatrix(tasks))
+        for rt, fitness in zip(self.rootTeams, fitnesses):
+            rt.fitness = float(fitness)
 
+    """
+    Rank agents by how often lexicase selection picks them, using a single
+    shuffled task ordering for every selection event.
+    """
     def lexicaseStaticScorer(self, tasks):
-        stasks = list(tasks)
-        random.shuffle(stasks)
+        self.lexicaseScorer(tasks, staticOrder=True)
 
-        for rt in self.rootTeams:
-            rt.fitness = rt.outcomes[tasks[0]]
+    """
+    Rank agents by how often lexicase selection picks them, shuffling the task
+    ordering for every selection event.
+    """
+    def lexicaseDynamicScorer(self, tasks):
+        self.lexicaseScorer(tasks, staticOrder=False)
 
+    """
+    Rank agents by how often epsilon lexicase selection picks them, with the
+    epsilon of each task being its median absolute deviation.
+    """
+    def lexicaseEpsilonScorer(self, tasks):
+        self.lexicaseScorer(tasks, epsilon="auto", staticOrder=False)
 
-    def lexicaseDynamicScorer(self, tasks):
-        pass
+    """
+    Runs one lexicase selection event per root team over the outcome matrix and
+    assigns the selection counts as fitness.
+    """
+    def lexicaseScorer(self, tasks, epsilon=None, staticOrder=False):
+        fitnesses = scoring.lexicaseFitness(self.outcomeMatrix(tasks),
+                        epsilon=epsilon, seed=random.getrandbits(31),
+                        staticOrder=staticOrder)
+        for rt, fitness in zip(self.rootTeams, fitnesses):
+            rt.fitness = float(fitness)
 
     """
     Save some stats on the fitness.
     """
     def saveFitnessStats(self):
-        fitnesses = []
-        for rt in self.rootTeams:
-            fitnesses.append(rt.fitness)
+        fitnesses = np.array([rt.fitness for rt in self.rootTeams], dtype=np.float64)
 
         self.fitnessStats = {}
-        self.fitnessStats['fitnesses'] = fitnesses
-        self.fitnessStats['min'] = min(fitnesses)
-        self.fitnessStats['max'] = max(fitnesses)
-        self.fitnessStats['average'] = sum(fitnesses)/len(fitnesses)
+        self.fitnessStats['fitnesses'] = fitnesses.tolist()
+        self.fitnessStats['min'] = float(fitnesses.min())
+        self.fitnessStats['max'] = float(fitnesses.max())
+        self.fitnessStats['average'] = float(fitnesses.mean())
 
     """
     Gets stats on some task.
     """
     def getTaskStats(self, task):
-        scores = []
-        for rt in self.rootTeams:
-            scores.append(rt.outcomes[task])
+        scores = self.outcomeStore.column(self.rootTeams, task)
+        if np.isnan(scores).any():
+            raise Exception("Root teams missing outcomes for task", task)
 
         scoreStats = {}
-        scoreStats['scores'] = scores
-        scoreStats['min'] = min(scores)
-        scoreStats['max'] = max(scores)
-        scoreStats['average'] = sum(scores)/len(scores)
+        scoreStats['scores'] = scores.tolist()
+        scoreStats['min'] = float(scores.min())
+        scoreStats['max'] = float(scores.max())
+        scoreStats['average'] = float(scores.mean())
 
         return scoreStats
 
     """
-    Select a portion of the root team population to keep according to gap size.
+    Select a portion of the root team population to keep according to gap size,
+    or remove the numDelete worst root teams if given.
     """
-    def select(self, extraTeams=None):
+    def select(self, extraTeams=None, numDelete=None):
 
         rankedTeams = sorted(self.rootTeams, key=lambda rt: rt.fitness, reverse=True)
-        numKeep = len(self.rootTeams) - int(len(self.rootTeams)*self.gap)
+        if numDelete is None:
+            numDelete = int(len(self.rootTeams)*self.gap)
+        numKeep = len(self.rootTeams) - numDelete
         deleteTeams = rankedTeams[numKeep:]
 
         #print("BEFORE SELECTION:")        
@@ -539,7 +792,8 @@ class Trainer:
 
         # delete the team unless it is an elite (best at some task at-least)
         # don't delete elites because they may not be root - TODO: elaborate
-        for team in [t for t in deleteTeams if t not in self.elites]:
+        # nor former elites still kept as root teams while others point to them
+        for team in [t for t in deleteTeams if t not in self.elites and len(t.inLearners) == 0]:
 
     
             # remove learners from team and delete team from populations
@@ -547,44 +801,47 @@ class Trainer:
                 team.removeLearners()
             self.teams.remove(team)
             self.rootTeams.remove(team)
+            self.outcomeStore.removeTeam(team)
 
         #print("AFTER SELECTION:")
-        # Find all learners that have no teams pointing to them
-        orphans = [learner for learner in self.learners if learner.numTeamsReferencing() == 0]
-        #print("Number of orphans after selection: {}".format(len(orphans)))
-
-        #print("Orphans:")
-        #for cursor in orphans:
-        #    print("\t{}".format(cursor.id))
-
-        #print("Learners:")
-        #for cursor in self.learners:
-        #    print("Learner {} -> [{}]{} inTeams:".format( cursor.id, "Atomic" if cursor.isActionAtomic() else "Team", cursor.actionObj.actionCode if cursor.isActionAtomic() else cursor.actionObj.teamAction.id))
-        #    for t_id in cursor.inTeams:
-        #        print("\t{}".format(t_id ))
-
-        #for cursor in self.teams:
-        #    print("Team: {} inLearners:".format(cursor.id))
-        #    for l_id in cursor.inLearners:
-        #        print("\t{}".format(l_id))
-
-        #print("-----------------------------------------------------")  
-
-        # These learners will be removed, but before we can do that, we should remove 
-        # their ids from any team's inLearners that the orphans are pointing to.
-        for cursor in orphans:
-            if not cursor.isActionAtomic(): # If the orphan does NOT point to an atomic action
-                # Get the team the orphan is pointing to and remove the orphan's id from the team's in learner list
-                cursor.actionObj.teamAction.inLearners.remove(str(cursor.id))
-
-        # Finaly, purge the orphans
-        self.learners = [learner for learner in self.learners if learner.numTeamsReferencing() > 0]
+        with self.timings.span("orphans"):
+            # Find all learners that have no teams pointing to them
+            orphans = [learner for learner in self.learners if learner.numTeamsReferencing() == 0]
+            #print("Number of orphans after selection: {}".format(len(orphans)))
+
+            #print("Orphans:")
+            #for cursor in orphans:
+            #    print("\t{}".format(cursor.id))
+
+            #print("Learners:")
+            #for cursor in self.learners:
+            #    print("Learner {} -> [{}]{} inTeams:".format( cursor.id, "Atomic" if cursor.isActionAtomic() else "Team", cursor.actionObj.actionCode if cursor.isActionAtomic() else cursor.actionObj.teamAction.id))
+            #    for t_id in cursor.inTeams:
+            #        print("\t{}".format(t_id ))
+
+            #for cursor in self.teams:
+            #    print("Team: {} inLearners:".format(cursor.id))
+            #    for l_id in cursor.inLearners:
+            #        print("\t{}".format(l_id))
+
+            #print("-----------------------------------------------------")  
+
+            # These learners will be removed, but before we can do that, we should remove 
+            # their ids from any team's inLearners that the orphans are pointing to.
+            for cursor in orphans:
+                if not cursor.isActionAtomic(): # If the orphan does NOT point to an atomic action
+                    # Get the team the orphan is pointing to and remove the orphan's id from the team's in learner list
+                    cursor.actionObj.teamAction.inLearners.remove(str(cursor.id))
+
+            # Finaly, purge the orphans
+            self.learners = [learner for learner in self.learners if learner.numTeamsReferencing() > 0]
                 
 
     """
-    Generates new rootTeams based on existing teams.
+    Generates new rootTeams based on existing teams. Offspring learners never
+    point to excludeTeams (e.g. root teams still out for evaluation).
     """
-    def generate(self, extraTeams=None):
+    def generate(self, extraTeams=None, excludeTeams=None):
 
         # extras who are already part of the team population
         protectedExtras = []
@@ -601,6 +858,8 @@ class Trainer:
 
         oLearners = list(self.learners)
         oTeams = list(self.teams)
+        if excludeTeams is not None:
+            oTeams = [team for team in oTeams if team not in excludeTeams]
 
         # update generation in mutateParams
         self.mutateParams["generation"] = self.generation
@@ -617,15 +876,30 @@ class Trainer:
                 child.addLearner(learner)
 
             # then mutates
-            child.mutate(self.mutateParams, oLearners, oTeams)
+            with self.timings.span("mutate"):
+                child.mutate(self.mutateParams, oLearners, oTeams)
 
             self.teams.append(child)
 
         # remove unused extras
         if extraTeams is not None:
-            for team in extraTeams:
-                if team.numLearnersReferencing() == 0 and team not in protectedExtras:
-                    self.teams.remove(team)
+            removedExtras = [team for team in extraTeams
+                if team.numLearnersReferencing() == 0 and team not in protectedExtras]
+            for team in removedExtras:
+                self.teams.remove(team)
+                self.outcomeStore.removeTeam(team)
+
+            # learners only on removed extras no longer point into the population
+            teamIds = set(str(team.id) for team in self.teams)
+            learnerIds = set(learner.id for learner in self.learners)
+            for team in removedExtras:
+                for learner in team.learners:
+                    target = learner.actionObj.teamAction
+                    if (target is not None and str(target.id) in teamIds
+                            and learner.id not in learnerIds
+                            and not any(teamId in teamIds for teamId in learner.inTeams)
+                            and str(learner.id) in target.inLearners):
+                        target.inLearners.remove(str(learner.id))
 
     """
     Finalize populations and prepare for next generation/epoch.
@@ -634,6 +908,9 @@ class Trainer:
         # add in newly added learners, and decide root teams
         self.rootTeams = []
         for team in self.teams:
+            # track outcomes of any new teams
+            self.outcomeStore.addTeam(team)
+
             # add any new learners to the population
             for learner in team.learners:
                 if learner not in self.learners:
@@ -648,7 +925,7 @@ class Trainer:
 
     """
     Removes hitchhikers, learners that are never used, except for the last atomic action on the team.
-    teamLearnerVisists is a dict with team keys and values represending the learners that are
+    visitedLearners is a list with, for each team in teams, the learners that are
     actually visited on the team. Any learner on a team not in this list gets deleted.
     Evolve should be called right after to properly remove the learners from the population.
     """
@@ -658,7 +935,7 @@ class Trainer:
 
         for i, team in enumerate(teams):
             affected = False
-            for learner in team.learners:
+            for learner in list(team.learners): # removing changes team.learners
                 # only remove if non atomic, or atomic and team has > 1 atomic actions
                 if learner not in visitedLearners[i] and (
                         not learner.isActionAtomic() or 
@@ -671,6 +948,29 @@ class Trainer:
                 teamsAffected.append(team)
 
         return learnersRemoved, teamsAffected
+
+    """
+    Removes hitchhikers (see removeHitchhikers) by the win counts since counting
+    was set up or the last generation: learners that never won a bid on a team
+    are removed from that team. Teams none of whose learners won weren't acted
+    with, so are left alone. Counts from evaluation workers only count once
+    their results went through applyScores. Like removeHitchhikers, call before
+    evolve.
+    """
+    def pruneHitchhikers(self, teams=None):
+        if "counters" not in self.actVars:
+            raise Exception("pruneHitchhikers needs counting, see setCounting")
+
+        teams = self.teams if teams is None else teams
+        pruneTeams = []
+        winners = []
+        for team in teams:
+            wins = self.counters.teamWinCounts(team)
+            if wins.any():
+                pruneTeams.append(team)
+                winners.append([l for l, w in zip(team.learners, wins) if w > 0])
+
+        return self.removeHitchhikers(pruneTeams, winners)
     
     '''
     Go through all teams and learners and make sure their inTeams/inLearners correspond with 
@@ -750,76 +1050,17 @@ class Trainer:
 
         return numRTeams
 
-
+    """
+    The graph of the population as dicts of nodes and links with string ids.
+    For large populations exportGraph is much more compact.
+    """
     def get_graph(self):
-
-
-        result = {
-            "nodes":[],
-            "links":[]
+        graph = graph_export.graphArrays(self)
+        return {
+            "nodes": list(graph_export.graphNodes(graph)),
+            "links": list(graph_export.graphLinks(graph))
         }
 
-        # First add action codes as nodes
-        for actionCode in self.actionCodes:
-            result["nodes"].append(
-                {
-                    "id": str(actionCode),   
-                    "type": "action"
-                }
-            )
-        
-        # Then add teams as nodes
-        for team in self.teams:
-            result["nodes"].append(
-                {
-                    "id": str(team.id),
-                    "type": "rootTeam" if team in self.rootTeams else "team"
-                }
-            )
-
-        # Then add learners as nodes
-        for learner in self.learners:
-            result["nodes"].append(
-                {
-                    "id": str(learner.id),
-                    "type": "learner"
-                }
-            )
-
-
-        # Then add links from learners to teams
-        for team in self.teams:
-            for learner in team.inLearners:
-                result["links"].append(
-                    {
-                        "source": learner,
-                        "target": str(team.id)
-                    }
-                )
-        
-        # Then add links from teams to learners
-        for learner in self.learners:
-            for team in learner.inTeams:
-                result["links"].append(
-                    {
-                        "source": team,
-                        "target": str(learner.id)
-                    }
-                )
-            
-            # Also add links to action codes
-            if learner.isActionAtomic():
-                result["links"].append(
-                    {
-                        "source": str(learner.id),
-                        "target": str(learner.actionObj.actionCode)
-                    }
-                )
-
-        # with open("tpg_{}.json".format(self.generation), 'w') as out_file:
-        #     json.dump(result, out_file)
-        return result
-
 
     """
     Function to cleanup anything that may interfere with another trainer run in
@@ -851,15 +1092,38 @@ class Trainer:
 
     """
     Save the trainer to the file, saving any class values to the instance.
+    Instructions are stored out of band (see tpg.serialization).
     """
     def saveToFile(self, fileName):
-        pickle.dump(self, open(fileName, 'wb'))
+        saveFile(self, fileName)
+
+    """
+    Team outcomes pickle as plain dicts, so point them back at the outcome store
+    after loading.
+    """
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if "timings" not in state: # saved before timings were added
+            self.timings = PhaseTimer()
+        if "counters" not in state:
+            self.counters = None
+            self.autoPruneHitchhikers = False
+        if "graphChecker" not in state:
+            self.graphChecker = None
+        if "graphRecorder" not in state:
+            self.graphRecorder = None
+        if "outcomeStore" not in state: # teams still hold their outcomes
+            self.outcomeStore = OutcomeStore(capacity=max(64, 2*len(self.teams)))
+        for team in self.teams:
+            self.outcomeStore.addTeam(team)
 
 """
 Load some trainer from the file, returning it and repopulate class values.
+With useMmap instructions are mapped from the file rather than read (see
+tpg.serialization.loadFile).
 """
-def loadTrainer(fileName):
-    trainer = pickle.load(open(fileName, 'rb'))
+def loadTrainer(fileName, useMmap=False):
+    trainer = loadFile(fileName, useMmap=useMmap)
     trainer.configFunctions()
     return trainer
 
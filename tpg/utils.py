@@ -1,3 +1,4 @@
+import hashlib
 import random
 import numpy as np
 
@@ -243,4 +244,47 @@ def pathDepths(team, prevDepth=0, parents=[]):
     for nTeam in nextTeams:
         depths.extend(pathDepths(nTeam, myDepth, list(parents)))
 
-    return depths
\ No newline at end of file
+    return depths
+
+"""
+Canonical hash of the graph reachable from the team, covering learner programs,
+register counts, learner order and action topology, but not ids. Teams are
+numbered in depth first order of discovery and team actions refer to those
+numbers, so cycles are fine and structurally identical graphs (e.g. an
+offspring whose mutations changed nothing) hash the same. Returns a hex string.
+"""
+def graphHash(team):
+    digest = hashlib.blake2b(digest_size=16)
+    order = {team.id: 0} # team id -> discovery number
+    stack = [team]
+    while len(stack) > 0:
+        cursor = stack.pop()
+        digest.update(b"T%d:" % order[cursor.id])
+        children = []
+        for learner in cursor.learners:
+            instructions = np.ascontiguousarray(learner.program.instructions, dtype=np.int32)
+            digest.update(b"L%d,%d:" % (len(learner.registers), len(instructions)))
+            digest.update(instructions.tobytes())
+
+            actionObj = learner.actionObj
+            if actionObj.isAtomic():
+                digest.update(b"A%d" % int(actionObj.actionCode))
+            else:
+                actionTeam = actionObj.teamAction
+                if actionTeam.id not in order:
+                    order[actionTeam.id] = len(order)
+                    children.append(actionTeam)
+                digest.update(b"T%d" % order[actionTeam.id])
+
+            # real actions
+            if getattr(actionObj, "program", None) is not None:
+                actInstructions = np.ascontiguousarray(actionObj.program.instructions,
+                                                        dtype=np.int32)
+                digest.update(b"R%d,%d:" % (-1 if actionObj.actionLength is None
+                                             else actionObj.actionLength, len(actInstructions)))
+                digest.update(actInstructions.tobytes())
+
+        # visit in discovery order
+        stack.extend(reversed(children))
+
+    return digest.hexdigest()
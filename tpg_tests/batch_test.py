@@ -0,0 +1,127 @@
+import unittest
+import xmlrunner
+import numpy as np
+from tpg.trainer import Trainer
+from tpg.batch import BatchActor
+from tpg.envs import SyntheticEnv, VectorEnv
+from tpg.evaluation import evaluateLockstep
+from tpg.utils import getLearners
+from tpg_tests.test_utils import create_evolved_trainer
+
+'''
+Plays the agent like extras.playAgent does, for comparison.
+'''
+def play_serial(agent, env, numEpisodes, numFrames, nRandFrames):
+    for learner in getLearners(agent.team):
+        learner.zeroRegisters()
+    total = 0
+    for ep in range(numEpisodes):
+        state = env.reset()
+        for i in range(numFrames):
+            if i < nRandFrames:
+                env.step(env.action_space.sample())
+                continue
+            state, reward, isDone, debug = env.step(agent.act(state))
+            total += reward
+            if isDone:
+                break
+    return total/numEpisodes
+
+class BatchTest(unittest.TestCase):
+
+    '''
+    Batched actions match Agent.act for every root team, over a sequence of
+    states (registers carry over between states).
+    '''
+    def test_batch_act(self):
+        for traversal in ['team', 'learner']:
+            trainer = create_evolved_trainer(traversal=traversal)
+            agents = trainer.getAgents()
+            actor = BatchActor(trainer.publishSnapshot(shared=False), len(agents),
+                                trainer.functionsDict)
+            for slot, agent in enumerate(agents):
+                actor.assign(slot, agent.team.id)
+
+            states = np.random.default_rng(1).random((10, 16))
+            expected = np.zeros((len(states), len(agents)), dtype=np.int64)
+            for a, agent in enumerate(agents):
+                for learner in getLearners(agent.team):
+                    learner.zeroRegisters()
+                for s, state in enumerate(states):
+                    expected[s, a] = agent.act(state)
+
+            for s, state in enumerate(states):
+                actions = actor.act(np.repeat(state[None], len(agents), axis=0))
+                self.assertTrue(np.array_equal(actions, expected[s]), traversal)
+
+            trainer.cleanup()
+
+    '''
+    Lockstep evaluation on a vector of synthetic environments scores each team
+    the same as playing it on its own, with more teams than environments.
+    '''
+    def test_lockstep(self):
+        trainer = create_evolved_trainer()
+        teams = [agent.team for agent in trainer.getAgents()]
+        vecEnv = VectorEnv([lambda: SyntheticEnv(inputSize=16, numActions=4,
+                                                 episodeLength=30, seed=3)]*3)
+
+        results = evaluateLockstep(trainer, teams, vecEnv, 2, 25, 'synth')
+        self.assertEqual(sorted(r.teamId for r in results), sorted(t.id for t in teams))
+
+        env = SyntheticEnv(inputSize=16, numActions=4, episodeLength=30, seed=3)
+        expected = {agent.team.id: play_serial(agent, env, 2, 25, 0)
+                    for agent in trainer.getAgents()}
+        for result in results:
+            self.assertEqual(result.outcomes['synth'], expected[result.teamId])
+
+        # random starting frames still give every team a score
+        results = evaluateLockstep(trainer, teams, vecEnv, 2, 25, 'synth', nRandFrames=5)
+        self.assertEqual(len(results), len(teams))
+
+        trainer.applyScores(results)
+        trainer.evolve(['synth'])
+        trainer.cleanup()
+
+    '''
+    With a racing cutoff nobody can reach, every team stops after the minimum
+    number of episodes.
+    '''
+    def test_lockstep_racing(self):
+        trainer = create_evolved_trainer(gens=1)
+        teams = [agent.team for agent in trainer.getAgents()]
+        envs = []
+        def make_env():
+            envs.append(SyntheticEnv(inputSize=16, numActions=4, episodeLength=10))
+            envs[-1].resets = 0
+            reset = envs[-1].reset
+            def counting_reset():
+                envs[-1].resets += 1
+                return reset()
+            envs[-1].reset = counting_reset
+            return envs[-1]
+
+        vecEnv = VectorEnv([make_env]*2)
+        results = evaluateLockstep(trainer, teams, vecEnv, 5, 10, 'synth')
+        self.assertEqual(sum(env.resets for env in envs), 5*len(teams))
+
+        for env in envs:
+            env.resets = 0
+        raced = evaluateLockstep(trainer, teams, vecEnv, 5, 10, 'synth',
+                                    cutoff=np.inf, minEpisodes=2)
+        self.assertEqual(sum(env.resets for env in envs), 2*len(teams))
+        self.assertEqual(sorted(r.teamId for r in raced), sorted(t.id for t in teams))
+
+        trainer.cleanup()
+
+    '''
+    Configurations needing the memory matrix can't be batched.
+    '''
+    def test_unsupported(self):
+        trainer = Trainer(actions=4, teamPopSize=10, inputSize=16, memType='def')
+        with self.assertRaises(Exception):
+            BatchActor(trainer.publishSnapshot(shared=False), 2, trainer.functionsDict)
+        trainer.cleanup()
+
+if __name__ == '__main__':
+    unittest.main(testRunner=xmlrunner.XMLTestRunner(output='test-reports'))
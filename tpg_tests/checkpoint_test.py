@@ -0,0 +1,177 @@
+import unittest
+import xmlrunner
+import collections
+import json
+import numpy as np
+import os
+import tempfile
+from tpg.trainer import Trainer
+from tpg.checkpoint import CheckpointStore, CheckpointWriter, resume
+from tpg.utils import graphHash
+from tpg_tests.test_utils import score_teams
+
+class CheckpointTest(unittest.TestCase):
+
+    def assertSamePopulation(self, trainer, loaded):
+        self.assertEqual(loaded.generation, trainer.generation)
+        self.assertEqual([t.id for t in loaded.teams], [t.id for t in trainer.teams])
+        self.assertEqual([t.id for t in loaded.rootTeams], [t.id for t in trainer.rootTeams])
+        self.assertEqual([l.id for l in loaded.learners], [l.id for l in trainer.learners])
+        self.assertEqual([t.id for t in loaded.elites], [t.id for t in trainer.elites])
+        for team, copy in zip(trainer.teams, loaded.teams):
+            self.assertEqual([l.id for l in copy.learners], [l.id for l in team.learners])
+            self.assertEqual(collections.Counter(copy.inLearners),
+                             collections.Counter(team.inLearners))
+            self.assertEqual(dict(copy.outcomes), dict(team.outcomes))
+            self.assertEqual(graphHash(copy), graphHash(team))
+        for learner, copy in zip(trainer.learners, loaded.learners):
+            self.assertEqual(copy.program.id, learner.program.id)
+            self.assertTrue(np.array_equal(copy.program.instructions, learner.program.instructions))
+            self.assertEqual(collections.Counter(copy.inTeams), collections.Counter(learner.inTeams))
+
+    '''
+    Each checkpoint only stores what changed, loads back the same population,
+    and the loaded trainer acts and evolves like the original.
+    '''
+    def test_checkpoints(self):
+        trainer = Trainer(actions=4, teamPopSize=20, inputSize=16)
+        with tempfile.TemporaryDirectory() as tmp:
+            store = CheckpointStore(tmp)
+            for gen in range(4):
+                score_teams(trainer)
+                name = store.save(trainer)
+                trainer.evolve(['task'])
+            score_teams(trainer)
+            name = store.save(trainer)
+            self.assertEqual(store.manifests()[-1], name)
+
+            # only the offspring of the last generation were new
+            segments = [os.path.join(tmp, 'segments', f) for f in os.listdir(os.path.join(tmp, 'segments'))]
+            newest = max(segments, key=os.path.getmtime)
+            with np.load(newest) as segment:
+                self.assertLess(len(segment['learnerHash']), len(trainer.learners))
+                self.assertLess(len(segment['teamHash']), len(trainer.teams))
+
+            # a fresh store over the directory knows everything is stored, from
+            # the index without reading the segments
+            with open(newest, 'rb') as f:
+                content = f.read()
+            with open(newest, 'wb') as f:
+                f.write(b'not read')
+            self.assertEqual(CheckpointStore(tmp).index, store.index)
+            with open(newest, 'wb') as f:
+                f.write(content)
+            store = CheckpointStore(tmp)
+            store.save(trainer, name='again')
+            newest = max(segments + [os.path.join(tmp, 'segments', f)
+                        for f in os.listdir(os.path.join(tmp, 'segments'))], key=os.path.getmtime)
+            with np.load(newest) as segment:
+                self.assertEqual(len(segment['learnerHash']), 0)
+                self.assertEqual(len(segment['programHash']), 0)
+
+            loaded = store.load(name)
+            self.assertSamePopulation(trainer, loaded)
+
+            states = np.random.default_rng(0).random((10, 16))
+            for agent, copy in zip(trainer.getAgents(), loaded.getAgents()):
+                for state in states:
+                    self.assertEqual(copy.act(state), agent.act(state))
+
+            # earlier checkpoints are still there
+            self.assertEqual(store.load('gen-1').generation, 1)
+
+            for gen in range(2):
+                loaded.evolve(['task'])
+                score_teams(loaded)
+            trainer.cleanup()
+
+    '''
+    Diagnostics are checkpointed as freshly set up, without their history, and
+    go on working after loading.
+    '''
+    def test_diagnostics(self):
+        trainer = Trainer(actions=4, teamPopSize=20, inputSize=16)
+        with tempfile.TemporaryDirectory() as tmp:
+            trainer.setCounting(maxHistory=5)
+            trainer.setGraphChecking()
+            trainer.setGraphRecording(os.path.join(tmp, 'graph'))
+            trainer.timings.enable()
+            for gen in range(3):
+                score_teams(trainer)
+                trainer.evolve(['task'])
+            score_teams(trainer)
+
+            store = CheckpointStore(os.path.join(tmp, 'store'))
+            loaded = store.load(store.save(trainer))
+            self.assertEqual(len(trainer.counters.history), 3)
+            self.assertEqual(len(loaded.counters.history), 0)
+            self.assertIs(loaded.actVars['counters'], loaded.counters)
+            self.assertEqual(loaded.graphChecker.teams, {})
+            self.assertIsNone(loaded.graphRecorder.last)
+            self.assertEqual(len(loaded.timings.history), 0)
+            self.assertTrue(loaded.timings.enabled)
+
+            loaded.evolve(['task'])
+            self.assertEqual(len(loaded.counters.history), 1)
+            self.assertNotEqual(loaded.graphChecker.teams, {})
+            self.assertEqual(len(loaded.timings.history), 1)
+            trainer.cleanup()
+
+    '''
+    Real valued actions keep their action programs.
+    '''
+    def test_real_actions(self):
+        trainer = Trainer(actions=[1, 1], teamPopSize=10, inputSize=16)
+        with tempfile.TemporaryDirectory() as tmp:
+            store = CheckpointStore(tmp)
+            store.save(trainer)
+            loaded = store.load()
+            self.assertSamePopulation(trainer, loaded)
+            for learner, copy in zip(trainer.learners, loaded.learners):
+                self.assertTrue(np.array_equal(copy.actionObj.program.instructions,
+                                                learner.actionObj.program.instructions))
+                self.assertEqual(copy.actionObj.actionLength, learner.actionObj.actionLength)
+        trainer.cleanup()
+
+    '''
+    Background writes capture the population at submit, however far the
+    trainer got since, and only the retained checkpoints and the segments they
+    use are kept.
+    '''
+    def test_writer(self):
+        trainer = Trainer(actions=4, teamPopSize=20, inputSize=16)
+        with tempfile.TemporaryDirectory() as tmp:
+            self.assertIsNone(resume(tmp))
+            teamIds = {}
+            with CheckpointWriter(CheckpointStore(tmp), keepLast=2, keepEvery=3) as writer:
+                for gen in range(7):
+                    score_teams(trainer)
+                    writer.submit(trainer)
+                    teamIds[gen] = [t.id for t in trainer.teams]
+                    if gen < 6:
+                        trainer.evolve(['task'])
+                writer.flush()
+
+            store = CheckpointStore(tmp)
+            self.assertEqual(sorted(store.manifests()), ['gen-0', 'gen-3', 'gen-5', 'gen-6'])
+            for name in store.manifests():
+                loaded = store.load(name)
+                self.assertEqual([t.id for t in loaded.teams], teamIds[loaded.generation])
+
+            used = set()
+            for name in store.manifests():
+                with open(os.path.join(tmp, 'manifests', name + '.json')) as f:
+                    used.update(json.load(f)['segments'])
+            self.assertEqual(set(f[:-4] for f in os.listdir(os.path.join(tmp, 'segments'))), used)
+
+            resumed = resume(tmp)
+            self.assertSamePopulation(trainer, resumed)
+
+            # the latest is by generation, whenever the files were last touched
+            os.utime(os.path.join(tmp, 'manifests', 'gen-3.json'))
+            self.assertEqual(store.manifests(), ['gen-0', 'gen-3', 'gen-5', 'gen-6'])
+            self.assertEqual(resume(tmp).generation, 6)
+            trainer.cleanup()
+
+if __name__ == '__main__':
+    unittest.main(testRunner=xmlrunner.XMLTestRunner(output='test-reports'))
@@ -0,0 +1,111 @@
+import unittest
+import xmlrunner
+import numpy as np
+import multiprocessing as mp
+from tpg.trainer import Trainer
+from tpg.cost_model import CostModel, graphFeatures
+from tpg.evaluation import EvaluationPool, runRemoteWorker
+from tpg.utils import getLearners, getTeams
+from tpg_tests.evaluation_test import sum_actions, serial_scores, LostOnEval
+
+class CostModelTest(unittest.TestCase):
+
+    '''
+    Features count the graph reachable from the team.
+    '''
+    def test_features(self):
+        trainer = Trainer(actions=4, teamPopSize=20, inputSize=16)
+        for gen in range(3):
+            for rt in trainer.rootTeams:
+                rt.outcomes['task'] = float(len(getLearners(rt)))
+            trainer.evolve(['task'])
+
+        for rt in trainer.rootTeams:
+            features = graphFeatures(rt)
+            self.assertEqual(features[1], len(getTeams(rt)))
+            self.assertEqual(features[2], len(getLearners(rt)))
+            self.assertEqual(features[3],
+                sum(len(l.program.instructions) for l in getLearners(rt)))
+
+        trainer.cleanup()
+
+    '''
+    The fit recovers a linear cost, and teams seen before are predicted by what
+    they took last time.
+    '''
+    def test_predict(self):
+        model = CostModel()
+        rng = np.random.default_rng(0)
+        features = np.column_stack([np.ones(30), rng.integers(1, 10, (30, 3))])
+        coefs = np.array([0.5, 0.1, 0.2, 0.01])
+
+        # no history, instructions stand in
+        self.assertTrue(np.array_equal(model.predict(list(range(30)), features),
+                                        features[:,3]))
+
+        for i in range(20):
+            model.record(i, features[i], features[i] @ coefs)
+        model.fit()
+        self.assertTrue(np.allclose(model.predict(list(range(20, 30)), features[20:]),
+                                    features[20:] @ coefs))
+
+        model.record(25, features[25], 99.0)
+        self.assertEqual(model.predict([25], features[25:26])[0], 99.0)
+
+    '''
+    Cost aware pools hand out the expected longest teams first, in chunks, and
+    score the same as without.
+    '''
+    def test_schedule(self):
+        trainer = Trainer(actions=4, teamPopSize=20, inputSize=16)
+        teams = trainer.rootTeams
+        model = CostModel()
+        with EvaluationPool(trainer, sum_actions, evalArgs=(20, 16), processes=2,
+                            costModel=model) as pool:
+            pool.submit(teams)
+            handed = [teamId for chunk in pool.busy.values() for teamId in chunk]
+            queued = list(pool.queue)
+            self.assertGreater(len(handed), 2) # cheap ones chunked together
+            costs = {team.id: graphFeatures(team)[3] for team in teams}
+            self.assertEqual([costs[teamId] for teamId in queued],
+                             sorted([costs[teamId] for teamId in queued], reverse=True))
+            self.assertGreaterEqual(min(costs[teamId] for teamId in handed),
+                                    max([costs[teamId] for teamId in queued], default=0))
+
+            results = []
+            while pool.numPending() > 0:
+                results += pool.collect()
+
+        expected = serial_scores(trainer, teams)
+        self.assertEqual({r.teamId: r.outcomes['task'] for r in results}, expected)
+        self.assertEqual(len(model.seconds), len(teams))
+        self.assertEqual(pool.features, {})
+
+        trainer.cleanup()
+
+    '''
+    A chunk that can't be sent to a lost remote worker goes back on the queue
+    with its predicted costs, for the other workers to take.
+    '''
+    def test_lost_worker(self):
+        trainer = Trainer(actions=4, teamPopSize=12, inputSize=16)
+        teams = trainer.rootTeams
+        with EvaluationPool(trainer, sum_actions, evalArgs=(20, 16), processes=1,
+                            costModel=CostModel(), address=('localhost', 0),
+                            authkey=b'tpg test') as pool:
+            remote = mp.Process(target=runRemoteWorker, args=(pool.address, b'tpg test'))
+            remote.start()
+            pool.acceptWorkers(1)
+            pool.conns[1] = LostOnEval(pool.conns[1])
+
+            results = pool.evaluate(teams)
+            self.assertEqual({r.teamId: r.outcomes['task'] for r in results},
+                             serial_scores(trainer, teams))
+            self.assertEqual(len(pool.conns), 1)
+            self.assertEqual(pool.costs, {})
+
+        remote.join(timeout=5)
+        trainer.cleanup()
+
+if __name__ == '__main__':
+    unittest.main(testRunner=xmlrunner.XMLTestRunner(output='test-reports'))
@@ -0,0 +1,233 @@
+import unittest
+import xmlrunner
+import collections
+import numpy as np
+from tpg.trainer import Trainer
+from tpg.batch import BatchActor
+from tpg.evaluation import EvaluationPool
+from tpg.counters import FIELDS
+from tpg.trace import DecisionTracer
+from tpg_tests.evaluation_test import sum_actions
+from tpg_tests.test_utils import create_evolved_trainer, score_teams, zero_registers
+
+class CountersTest(unittest.TestCase):
+
+    '''
+    Counted bids and wins match what a tracer sees of every bid, instructions
+    follow from the bids, and each generation's counts go to history.
+    '''
+    def test_counts(self):
+        for traversal in ['team', 'learner']:
+            trainer = create_evolved_trainer(traversal=traversal)
+            trainer.setCounting()
+            self.assertEqual(trainer.functionsDict['Learner']['bid'], 'def_counted')
+            states = np.random.default_rng(0).random((10, 16))
+
+            tracer = DecisionTracer(allBids=True)
+            for agent in trainer.getAgents():
+                for state in states:
+                    agent.act(state, path_trace=tracer)
+            records = tracer.records()
+            bids = collections.Counter(tracer.learnerIds[l] for l in records['learner'])
+            wins = collections.Counter(tracer.learnerIds[l] for l in records['learner'][records['top']])
+
+            counts = trainer.counters.read(trainer.learners)
+            for learner, (numBids, numWins, numInstructions, numMemOps) in zip(trainer.learners, counts):
+                # a learner on several teams of a path bids once, but gets recorded per team
+                self.assertLessEqual(numBids, bids[learner.id])
+                self.assertEqual(numBids > 0, bids[learner.id] > 0)
+                self.assertEqual(numWins, wins[learner.id])
+                self.assertEqual(numInstructions, numBids*len(learner.program.instructions))
+                self.assertEqual(numMemOps, 0)
+            self.assertEqual(counts[:, 1].sum(), records['top'].sum())
+
+            learners = list(trainer.learners)
+            for rt in trainer.rootTeams:
+                rt.outcomes['task'] = 1.0
+            trainer.evolve(['task'])
+            generation, ids, history = trainer.counters.history[-1]
+            self.assertEqual(generation, trainer.generation - 1)
+            self.assertEqual(ids, [l.id for l in learners])
+            self.assertTrue(np.array_equal(history, counts))
+            self.assertEqual(trainer.counters.read(trainer.learners).sum(), 0)
+
+            trainer.setCounting(False)
+            self.assertEqual(trainer.functionsDict['Learner']['bid'], 'def')
+            self.assertNotIn('counters', trainer.actVars)
+            trainer.cleanup()
+
+    '''
+    With memory, the memory reads and writes executed are counted.
+    '''
+    def test_memory(self):
+        trainer = Trainer(actions=4, teamPopSize=20, inputSize=16, memType='def')
+        trainer.setCounting()
+        self.assertEqual(trainer.functionsDict['Learner']['bid'], 'mem_counted')
+        memOps = [i for i, op in enumerate(trainer.operations) if op.startswith('MEM_')]
+        for agent in trainer.getAgents():
+            for state in np.random.default_rng(0).random((5, 16)):
+                agent.act(state)
+
+        counts = trainer.counters.read(trainer.learners)
+        self.assertGreater(counts[:, FIELDS.index('memOps')].sum(), 0)
+        for learner, row in zip(trainer.learners, counts):
+            self.assertEqual(row[3], row[0]*np.isin(learner.program.instructions[:,1], memOps).sum())
+        trainer.setCounting(False)
+        trainer.cleanup()
+
+    '''
+    The batched kernel counts the same as acting agent by agent.
+    '''
+    def test_batch(self):
+        trainer = create_evolved_trainer()
+        trainer.setCounting()
+        agents = trainer.getAgents()
+        states = np.random.default_rng(1).random((10, 16))
+        for agent in agents:
+            zero_registers(trainer)
+            for state in states:
+                agent.act(state)
+        expected = trainer.counters.read(trainer.learners)
+        expectedTeamWins = dict(trainer.counters.teamWins)
+        trainer.counters.reset()
+
+        actor = BatchActor(trainer.publishSnapshot(shared=False), len(agents),
+                           trainer.functionsDict, counters=trainer.counters)
+        for slot, agent in enumerate(agents):
+            actor.assign(slot, agent.team.id)
+        for state in states:
+            actor.act(np.repeat(state[None], len(agents), axis=0))
+        self.assertEqual(trainer.counters.read(trainer.learners).sum(), 0)
+        actor.flushCounts()
+        self.assertTrue(np.array_equal(trainer.counters.read(trainer.learners), expected))
+        self.assertEqual(trainer.counters.teamWins, expectedTeamWins)
+        trainer.setCounting(False)
+        trainer.cleanup()
+
+    '''
+    Pruning removes the learners that never won on a team from it, keeping the
+    last atomic action of each team, leaves teams that weren't acted with
+    alone, and doesn't change the actions of the teams acted with.
+    '''
+    def test_prune(self):
+        trainer = create_evolved_trainer()
+        trainer.setCounting(pruneHitchhikers=True)
+        agents = trainer.getAgents()
+        acted, idle = agents[:-3], agents[-3:]
+        states = np.random.default_rng(2).random((10, 16))
+
+        # registers zeroed every frame, a pruned learner still on other teams
+        # would otherwise carry different memory there
+        def play():
+            actions = []
+            for agent in acted:
+                actions.append([])
+                for state in states:
+                    zero_registers(trainer)
+                    actions[-1].append(agent.act(state))
+            return actions
+
+        before = play()
+        idleLearners = {agent.team.id: list(agent.team.learners) for agent in idle}
+        teamWins = dict(trainer.counters.teamWins)
+        teamLearners = {team.id: list(team.learners) for team in trainer.teams}
+        teamSizes = sum(len(team.learners) for team in trainer.teams)
+
+        removed, affected = trainer.pruneHitchhikers()
+        self.assertGreater(len(removed), 0)
+        self.assertEqual(sum(len(team.learners) for team in trainer.teams),
+                         teamSizes - len(removed))
+        for team in trainer.teams:
+            for learner in teamLearners[team.id]:
+                if not any(learner is l for l in team.learners):
+                    self.assertNotIn((team.id, learner.id), teamWins)
+        for team in affected:
+            self.assertGreaterEqual(team.numAtomicActions(), 1)
+            for learner in team.learners:
+                self.assertTrue((team.id, learner.id) in teamWins or learner.isActionAtomic())
+        for agent in idle:
+            if not any((agent.team.id, l.id) in teamWins for l in idleLearners[agent.team.id]):
+                self.assertEqual(agent.team.learners, idleLearners[agent.team.id])
+
+        trainer.counters.reset()
+        self.assertEqual(play(), before)
+
+        # and automatically in evolve
+        score_teams(trainer)
+        teamWins = dict(trainer.counters.teamWins)
+        trainer.evolve(['task'])
+        for team in trainer.teams:
+            if (team.genCreate < trainer.generation - 1
+                    and any((team.id, l.id) in teamWins for l in team.learners)):
+                for learner in team.learners:
+                    self.assertTrue((team.id, learner.id) in teamWins
+                                    or learner.isActionAtomic())
+        trainer.setCounting(False)
+        trainer.cleanup()
+
+    '''
+    A learner winning on one team is still a hitchhiker on another team it
+    never wins on.
+    '''
+    def test_prune_per_team(self):
+        trainer = create_evolved_trainer()
+        trainer.setCounting()
+        learner, teams = next((l, [t for t in trainer.teams if str(t.id) in l.inTeams])
+            for l in trainer.learners if len(l.inTeams) > 1 and not l.isActionAtomic())
+        winning, hitchhiking = teams[:2]
+        for team in [winning, hitchhiking]:
+            for other in team.learners:
+                if other is not learner or team is winning:
+                    trainer.counters.countWin(other, team)
+
+        removed, affected = trainer.pruneHitchhikers([winning, hitchhiking])
+        self.assertEqual(removed, [learner])
+        self.assertEqual(affected, [hitchhiking])
+        self.assertTrue(any(l is learner for l in winning.learners))
+        self.assertFalse(any(l is learner for l in hitchhiking.learners))
+        trainer.setCounting(False)
+        trainer.cleanup()
+
+    '''
+    Counts made in evaluation workers come back with the results, and count
+    for pruning once applied.
+    '''
+    def test_pool(self):
+        trainer = create_evolved_trainer()
+        trainer.setCounting(pruneHitchhikers=True)
+        teams = list(trainer.rootTeams)
+        with EvaluationPool(trainer, sum_actions, evalArgs=(20, 16), processes=2) as pool:
+            results = pool.evaluate(teams)
+        self.assertTrue(all(r.counts is not None for r in results))
+        self.assertEqual(trainer.counters.read(trainer.learners).sum(), 0)
+
+        trainer.applyScores(results)
+        for team in teams:
+            # one win on the root team every frame, more on elites others reach
+            wins = trainer.counters.teamWinCounts(team).sum()
+            if len(team.inLearners) == 0:
+                self.assertEqual(wins, 20)
+            else:
+                self.assertGreaterEqual(wins, 20)
+        removed, affected = trainer.pruneHitchhikers()
+        self.assertGreater(len(affected), 0)
+        trainer.setCounting(False)
+        trainer.cleanup()
+
+    '''
+    Removing hitchhikers by hand drops every learner of the team that wasn't
+    visited.
+    '''
+    def test_remove_hitchhikers(self):
+        trainer = create_evolved_trainer()
+        team = max(trainer.rootTeams, key=lambda t: len(t.learners))
+        keep = [l for l in team.learners if l.isActionAtomic()][:1]
+        numLearners = len(team.learners)
+        removed, affected = trainer.removeHitchhikers([team], [keep])
+        self.assertEqual(team.learners, keep)
+        self.assertEqual(len(removed), numLearners - 1)
+        self.assertEqual(affected, [team] if numLearners > 1 else [])
+        trainer.cleanup()
+
+if __name__ == '__main__':
+    unittest.main(testRunner=xmlrunner.XMLTestRunner(output='test-reports'))
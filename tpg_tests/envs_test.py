@@ -0,0 +1,160 @@
+import unittest
+import xmlrunner
+import numpy as np
+from tpg.trainer import Trainer
+from tpg.envs import SyntheticEnv, VectorEnv, EnvPool, StartStateCache, processEnvPool
+from tpg.evaluation import EvaluationPool, evaluateLockstep
+
+def make_synthetic(name):
+    return SyntheticEnv(inputSize=16, numActions=4, episodeLength=20)
+
+'''
+Evaluation function using the worker's environment pool, also reporting how
+many environments the worker created so far.
+'''
+def play_pooled(agent, numEpisodes):
+    envPool = processEnvPool(make_synthetic)
+    env = envPool.acquire('synth')
+    score = 0
+    for ep in range(numEpisodes):
+        state = env.reset()
+        isDone = False
+        while not isDone:
+            state, reward, isDone, debug = env.step(agent.act(state))
+            score += reward
+    envPool.release('synth', env)
+    return {'task': score/numEpisodes, 'created': float(envPool.numCreated)}
+
+'''
+Synthetic environment counting its steps.
+'''
+class CountingEnv(SyntheticEnv):
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.steps = 0
+
+    def step(self, action):
+        self.steps += 1
+        return super().step(action)
+
+'''
+Environment without clone support.
+'''
+class NoCloneEnv:
+
+    def __init__(self, env):
+        self.env = env
+        self.action_space = env.action_space
+
+    def reset(self):
+        return self.env.reset()
+
+    def step(self, action):
+        return self.env.step(action)
+
+class EnvsTest(unittest.TestCase):
+
+    def test_synthetic(self):
+        env = make_synthetic('synth')
+        first = env.reset()
+        states = [first.copy()]
+        isDone = False
+        while not isDone:
+            state, reward, isDone, debug = env.step(1)
+            states.append(state)
+        self.assertEqual(len(states), 21)
+        self.assertTrue(np.array_equal(env.reset(), first))
+
+        vecEnv = VectorEnv([lambda: make_synthetic('synth')]*3)
+        self.assertEqual(len(vecEnv.reset()), 3)
+        states, rewards, dones, debugs = vecEnv.step([0, 1, 2], np.array([True, False, True]))
+        self.assertIsNone(states[1])
+        self.assertEqual(rewards[1], 0)
+
+    '''
+    Released environments get reused, up to maxIdle are kept per key.
+    '''
+    def test_pool(self):
+        envPool = EnvPool(make_synthetic, maxIdle=1)
+        env1 = envPool.acquire('a')
+        env2 = envPool.acquire('a')
+        self.assertIsNot(env1, env2)
+        envPool.release('a', env1)
+        envPool.release('a', env2) # closed, one already idle
+        self.assertIs(envPool.acquire('a'), env1)
+        self.assertIsNot(envPool.acquire('b'), env1)
+        self.assertEqual(envPool.numCreated, 3)
+
+        envPool.discard(env1)
+        self.assertEqual(envPool.acquire('a').__class__, SyntheticEnv)
+        self.assertEqual(envPool.numCreated, 4)
+
+        self.assertIs(processEnvPool(make_synthetic), processEnvPool(make_synthetic))
+
+    '''
+    Evaluation workers create their environment once and keep reusing it over
+    agents and generations.
+    '''
+    def test_worker_reuse(self):
+        trainer = Trainer(actions=4, teamPopSize=10, inputSize=16)
+        with EvaluationPool(trainer, play_pooled, evalArgs=(2,), processes=2) as pool:
+            for gen in range(2):
+                results = pool.evaluate([a.team for a in trainer.getAgents(skipTasks=['task'])])
+                for result in results:
+                    self.assertEqual(result.outcomes['created'], 1.0)
+                trainer.applyScores(results)
+                trainer.evolve(['task'])
+
+        trainer.cleanup()
+
+    '''
+    Only the first size starts play the warmup frames, later ones restore one of
+    the saved starts.
+    '''
+    def test_start_cache(self):
+        env = CountingEnv(inputSize=16, numActions=4, episodeLength=50)
+        cache = StartStateCache(nRandFrames=10, size=3, seed=0)
+        firsts = [cache.start(env) for i in range(3)]
+        self.assertEqual(env.steps, 30)
+
+        for i in range(20):
+            state = cache.start(env)
+            self.assertTrue(any(np.array_equal(state, first) for first in firsts))
+            self.assertEqual(env.frame, 10)
+        self.assertEqual(env.steps, 30)
+
+        # can't clone, always warms up
+        env = CountingEnv(inputSize=16, numActions=4, episodeLength=50)
+        cache = StartStateCache(nRandFrames=10, size=3)
+        for i in range(5):
+            cache.start(NoCloneEnv(env))
+        self.assertEqual(env.steps, 50)
+        self.assertEqual(len(cache.starts), 0)
+
+    '''
+    Lockstep evaluation with a start cache skips the warmup frames once the
+    cache is full.
+    '''
+    def test_lockstep_start_cache(self):
+        trainer = Trainer(actions=4, teamPopSize=10, inputSize=16)
+        teams = [a.team for a in trainer.getAgents()]
+        envs = []
+        def make_env():
+            envs.append(CountingEnv(inputSize=16, numActions=4, episodeLength=20))
+            return envs[-1]
+        vecEnv = VectorEnv([make_env]*2)
+
+        evaluateLockstep(trainer, teams, vecEnv, 2, 20, 'synth', nRandFrames=5)
+        plain = sum(env.steps for env in envs)
+        for env in envs:
+            env.steps = 0
+        results = evaluateLockstep(trainer, teams, vecEnv, 2, 20, 'synth', nRandFrames=5,
+                    startCache=StartStateCache(5, size=2))
+        self.assertEqual(len(results), len(teams))
+        self.assertEqual(sum(env.steps for env in envs), plain - 5*(2*len(teams) - 2))
+
+        trainer.cleanup()
+
+if __name__ == '__main__':
+    unittest.main(testRunner=xmlrunner.XMLTestRunner(output='test-reports'))
@@ -0,0 +1,384 @@
+import unittest
+import xmlrunner
+import numpy as np
+import multiprocessing as mp
+import os
+import tempfile
+import time
+from tpg.trainer import Trainer
+from tpg.evaluation import (EvaluationPool, PopulationSync, PopulationReplica, reachableTeams,
+    outOfRace, runRemoteWorker, EvalResult, COMPLETED, TIMED_OUT, FAILED)
+from tpg.utils import getLearners
+
+'''
+Cheap deterministic evaluation, the sum of the actions taken over some fixed
+states.
+'''
+def sum_actions(agent, numFrames, inputSize):
+    states = np.random.default_rng(0).random((numFrames, inputSize))
+    return {'task': float(sum(agent.act(state) for state in states))}
+
+'''
+Like sum_actions, but the teams given by id hang, raise, kill their worker, or
+are slow only the first time they are played (going by a marker file).
+'''
+def misbehave(agent, numFrames, inputSize, hang=None, fail=None, die=None,
+        slow=None, marker=None):
+    teamId = agent.team.id
+    if teamId == hang:
+        time.sleep(60)
+    elif teamId == fail:
+        raise ValueError("bad agent")
+    elif teamId == die:
+        os._exit(1)
+    elif teamId == slow and not os.path.exists(marker):
+        open(marker, 'w').close()
+        time.sleep(60)
+    return sum_actions(agent, numFrames, inputSize)
+
+def serial_scores(trainer, teams):
+    scores = {}
+    for agent in trainer.getAgents():
+        if agent.team in teams:
+            for learner in getLearners(agent.team):
+                learner.zeroRegisters()
+            scores[agent.team.id] = sum_actions(agent, 20, 16)['task']
+    return scores
+
+'''
+Connection to a worker that is lost as soon as it is handed teams.
+'''
+class LostOnEval:
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def send(self, msg):
+        if msg[0] == 'eval':
+            raise BrokenPipeError()
+        self.conn.send(msg)
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+class EvaluationTest(unittest.TestCase):
+
+    '''
+    Replicas built from deltas must have the same structure as the trainer's
+    population, and later deltas only carry what changed.
+    '''
+    def test_delta_sync(self):
+        trainer = Trainer(actions=4, teamPopSize=20, inputSize=16)
+        sync = PopulationSync()
+        replica = PopulationReplica()
+
+        for gen in range(4):
+            delta = sync.delta(trainer.teams)
+            replica.applyDelta(delta)
+
+            if gen > 0:
+                # survivors don't get resent
+                self.assertLess(len(delta.learners), len(trainer.learners))
+
+            teams = reachableTeams(trainer.teams)
+            self.assertEqual(set(replica.teams), set(t.id for t in teams))
+            for team in teams:
+                copy = replica.teams[team.id]
+                self.assertEqual([l.id for l in copy.learners], [l.id for l in team.learners])
+                for learner, lCopy in zip(team.learners, copy.learners):
+                    self.assertTrue(np.array_equal(learner.program.instructions,
+                                                    lCopy.program.instructions))
+                    if learner.isActionAtomic():
+                        self.assertEqual(learner.actionObj.actionCode, lCopy.actionObj.actionCode)
+                    else:
+                        self.assertIs(lCopy.actionObj.teamAction,
+                            replica.teams[learner.actionObj.teamAction.id])
+
+            for rt in trainer.rootTeams:
+                rt.outcomes['task'] = float(len(rt.learners))
+            trainer.evolve(['task'])
+
+        # nothing changed, nothing to send
+        sync.delta(trainer.teams)
+        delta = sync.delta(trainer.teams)
+        self.assertEqual(sum(len(part) for part in delta), 0)
+
+        trainer.cleanup()
+
+    '''
+    Persistent workers produce the same scores as evaluating in process, over
+    multiple generations.
+    '''
+    def test_pool(self):
+        trainer = Trainer(actions=4, teamPopSize=12, inputSize=16)
+
+        with EvaluationPool(trainer, sum_actions, evalArgs=(20, 16), processes=3) as pool:
+            for gen in range(3):
+                teams = [a.team for a in trainer.getAgents(skipTasks=['task'])]
+                results = pool.evaluate(teams)
+                self.assertEqual(sorted(r.teamId for r in results), sorted(t.id for t in teams))
+
+                expected = serial_scores(trainer, teams)
+                for result in results:
+                    self.assertEqual(result.outcomes['task'], expected[result.teamId])
+
+                trainer.applyScores(results)
+                trainer.evolve(['task'])
+
+        trainer.cleanup()
+
+    '''
+    Steady state evolution only replaces evaluated root teams, leaves the ones
+    still being evaluated alone, and keeps the workers busy without a
+    generation barrier.
+    '''
+    def test_steady_state(self):
+        trainer = Trainer(actions=4, teamPopSize=12, inputSize=16)
+
+        # not enough evaluated root teams to replace any yet
+        self.assertEqual(trainer.evolveSteadyState(['task'], numReplace=3), [])
+
+        with EvaluationPool(trainer, sum_actions, evalArgs=(20, 16), processes=3) as pool:
+            pool.submit(trainer.rootTeams)
+            arrived = 0
+            for step in range(12):
+                results = pool.collect()
+                self.assertGreater(len(results), 0)
+                expected = serial_scores(trainer, [t for t in trainer.rootTeams
+                                                    if t.id in set(r.teamId for r in results)])
+                for result in results:
+                    if result.teamId in expected:
+                        self.assertEqual(result.outcomes['task'], expected[result.teamId])
+                trainer.applyScores(results)
+                arrived += len(results)
+
+                if arrived >= 3:
+                    waiting = [t for t in trainer.rootTeams if 'task' not in t.outcomes]
+                    newTeams = trainer.evolveSteadyState(['task'], numReplace=3)
+                    arrived = 0
+                    for team in waiting:
+                        self.assertIn(team, trainer.teams)
+                    for team in newTeams:
+                        self.assertIn(team, trainer.rootTeams)
+                        self.assertNotIn('task', team.outcomes)
+                    pool.submit(newTeams)
+
+                self.assertGreaterEqual(len(trainer.teams), trainer.teamPopSize)
+
+            # everything handed out gets its result
+            while pool.numPending() > 0:
+                trainer.applyScores(pool.collect())
+
+        trainer.cleanup()
+
+    '''
+    Root teams still out for evaluation aren't made team actions of offspring,
+    so stay root teams and their results still count when they arrive.
+    '''
+    def test_steady_state_waiting(self):
+        trainer = Trainer(actions=4, teamPopSize=12, inputSize=16, pActMut=1.0, pActAtom=0.0)
+        waiting = trainer.rootTeams[:4]
+        for gen in range(6):
+            for rt in trainer.rootTeams:
+                if rt not in waiting and 'task' not in rt.outcomes:
+                    rt.outcomes['task'] = float(len(rt.learners))
+            trainer.evolveSteadyState(['task'], numReplace=3)
+            for team in waiting:
+                self.assertEqual(team.numLearnersReferencing(), 0)
+                self.assertIn(team, trainer.rootTeams)
+        self.assertTrue(any(not l.isActionAtomic() for l in trainer.learners))
+
+        trainer.applyScores([EvalResult(team.id, {'task': 100.0}, 0.1) for team in waiting])
+        for team in waiting:
+            self.assertEqual(team.outcomes['task'], 100.0)
+        trainer.checkGraph(full=True)
+        trainer.cleanup()
+
+    '''
+    Submitting doesn't wait on a worker busy with a team, the population delta
+    is held back until it is idle again.
+    '''
+    def test_submit_busy(self):
+        trainer = Trainer(actions=4, teamPopSize=100, inputSize=16)
+        with tempfile.TemporaryDirectory() as tmp:
+            with EvaluationPool(trainer, misbehave, evalArgs=(20, 16), processes=1) as pool:
+                slow = trainer.rootTeams[0]
+                pool.submit([slow], evalKwargs={'slow': slow.id,
+                                                'marker': os.path.join(tmp, 'marker')})
+                for gen in range(4):
+                    for rt in trainer.rootTeams:
+                        rt.outcomes['task'] = float(len(rt.learners))
+                    trainer.evolve(['task'])
+
+                start = time.perf_counter()
+                pool.submit(trainer.rootTeams[:2])
+                self.assertLess(time.perf_counter() - start, 5)
+                self.assertEqual(len(pool.held[pool.conns[0]]), 1)
+
+        trainer.cleanup()
+
+    '''
+    The survival cutoff is the worst outcome kept at the current gap, and
+    agents are only out of the race once confidently below it.
+    '''
+    def test_racing(self):
+        trainer = Trainer(actions=4, teamPopSize=10, inputSize=16, gap=0.5)
+        for i, rt in enumerate(trainer.rootTeams[:4]):
+            rt.outcomes['task'] = float(i)
+        self.assertEqual(trainer.getSurvivalCutoff('task'), -np.inf) # 5 kept, 4 known
+
+        for i, rt in enumerate(trainer.rootTeams[4:7]):
+            rt.outcomes['task'] = float(10 + i)
+        self.assertEqual(trainer.getSurvivalCutoff('task'), 2.0) # 12, 11, 10, 3, 2
+
+        self.assertFalse(outOfRace([0.0], 5.0)) # too few episodes
+        self.assertTrue(outOfRace([0.0, 0.0], 5.0))
+        self.assertFalse(outOfRace([0.0, 10.0], 5.0)) # too uncertain
+        self.assertTrue(outOfRace([0.0, 10.0]*32, 7.0))
+        self.assertFalse(outOfRace([0.0, 0.0], None))
+        self.assertFalse(outOfRace([0.0, 0.0], -np.inf))
+
+        trainer.cleanup()
+
+    '''
+    A hanging, a raising and a dying agent get timed out or failed results, the
+    rest score as usual, failures get the worst score, and the replaced workers
+    carry on with the next evaluation.
+    '''
+    def test_timeouts(self):
+        trainer = Trainer(actions=4, teamPopSize=12, inputSize=16)
+        teams = trainer.rootTeams
+        with EvaluationPool(trainer, misbehave, evalArgs=(20, 16), processes=3,
+                            timeout=2.0) as pool:
+            results = pool.evaluate(teams, evalKwargs={'hang': teams[0].id,
+                                    'fail': teams[1].id, 'die': teams[2].id})
+            self.assertEqual(sorted(r.teamId for r in results), sorted(t.id for t in teams))
+            statuses = {r.teamId: r.status for r in results}
+            self.assertEqual(statuses[teams[0].id], TIMED_OUT)
+            self.assertEqual(statuses[teams[1].id], FAILED)
+            self.assertIn("bad agent", [r for r in results if r.teamId == teams[1].id][0].detail)
+            self.assertEqual(statuses[teams[2].id], FAILED)
+
+            expected = serial_scores(trainer, teams[3:])
+            for result in results:
+                if result.teamId in expected:
+                    self.assertEqual(result.status, COMPLETED)
+                    self.assertEqual(result.outcomes['task'], expected[result.teamId])
+
+            trainer.applyScores(results, tasks=['task'])
+            worst = min(expected.values())
+            for team in teams[:3]:
+                self.assertEqual(team.outcomes['task'], worst)
+
+            results = pool.evaluate(teams, evalKwargs={})
+            self.assertTrue(all(r.status == COMPLETED for r in results))
+            self.assertEqual(len(results), len(teams))
+
+        trainer.cleanup()
+
+    '''
+    A straggler gets copied to an idle worker, its first result counts.
+    '''
+    def test_stragglers(self):
+        trainer = Trainer(actions=4, teamPopSize=8, inputSize=16)
+        teams = trainer.rootTeams
+        with tempfile.TemporaryDirectory() as tmp:
+            with EvaluationPool(trainer, misbehave, evalArgs=(20, 16), processes=2,
+                                stragglerFactor=5) as pool:
+                start = time.perf_counter()
+                results = pool.evaluate(teams, evalKwargs={'slow': teams[0].id,
+                                        'marker': os.path.join(tmp, 'marker')})
+                self.assertLess(time.perf_counter() - start, 30)
+                self.assertEqual(sorted(r.teamId for r in results), sorted(t.id for t in teams))
+                self.assertEqual({r.teamId: r.outcomes['task'] for r in results},
+                                 serial_scores(trainer, teams))
+                self.assertEqual(pool.numPending(), 0)
+
+        trainer.cleanup()
+
+    '''
+    A straggler left running alone at the end still gets copied, rather than
+    waited on.
+    '''
+    def test_straggler_tail(self):
+        trainer = Trainer(actions=4, teamPopSize=8, inputSize=16)
+        teams = trainer.rootTeams[:2]
+        with tempfile.TemporaryDirectory() as tmp:
+            with EvaluationPool(trainer, misbehave, evalArgs=(20, 16), processes=2,
+                                stragglerFactor=5) as pool:
+                start = time.perf_counter()
+                results = pool.evaluate(teams, evalKwargs={'slow': teams[1].id,
+                                        'marker': os.path.join(tmp, 'marker')})
+                self.assertLess(time.perf_counter() - start, 30)
+                self.assertEqual({r.teamId: r.outcomes['task'] for r in results},
+                                 serial_scores(trainer, teams))
+                self.assertEqual(pool.numPending(), 0)
+
+        trainer.cleanup()
+
+    '''
+    Workers connecting over TCP evaluate alongside a local one, losing one of
+    them doesn't lose any results.
+    '''
+    def test_remote_workers(self):
+        trainer = Trainer(actions=4, teamPopSize=12, inputSize=16)
+        with EvaluationPool(trainer, sum_actions, evalArgs=(20, 16), processes=1,
+                            address=('localhost', 0), authkey=b'tpg test') as pool:
+            remotes = [mp.Process(target=runRemoteWorker, args=(pool.address, b'tpg test'))
+                        for i in range(2)]
+            for remote in remotes:
+                remote.start()
+            pool.acceptWorkers(2)
+            self.assertEqual(len(pool.conns), 3)
+
+            for gen in range(2):
+                teams = [a.team for a in trainer.getAgents(skipTasks=['task'])]
+                results = pool.evaluate(teams)
+                self.assertEqual({r.teamId: r.outcomes['task'] for r in results},
+                                 serial_scores(trainer, teams))
+                trainer.applyScores(results)
+                trainer.evolve(['task'])
+
+            remotes[0].terminate()
+            remotes[0].join()
+            teams = trainer.rootTeams
+            results = pool.evaluate(teams)
+            self.assertEqual(sorted(r.teamId for r in results), sorted(t.id for t in teams))
+            self.assertEqual(len(pool.conns), 2)
+
+        remotes[1].join(timeout=5)
+        self.assertFalse(remotes[1].is_alive())
+        trainer.cleanup()
+
+    '''
+    Listening for remote workers without an authkey is refused.
+    '''
+    def test_remote_authkey(self):
+        trainer = Trainer(actions=4, teamPopSize=12, inputSize=16)
+        for authkey in [None, b'']:
+            with self.assertRaises(Exception):
+                EvaluationPool(trainer, sum_actions, evalArgs=(20, 16), processes=0,
+                               address=('localhost', 0), authkey=authkey)
+        trainer.cleanup()
+
+    '''
+    Losing every worker with teams still to evaluate raises rather than waiting
+    forever.
+    '''
+    def test_no_workers(self):
+        trainer = Trainer(actions=4, teamPopSize=6, inputSize=16)
+        with EvaluationPool(trainer, sum_actions, evalArgs=(20, 16), processes=0,
+                            address=('localhost', 0), authkey=b'tpg test') as pool:
+            remote = mp.Process(target=runRemoteWorker, args=(pool.address, b'tpg test'))
+            remote.start()
+            pool.acceptWorkers(1)
+            pool.conns[0] = LostOnEval(pool.conns[0])
+            with self.assertRaises(Exception):
+                pool.evaluate(trainer.rootTeams)
+            self.assertEqual(len(pool.conns), 0)
+
+        remote.join(timeout=5)
+        trainer.cleanup()
+
+if __name__ == '__main__':
+    unittest.main(testRunner=xmlrunner.XMLTestRunner(output='test-reports'))
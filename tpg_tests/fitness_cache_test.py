@@ -0,0 +1,88 @@
+import unittest
+import xmlrunner
+import numpy as np
+from tpg.team import Team
+from tpg.fitness_cache import FitnessCache
+from tpg.snapshot import PopulationSnapshot
+from tpg.utils import graphHash
+from tpg_tests.test_utils import create_evolved_trainer
+
+class FitnessCacheTest(unittest.TestCase):
+
+    '''
+    The hash depends on the graph's structure and programs, not on ids.
+    '''
+    def test_graph_hash(self):
+        trainer = create_evolved_trainer(gens=3)
+        snapshot = PopulationSnapshot.fromTeams(trainer.teams, trainer.rootTeams)
+
+        hashes = set()
+        for rt in trainer.rootTeams:
+            key = graphHash(rt)
+            hashes.add(key)
+            # rebuilt copy with fresh objects
+            self.assertEqual(graphHash(snapshot.buildTeam(rt.id)), key)
+
+            # same learners on a new team, like an offspring before mutation
+            child = Team(initParams=trainer.mutateParams)
+            for learner in rt.learners:
+                child.learners.append(learner)
+            self.assertEqual(graphHash(child), key)
+
+            # learner order matters, ties go to the first learner
+            if len(rt.learners) > 1:
+                child.learners.reverse()
+                self.assertNotEqual(graphHash(child), key)
+
+        self.assertGreater(len(hashes), 1)
+
+        # changing a program changes the hash
+        rt = trainer.rootTeams[0]
+        copy = snapshot.buildTeam(rt.id)
+        instructions = np.array(copy.learners[0].program.instructions)
+        instructions[0, 1] = (instructions[0, 1] + 1) % trainer.nOperations
+        copy.learners[0].program.instructions = instructions
+        self.assertNotEqual(graphHash(copy), graphHash(rt))
+
+        # cycles are fine
+        copy = snapshot.buildTeam(rt.id)
+        copy.learners[0].actionObj.teamAction = copy
+        copy.learners[0].actionObj.actionCode = None
+        graphHash(copy)
+
+        trainer.cleanup()
+
+    '''
+    Teams identical to cached ones inherit their outcomes, duplicates are only
+    evaluated once, and old entries get evicted.
+    '''
+    def test_cache(self):
+        trainer = create_evolved_trainer(gens=3)
+        rt = trainer.rootTeams[0]
+        twin = Team(initParams=trainer.mutateParams)
+        for learner in rt.learners:
+            twin.learners.append(learner)
+        other = trainer.rootTeams[1]
+
+        cache = FitnessCache(capacity=2)
+        del rt.outcomes['task']
+        toEvaluate = cache.inherit([rt, twin, other], ['task'])
+        self.assertEqual(toEvaluate, [rt] + ([other] if graphHash(other) != graphHash(rt) else []))
+
+        rt.outcomes['task'] = 42.0
+        cache.store([rt], ['task'])
+        self.assertEqual(cache.inherit([twin], ['task']), [])
+        self.assertEqual(twin.outcomes['task'], 42.0)
+        self.assertEqual(cache.hits, 1)
+
+        # not cached for tasks it wasn't stored with
+        self.assertEqual(cache.inherit([twin], ['task', 'other']), [twin])
+
+        cache.store(trainer.rootTeams[1:4], ['task'])
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get(graphHash(rt)))
+
+        trainer.cleanup()
+
+if __name__ == '__main__':
+    unittest.main(testRunner=xmlrunner.XMLTestRunner(output='test-reports'))
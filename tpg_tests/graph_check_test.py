@@ -0,0 +1,97 @@
+import unittest
+import xmlrunner
+import pickle
+from tpg.trainer import Trainer
+from tpg.graph_check import GraphChecker
+from tpg_tests.test_utils import score_teams
+
+class GraphCheckTest(unittest.TestCase):
+
+    '''
+    Evolution keeps the invariants, checked after every generation.
+    '''
+    def test_evolve(self):
+        for kwargs in [{'actions': 4}, {'actions': 4, 'traversal': 'learner'},
+                       {'actions': [1, 1]}]:
+            trainer = Trainer(teamPopSize=30, inputSize=16, **kwargs)
+            trainer.setGraphChecking()
+            trainer.timings.enable()
+            for gen in range(6):
+                score_teams(trainer)
+                trainer.evolve(['task'])
+            score_teams(trainer)
+            trainer.evolveSteadyState(['task'], numReplace=3)
+            self.assertIn('checkGraph', trainer.timings.history[-1][1])
+            trainer.checkGraph(full=True)
+            trainer.cleanup()
+
+    '''
+    Broken invariants are found by the next check, though only what changed is
+    looked at.
+    '''
+    def test_problems(self):
+        trainer = Trainer(actions=4, teamPopSize=30, inputSize=16)
+        for gen in range(4):
+            score_teams(trainer)
+            trainer.evolve(['task'])
+        saved = pickle.dumps(trainer)
+
+        def checked():
+            copy = pickle.loads(saved)
+            checker = GraphChecker()
+            self.assertEqual(checker.check(copy), [])
+            self.assertEqual(checker.check(copy), [])
+            return copy, checker
+
+        # a learner forgets one of its teams
+        copy, checker = checked()
+        learner = next(l for l in copy.learners if len(l.inTeams) > 0)
+        learner.inTeams.pop()
+        self.assertTrue(any('in inTeams 0 times' in p for p in checker.check(copy)))
+
+        # a pointed to team leaves the population without its learners knowing
+        copy, checker = checked()
+        team = next(t for t in copy.teams if len(t.inLearners) > 0)
+        copy.teams.remove(team)
+        problems = checker.check(copy)
+        self.assertTrue(any('not in the population' in p for p in problems))
+
+        # a team loses its atomic actions
+        copy, checker = checked()
+        team = next(t for t in copy.teams if any(not l.isActionAtomic() for l in t.learners))
+        for learner in [l for l in team.learners if l.isActionAtomic()]:
+            team.removeLearner(learner)
+        self.assertTrue(any('no atomic action' in p for p in checker.check(copy)))
+
+        # a team that is pointed to counts as a root team
+        copy, checker = checked()
+        team = next(t for t in copy.teams if len(t.inLearners) > 0)
+        copy.rootTeams.append(team)
+        self.assertTrue(any('is a root team' in p for p in checker.check(copy)))
+        with self.assertRaises(Exception):
+            copy.checkGraph()
+
+        trainer.cleanup()
+
+    '''
+    An elite stays a root team while others point to it, and isn't deleted by
+    selection once it is no longer one.
+    '''
+    def test_former_elite(self):
+        trainer = Trainer(actions=4, teamPopSize=30, inputSize=16)
+        for gen in range(4):
+            score_teams(trainer)
+            trainer.evolve(['task'])
+        team = next(t for t in trainer.teams
+                        if len(t.inLearners) > 0 and t not in trainer.rootTeams)
+        trainer.rootTeams.append(team) # as nextEpoch keeps an elite
+        score_teams(trainer)
+        team.outcomes['task'] = -1.0
+        trainer.evolve(['task'])
+        self.assertIn(team, trainer.teams)
+        self.assertNotIn(team, trainer.rootTeams)
+        trainer.checkGraph(full=True)
+        trainer.cleanup()
+
+if __name__ == '__main__':
+    unittest.main(testRunner=xmlrunner.XMLTestRunner(output='test-reports'))
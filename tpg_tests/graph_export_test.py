@@ -0,0 +1,121 @@
+import unittest
+import xmlrunner
+import json
+import os
+import shutil
+import tempfile
+import xml.etree.ElementTree as ET
+from tpg.trainer import Trainer
+from tpg.graph_export import graphArrays, graphDiff, loadArrays, edgeSet, NODE_TYPES
+from tpg_tests.test_utils import score_teams
+
+'''
+Nodes and links of the trainer as get_graph used to build them from the objects.
+'''
+def expectedGraph(trainer):
+    nodes = set((str(code), 'action') for code in trainer.actionCodes)
+    nodes |= set((str(team.id), 'rootTeam' if team in trainer.rootTeams else 'team')
+                    for team in trainer.teams)
+    nodes |= set((str(learner.id), 'learner') for learner in trainer.learners)
+    links = set((learnerId, str(team.id)) for team in trainer.teams
+                    for learnerId in team.inLearners)
+    for learner in trainer.learners:
+        links |= set((teamId, str(learner.id)) for teamId in learner.inTeams)
+        if learner.isActionAtomic():
+            links.add((str(learner.id), str(learner.actionObj.actionCode)))
+    return nodes, links
+
+class GraphExportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    '''
+    get_graph, the JSON lines and GraphML hold the same nodes and links as the
+    population.
+    '''
+    def test_formats(self):
+        trainer = Trainer(actions=4, teamPopSize=30, inputSize=16)
+        for gen in range(4):
+            score_teams(trainer)
+            trainer.evolve(['task'])
+        nodes, links = expectedGraph(trainer)
+
+        graph = trainer.get_graph()
+        self.assertEqual(set((n['id'], n['type']) for n in graph['nodes']), nodes)
+        self.assertEqual(len(graph['nodes']), len(nodes))
+        self.assertEqual(set((l['source'], l['target']) for l in graph['links']), links)
+        self.assertEqual(len(graph['links']), len(links))
+
+        fileName = os.path.join(self.dir, 'graph.jsonl')
+        trainer.exportGraph(fileName, format='jsonl')
+        with open(fileName) as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual(records, graph['nodes'] + graph['links'])
+
+        fileName = os.path.join(self.dir, 'graph.graphml')
+        trainer.exportGraph(fileName, format='graphml')
+        ns = {'g': 'http://graphml.graphdrawing.org/xmlns'}
+        root = ET.parse(fileName).getroot()
+        self.assertEqual(set((n.get('id'), n.find("g:data[@key='type']", ns).text)
+                            for n in root.iterfind('.//g:node', ns)), nodes)
+        self.assertEqual(set((e.get('source'), e.get('target'))
+                            for e in root.iterfind('.//g:edge', ns)), links)
+
+        fileName = os.path.join(self.dir, 'graph.npz')
+        trainer.exportGraph(fileName)
+        saved = loadArrays(fileName)
+        for name, array in graphArrays(trainer).items():
+            self.assertTrue((saved[name] == array).all(), name)
+
+        with self.assertRaises(Exception):
+            trainer.exportGraph(fileName, format='dot')
+
+        trainer.cleanup()
+
+    '''
+    Recording saves a full graph then diffs, which take each graph to the next.
+    '''
+    def test_record(self):
+        trainer = Trainer(actions=4, teamPopSize=30, inputSize=16)
+        prefix = os.path.join(self.dir, 'gen')
+        trainer.setGraphRecording(prefix, fullEvery=3)
+        graphs = []
+        for gen in range(4):
+            score_teams(trainer)
+            trainer.evolve(['task'])
+            graphs.append(graphArrays(trainer))
+        self.assertEqual(sorted(os.listdir(self.dir)),
+                         ['gen1.npz', 'gen2.diff.npz', 'gen3.npz', 'gen4.diff.npz'])
+
+        diff = loadArrays(prefix + '2.diff.npz')
+        old, new = graphs[0], graphs[1]
+        self.assertEqual(int(diff['fromGeneration']), 1)
+        self.assertEqual(int(diff['generation']), 2)
+        ids = set(old['nodeIds'].tolist()) - set(diff['removedIds'].tolist())
+        ids |= set(diff['addedIds'].tolist())
+        self.assertEqual(ids, set(new['nodeIds'].tolist()))
+        edges = edgeSet(old) - set(map(tuple, diff['removedEdges'].tolist()))
+        edges |= set(map(tuple, diff['addedEdges'].tolist()))
+        self.assertEqual(edges, edgeSet(new))
+        self.assertTrue(len(diff['addedIds']) > 0)
+        self.assertTrue(len(diff['removedIds']) > 0)
+
+        # types of surviving nodes changed are in the diff
+        types = dict(zip(old['nodeIds'].tolist(), old['nodeType'].tolist()))
+        types.update(zip(diff['changedIds'].tolist(), diff['changedType'].tolist()))
+        types.update(zip(diff['addedIds'].tolist(), diff['addedType'].tolist()))
+        self.assertEqual(dict((i, types[i]) for i in new['nodeIds'].tolist()),
+                         dict(zip(new['nodeIds'].tolist(), new['nodeType'].tolist())))
+
+        self.assertEqual(graphDiff(new, new)['addedEdges'].shape, (0, 2))
+
+        trainer.setGraphRecording(None)
+        self.assertIsNone(trainer.graphRecorder)
+        trainer.cleanup()
+
+if __name__ == '__main__':
+    unittest.main(testRunner=xmlrunner.XMLTestRunner(output='test-reports'))
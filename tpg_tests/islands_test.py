@@ -0,0 +1,81 @@
+import unittest
+import xmlrunner
+from tpg.islands import IslandModel, migrationSources, importMigrants
+from tpg.trainer import Trainer
+from tpg_tests.evaluation_test import sum_actions
+
+class IslandsTest(unittest.TestCase):
+
+    def test_topology(self):
+        self.assertEqual(migrationSources("ring", 3), [[2], [0], [1]])
+        self.assertEqual(migrationSources("complete", 3), [[1, 2], [0, 2], [0, 1]])
+        self.assertEqual(migrationSources("ring", 1), [[]])
+        self.assertEqual(migrationSources([[1], []], 2), [[1], []])
+        with self.assertRaises(Exception):
+            migrationSources([[1]], 2)
+
+    '''
+    Migrants come in as copies that only point into their new population.
+    '''
+    def test_import(self):
+        trainers = [Trainer(actions=4, teamPopSize=10, inputSize=16) for i in range(2)]
+        for gen in range(3):
+            for trainer in trainers:
+                for rt in trainer.rootTeams:
+                    rt.outcomes['task'] = float(len(rt.learners))
+                trainer.evolve(['task'])
+        source, trainer = trainers
+        # ones pointing to teams of the source island first
+        immigrants = sorted(source.rootTeams,
+                        key=lambda team: all(l.isActionAtomic() for l in team.learners))[:2]
+        immigrants.append(trainer.rootTeams[0]) # already at home
+        copies = importMigrants(trainer, immigrants)
+        self.assertEqual(len(copies), 2)
+        for copy, immigrant in zip(copies, immigrants):
+            self.assertNotEqual(copy.id, immigrant.id)
+            self.assertGreaterEqual(copy.numAtomicActions(), 1)
+
+        for gen in range(3):
+            for rt in trainer.rootTeams:
+                rt.outcomes['task'] = float(len(rt.learners))
+            trainer.evolve(['task'], extraTeams=copies if gen == 0 else None)
+            trainer.checkGraph(full=True)
+        for t in trainers:
+            t.cleanup()
+
+    '''
+    Differently configured islands evolve side by side, and the best root teams
+    of each get sent on to the next island in the ring.
+    '''
+    def test_islands(self):
+        trainerKwargs = [
+            {'actions': 4, 'teamPopSize': 10, 'inputSize': 16},
+            {'actions': 4, 'teamPopSize': 12, 'inputSize': 16, 'gap': 0.3},
+            {'actions': 4, 'teamPopSize': 10, 'inputSize': 16, 'traversal': 'learner'},
+        ]
+        with IslandModel(trainerKwargs, sum_actions, evalArgs=(20, 16), tasks=['task'],
+                         migrationInterval=2, numMigrants=2, seed=1) as model:
+            stats = model.run(2)
+            self.assertEqual([len(s) for s in stats], [4, 4, 4])
+            for islandStats in stats:
+                for genStats in islandStats:
+                    self.assertLessEqual(genStats['min'], genStats['max'])
+
+            # emigrants are the best root teams, so survive on their own island
+            teamIds = model.getTeamIds()
+            for i, immigrants in enumerate(model.immigrants):
+                self.assertEqual(len(immigrants), 2)
+                source = (i - 1) % 3
+                self.assertTrue(set(t.id for t in immigrants) <= teamIds[source])
+
+            # migrants get taken in without trouble
+            stats = model.run(1)
+            self.assertEqual([len(s) for s in stats], [6, 6, 6])
+            self.assertEqual(model.checkGraphs(), [[], [], []])
+
+            champion, outcomes = model.getChampion()
+            self.assertIn('task', outcomes)
+            self.assertGreaterEqual(len(champion.learners), 1)
+
+if __name__ == '__main__':
+    unittest.main(testRunner=xmlrunner.XMLTestRunner(output='test-reports'))
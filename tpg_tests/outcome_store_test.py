@@ -0,0 +1,129 @@
+import unittest
+import xmlrunner
+import pickle
+import os
+import numpy as np
+from tpg.trainer import Trainer, loadTrainer
+from tpg.outcome_store import OutcomeStore, OutcomeView
+from tpg.evaluation import EvalResult, COMPLETED, FAILED
+from tpg_tests.test_utils import create_dummy_team
+
+class OutcomeStoreTest(unittest.TestCase):
+
+    '''
+    team.outcomes keeps behaving like a dict once it is a view onto the store.
+    '''
+    def test_view(self):
+        store = OutcomeStore(capacity=1)
+        team, _ = create_dummy_team()
+        first, _ = create_dummy_team()
+        store.addTeam(first)
+        # no tasks seen yet
+        self.assertTrue(np.isnan(store.column([first], 'task')).all())
+        team.outcomes['old'] = 3.0
+
+        store.addTeam(team)
+        self.assertIsInstance(team.outcomes, OutcomeView)
+        self.assertEqual(team.outcomes['old'], 3.0)
+        self.assertNotIn('new', team.outcomes)
+
+        team.outcomes['new'] = 5.0
+        self.assertEqual(dict(team.outcomes), {'old': 3.0, 'new': 5.0})
+        self.assertEqual(len(team.outcomes), 2)
+        del team.outcomes['old']
+        self.assertEqual(dict(team.outcomes), {'new': 5.0})
+        with self.assertRaises(KeyError):
+            team.outcomes['old']
+
+        # growing past capacity keeps old rows intact
+        others = [create_dummy_team()[0] for _ in range(10)]
+        for i, other in enumerate(others):
+            store.addTeam(other)
+            other.outcomes['new'] = float(i)
+        self.assertEqual(team.outcomes['new'], 5.0)
+        self.assertEqual(list(store.column(others, 'new')), [float(i) for i in range(10)])
+        self.assertTrue(np.isnan(store.column(others, 'never seen')).all())
+
+        # removed teams keep their outcomes as a plain dict, rows get reused
+        store.removeTeam(team)
+        self.assertEqual(team.outcomes, {'new': 5.0})
+        store.addTeam(create_dummy_team()[0])
+        self.assertEqual(store.nRows, 12)
+
+        # agents shipped to other processes carry a plain dict
+        self.assertEqual(pickle.loads(pickle.dumps(others[3])).outcomes, {'new': 3.0})
+
+    '''
+    Trainer queries read the store and stay bound after saving and loading.
+    '''
+    def test_trainer(self):
+        trainer = Trainer(actions=4, teamPopSize=10)
+        ids = [rt.id for rt in trainer.rootTeams]
+        scores = np.arange(10, dtype=float)[:,None]
+        trainer.applyScoreMatrix(ids[:5], ['task'], scores[:5])
+
+        # skip the ones already done
+        self.assertEqual([a.team.id for a in trainer.getAgents(skipTasks=['task'])], ids[5:])
+
+        trainer.applyScores([(ids[i], {'task': float(i)}) for i in range(5, 10)])
+        self.assertEqual([a.team.id for a in trainer.getAgents(sortTasks=['task'])],
+                        ids[::-1])
+        self.assertEqual(trainer.getTaskStats('task')['average'], 4.5)
+        self.assertEqual(trainer.getEliteAgent('task').team.id, ids[9])
+
+        trainer.scoreIndividuals(['task'])
+        trainer.saveFitnessStats()
+        self.assertEqual(trainer.fitnessStats['max'], 9.0)
+        self.assertIs(trainer.elites[0], trainer.rootTeams[9])
+
+        trainer.saveToFile("test_outcome_store_save")
+        loaded = loadTrainer("test_outcome_store_save")
+        os.remove("test_outcome_store_save")
+        self.assertIs(loaded.rootTeams[2].outcomes.store, loaded.outcomeStore)
+        self.assertEqual(loaded.rootTeams[2].outcomes['task'], 2.0)
+
+        # evolution drops the removed teams from the store
+        trainer.evolve(['task'])
+        self.assertEqual(len(trainer.outcomeStore.rows), len(trainer.teams))
+
+        trainer.cleanup()
+
+    '''
+    Results of failed evaluations get the worst outcome at each task, also when
+    the tasks aren't given.
+    '''
+    def test_failed(self):
+        trainer = Trainer(actions=4, teamPopSize=10)
+        ids = [rt.id for rt in trainer.rootTeams]
+        trainer.applyScores([EvalResult(ids[i], {'task': float(i)}, 0.1, COMPLETED, None)
+                             for i in range(2, 10)])
+        trainer.applyScores([EvalResult(ids[i], {}, 0.1, FAILED, "error") for i in range(2)])
+        self.assertEqual([trainer.rootTeams[i].outcomes['task'] for i in range(2)], [2.0, 2.0])
+        trainer.evolve(['task'])
+        trainer.cleanup()
+
+    '''
+    Trainers pickled before the outcome store get one, with the outcomes their
+    teams held.
+    '''
+    def test_old_pickle(self):
+        trainer = Trainer(actions=4, teamPopSize=10)
+        ids = [rt.id for rt in trainer.rootTeams]
+        trainer.applyScores([(ids[i], {'task': float(i)}) for i in range(10)])
+        state = dict(pickle.loads(pickle.dumps(trainer)).__dict__)
+        del state['outcomeStore']
+        for team in state['teams']:
+            team.outcomes = dict(team.outcomes)
+
+        old = Trainer.__new__(Trainer)
+        old.__setstate__(state)
+        self.assertIs(old.rootTeams[3].outcomes.store, old.outcomeStore)
+        self.assertEqual(old.getTaskStats('task')['average'], 4.5)
+        old.applyScores([(ids[0], {'task': 20.0})])
+        self.assertEqual(old.getEliteAgent('task').team.id, ids[0])
+        old.evolve(['task'])
+        trainer.cleanup()
+        old.cleanup()
+
+if __name__ == '__main__':
+    unittest.main(testRunner=xmlrunner.XMLTestRunner(output='test-reports'))
@@ -0,0 +1,174 @@
+import unittest
+import xmlrunner
+import time
+import numpy as np
+from tpg.trainer import Trainer
+from tpg import scoring
+
+'''
+Slow reference implementations to compare the vectorized scorers against.
+'''
+def dominates(a, b):
+    return all(a >= b) and any(a > b)
+
+def reference_ranks(outcomes):
+    ranks = np.full(len(outcomes), -1)
+    remaining = set(range(len(outcomes)))
+    rank = 0
+    while remaining:
+        front = [i for i in remaining
+            if not any(dominates(outcomes[j], outcomes[i]) for j in remaining if j != i)]
+        for i in front:
+            ranks[i] = rank
+            remaining.remove(i)
+        rank += 1
+    return ranks
+
+class ScoringTest(unittest.TestCase):
+
+    '''
+    Dominance counts must match the original pairwise list based scorers.
+    '''
+    def test_dominance_counts(self):
+        rng = np.random.default_rng(0)
+        # small integer outcomes so ties are common
+        outcomes = rng.integers(0, 4, size=(60, 3)).astype(float)
+
+        weak = [sum(1 for j in range(60) if j != i and all(outcomes[i] >= outcomes[j]))
+                for i in range(60)]
+        beaten = [sum(1 for j in range(60) if j != i and all(outcomes[i] < outcomes[j]))
+                for i in range(60)]
+
+        self.assertEqual(weak, list(scoring.paretoDominateCounts(outcomes)))
+        self.assertEqual(beaten, list(scoring.paretoBeatenCounts(outcomes)))
+
+    '''
+    Fast non-dominated sort must agree with naive front peeling.
+    '''
+    def test_non_dominated_sort(self):
+        rng = np.random.default_rng(1)
+        for shape in [(1, 2), (50, 2), (80, 4)]:
+            outcomes = rng.integers(0, 5, size=shape).astype(float)
+            self.assertEqual(list(reference_ranks(outcomes)),
+                list(scoring.nonDominatedSort(outcomes)))
+
+    '''
+    Boundaries of a front are infinitely crowded, interior points get the
+    normalized gap between neighbours.
+    '''
+    def test_crowding_distance(self):
+        outcomes = np.array([[0., 4.], [1., 2.], [3., 1.], [4., 0.]])
+        ranks = scoring.nonDominatedSort(outcomes)
+        self.assertEqual(list(ranks), [0, 0, 0, 0])
+
+        distances = scoring.crowdingDistance(outcomes, ranks)
+        self.assertTrue(np.isinf(distances[0]) and np.isinf(distances[3]))
+        self.assertAlmostEqual(distances[1], 3/4 + 3/4)
+        self.assertAlmostEqual(distances[2], 3/4 + 2/4)
+
+        # better fronts always have higher fitness
+        outcomes = np.array([[2., 2.], [1., 1.], [0., 3.], [0., 0.]])
+        fitness = scoring.paretoRankFitness(outcomes)
+        self.assertGreater(fitness[0], fitness[1])
+        self.assertGreater(fitness[2], fitness[1])
+        self.assertGreater(fitness[1], fitness[3])
+
+    '''
+    Thousands of teams over dozens of tasks should score quickly.
+    '''
+    def test_large_population(self):
+        outcomes = np.random.default_rng(2).random((3000, 24))
+        scoring.paretoRankFitness(outcomes[:10]) # compile
+
+        start = time.perf_counter()
+        scoring.paretoRankFitness(outcomes)
+        scoring.paretoDominateCounts(outcomes)
+        self.assertLess(time.perf_counter() - start, 5.0)
+
+    '''
+    The pareto scorers must actually get dispatched by the trainer.
+    '''
+    def test_trainer_dispatch(self):
+        trainer = Trainer(actions=4, teamPopSize=20)
+        for i, rt in enumerate(trainer.rootTeams):
+            rt.outcomes['a'] = float(i)
+            rt.outcomes['b'] = float(i)
+
+        trainer.scoreIndividuals(['a', 'b'], multiTaskType='paretoDominate')
+        self.assertEqual([rt.fitness for rt in trainer.rootTeams], list(range(20)))
+
+        trainer.scoreIndividuals(['a', 'b'], multiTaskType='paretoNonDominated')
+        self.assertEqual([rt.fitness for rt in trainer.rootTeams], [i-19 for i in range(20)])
+
+        trainer.scoreIndividuals(['a', 'b'], multiTaskType='paretoRank')
+        fitnesses = [rt.fitness for rt in trainer.rootTeams]
+        self.assertEqual(sorted(fitnesses), fitnesses)
+
+        trainer.scoreIndividuals(['a', 'b'], multiTaskType='average')
+        self.assertAlmostEqual(trainer.rootTeams[-1].fitness, 1.0)
+        self.assertAlmostEqual(trainer.rootTeams[0].fitness, 0.0)
+
+        trainer.cleanup()
+
+    '''
+    Lexicase never picks a team that is beaten on every case by another, and
+    always gives specialists (best at some case) a chance.
+    '''
+    def test_lexicase_select(self):
+        outcomes = np.array([
+            [10., 0., 0.],  # specialist case 0
+            [0., 10., 0.],  # specialist case 1
+            [0., 0., 10.],  # specialist case 2
+            [5., 5., 5.],   # generalist, never best on any case
+            [-1., -1., -1.] # beaten everywhere
+        ])
+        selected = scoring.lexicaseSelect(outcomes, 3000, seed=3)
+        counts = np.bincount(selected, minlength=5)
+        self.assertEqual(counts[3], 0)
+        self.assertEqual(counts[4], 0)
+        for i in range(3):
+            self.assertGreater(counts[i], 500)
+
+        # with a wide enough epsilon the generalist survives cases it is close on
+        selected = scoring.lexicaseSelect(outcomes, 3000, epsilon=6.0, seed=3)
+        self.assertGreater(np.bincount(selected, minlength=5)[3], 0)
+
+        # automatic epsilons are the median absolute deviation of each case
+        self.assertEqual(list(scoring.medianAbsoluteDeviation(outcomes)), [1., 1., 1.])
+
+        # same seed same selections
+        self.assertEqual(list(scoring.lexicaseSelect(outcomes, 50, seed=9, staticOrder=True)),
+                        list(scoring.lexicaseSelect(outcomes, 50, seed=9, staticOrder=True)))
+
+    '''
+    Hundreds of cases and thousands of root teams per generation.
+    '''
+    def test_lexicase_large(self):
+        outcomes = np.random.default_rng(4).random((3000, 300))
+        scoring.lexicaseFitness(outcomes[:10], epsilon="auto") # compile
+
+        start = time.perf_counter()
+        fitness = scoring.lexicaseFitness(outcomes, epsilon="auto", seed=1)
+        self.assertLess(time.perf_counter() - start, 5.0)
+        self.assertEqual(int(np.floor(fitness).sum()), 3000)
+
+    '''
+    Lexicase scorers must get dispatched by the trainer and rank a team that
+    is best everywhere first.
+    '''
+    def test_trainer_lexicase(self):
+        trainer = Trainer(actions=4, teamPopSize=20)
+        for i, rt in enumerate(trainer.rootTeams):
+            for j in range(5):
+                rt.outcomes[str(j)] = float((i*7 + j*3) % 11)
+        trainer.rootTeams[5].outcomes.update({str(j): 100.0 for j in range(5)})
+
+        for multiTaskType in ['lexicaseStatic', 'lexicaseDynamic', 'lexicaseEpsilon']:
+            trainer.scoreIndividuals([str(j) for j in range(5)], multiTaskType=multiTaskType)
+            best = max(trainer.rootTeams, key=lambda rt: rt.fitness)
+            self.assertIs(best, trainer.rootTeams[5])
+
+        trainer.cleanup()
+
+if __name__ == '__main__':
+    unittest.main(testRunner=xmlrunner.XMLTestRunner(output='test-reports'))
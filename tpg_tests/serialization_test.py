@@ -0,0 +1,90 @@
+import unittest
+import xmlrunner
+import multiprocessing as mp
+import numpy as np
+import os
+import pickle
+import tempfile
+from tpg.trainer import Trainer, loadTrainer
+from tpg.agent import loadAgent
+from tpg.serialization import dumps, loads, saveFile, loadFile, sendObject, recvObject
+
+class SerializationTest(unittest.TestCase):
+
+    '''
+    Instructions leave the pickle as out-of-band buffers and come back equal,
+    older protocols still pickle them in band.
+    '''
+    def test_buffers(self):
+        trainer = Trainer(actions=4, teamPopSize=10, inputSize=16)
+        programs = [l.program for l in trainer.learners]
+        payload, buffers = dumps(programs)
+        self.assertEqual(len(buffers), len(programs))
+        self.assertLess(len(payload), sum(p.instructions.nbytes for p in programs))
+
+        for copy, program in zip(loads(payload, buffers), programs):
+            self.assertEqual(copy.id, program.id)
+            self.assertTrue(np.array_equal(copy.instructions, program.instructions))
+
+        for copy, program in zip(pickle.loads(pickle.dumps(programs, protocol=4)), programs):
+            self.assertTrue(np.array_equal(copy.instructions, program.instructions))
+        trainer.cleanup()
+
+    '''
+    Saved trainers and agents load back (mapped or read) and act the same,
+    and files saved as plain pickles still load.
+    '''
+    def test_files(self):
+        trainer = Trainer(actions=4, teamPopSize=10, inputSize=16)
+        states = np.random.default_rng(0).random((10, 16))
+        with tempfile.TemporaryDirectory() as tmp:
+            fileName = os.path.join(tmp, 'trainer')
+            trainer.saveToFile(fileName)
+            for loaded in [loadTrainer(fileName), loadTrainer(fileName, useMmap=True)]:
+                self.assertEqual([t.id for t in loaded.teams], [t.id for t in trainer.teams])
+                for agent, copy in zip(trainer.getAgents(), loaded.getAgents()):
+                    agent.zeroRegisters()
+                    copy.zeroRegisters()
+                    for state in states:
+                        self.assertEqual(copy.act(state), agent.act(state))
+
+            # mapped arrays are copy on write, the file is left alone
+            loaded = loadTrainer(fileName, useMmap=True)
+            before = open(fileName, 'rb').read()
+            loaded.learners[0].program.instructions[0, 0] += 1
+            self.assertEqual(open(fileName, 'rb').read(), before)
+
+            # saving over the file a trainer was loaded from, mapped or not
+            for useMmap in [False, True]:
+                loaded = loadTrainer(fileName, useMmap=useMmap)
+                loaded.saveToFile(fileName)
+                loaded.learners[0].program.instructions[0, 0] += 1
+                loaded.saveToFile(fileName)
+                again = loadTrainer(fileName)
+                self.assertEqual(again.learners[0].program.instructions[0, 0],
+                                 loaded.learners[0].program.instructions[0, 0])
+                self.assertEqual(sorted(os.listdir(tmp)), ['trainer'])
+
+            agent = trainer.getAgents()[0]
+            agent.saveToFile(os.path.join(tmp, 'agent'))
+            copy = loadAgent(os.path.join(tmp, 'agent'))
+            self.assertEqual(copy.team.id, agent.team.id)
+
+            with open(os.path.join(tmp, 'old'), 'wb') as f:
+                pickle.dump(agent, f)
+            self.assertEqual(loadAgent(os.path.join(tmp, 'old')).team.id, agent.team.id)
+        trainer.cleanup()
+
+    def test_connections(self):
+        trainer = Trainer(actions=4, teamPopSize=10, inputSize=16)
+        programs = [l.program for l in trainer.learners]
+        reader, writer = mp.Pipe(duplex=False)
+        sendObject(writer, programs)
+        for copy, program in zip(recvObject(reader), programs):
+            self.assertTrue(np.array_equal(copy.instructions, program.instructions))
+        reader.close()
+        writer.close()
+        trainer.cleanup()
+
+if __name__ == '__main__':
+    unittest.main(testRunner=xmlrunner.XMLTestRunner(output='test-reports'))
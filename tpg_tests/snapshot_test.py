@@ -0,0 +1,189 @@
+import unittest
+import xmlrunner
+import numpy as np
+import multiprocessing as mp
+import os
+import tempfile
+import threading
+from tpg.trainer import Trainer
+from tpg.evaluation import EvaluationPool, reachableTeams, workerLoop, COMPLETED
+from tpg.snapshot import PopulationSnapshot, openSnapshot
+from tpg.utils import getLearners
+from tpg_tests.evaluation_test import sum_actions, serial_scores
+
+class SnapshotTest(unittest.TestCase):
+
+    '''
+    Teams built from a snapshot have the same graph and programs as the
+    population it was taken from.
+    '''
+    def test_structure(self):
+        trainer = Trainer(actions=4, teamPopSize=20, inputSize=16)
+        for gen in range(3):
+            for rt in trainer.rootTeams:
+                rt.outcomes['task'] = float(len(rt.learners))
+            trainer.evolve(['task'])
+
+        snapshot = trainer.publishSnapshot(shared=False)
+        self.assertEqual(snapshot.numTeams, len(reachableTeams(trainer.teams + trainer.rootTeams)))
+        self.assertEqual(set(snapshot.rootIds()), set(rt.id for rt in trainer.rootTeams))
+        self.assertEqual(len(snapshot.programPtr) - 1, snapshot.numLearners)
+
+        for rt in trainer.rootTeams:
+            copy = snapshot.buildTeam(rt.id)
+            self.assertIsNot(copy, rt)
+            self.assertEqual(copy.id, rt.id)
+            originals = {l.id: l for l in getLearners(rt)}
+            copies = getLearners(copy)
+            self.assertEqual(set(l.id for l in copies), set(originals))
+            for lCopy in copies:
+                learner = originals[lCopy.id]
+                self.assertTrue(np.array_equal(lCopy.program.instructions,
+                                                learner.program.instructions))
+                if learner.isActionAtomic():
+                    self.assertEqual(lCopy.actionObj.actionCode, learner.actionObj.actionCode)
+                else:
+                    self.assertEqual(lCopy.actionObj.teamAction.id, learner.actionObj.teamAction.id)
+
+        with self.assertRaises(Exception):
+            snapshot.buildTeam(trainer.learners[0].id) # not a team id
+
+        trainer.cleanup()
+
+    '''
+    A published snapshot is readable (but not writable) by anyone attaching to
+    it, and agents built from it act like the originals.
+    '''
+    def test_shared(self):
+        trainer = Trainer(actions=4, teamPopSize=12, inputSize=16)
+        published = trainer.publishSnapshot()
+        attached = PopulationSnapshot.attach(published.descriptor)
+
+        for name, array in published.arrays.items():
+            self.assertTrue(np.array_equal(array, attached.arrays[name]))
+            self.assertFalse(attached.arrays[name].flags.writeable)
+
+        expected = serial_scores(trainer, trainer.rootTeams)
+        for rt in trainer.rootTeams:
+            agent = attached.getAgent(rt.id, trainer.functionsDict, trainer.actVars)
+            self.assertEqual(sum_actions(agent, 20, 16)['task'], expected[rt.id])
+        agent = None
+
+        attached.close()
+        published.close()
+        trainer.cleanup()
+
+    '''
+    Saved snapshots open mapped read only from the file, with the outcomes and
+    everything agents need to act like the originals.
+    '''
+    def test_files(self):
+        trainer = Trainer(actions=4, teamPopSize=12, inputSize=16)
+        for rt in trainer.rootTeams:
+            rt.outcomes['task'] = float(len(rt.learners))
+        trainer.evolve(['task'])
+        trainer.rootTeams[0].outcomes['task'] = 5.0
+
+        with tempfile.TemporaryDirectory() as tmp:
+            fileName = os.path.join(tmp, 'snapshot')
+            trainer.saveSnapshot(fileName)
+            opened = openSnapshot(fileName)
+            self.assertEqual(opened.meta['generation'], trainer.generation)
+            self.assertEqual(set(opened.rootIds()), set(rt.id for rt in trainer.rootTeams))
+            for name, array in trainer.publishSnapshot(shared=False).arrays.items():
+                self.assertTrue(np.array_equal(array, opened.arrays[name]))
+                self.assertFalse(opened.arrays[name].flags.writeable)
+
+            self.assertEqual(opened.teamOutcomeMatrix.shape, (opened.numTeams, 1))
+            self.assertEqual(opened.teamOutcomes(trainer.rootTeams[0].id), {'task': 5.0})
+            for rt in trainer.rootTeams:
+                self.assertEqual(opened.teamOutcomes(rt.id), dict(rt.outcomes))
+
+            expected = serial_scores(trainer, trainer.rootTeams)
+            for rt in trainer.rootTeams:
+                self.assertEqual(sum_actions(opened.getAgent(rt.id), 20, 16)['task'],
+                                 expected[rt.id])
+            opened.close()
+
+            agent = trainer.getAgents()[0]
+            agent.saveSnapshot(fileName)
+            opened = openSnapshot(fileName)
+            self.assertEqual(opened.rootIds(), [agent.team.id])
+            self.assertEqual(sum_actions(opened.getAgent(agent.team.id), 20, 16)['task'],
+                             expected[agent.team.id])
+            opened.close()
+
+            with open(fileName, 'wb') as f:
+                f.write(b'not a snapshot')
+            with self.assertRaises(Exception):
+                openSnapshot(fileName)
+        trainer.cleanup()
+
+    '''
+    Workers reading shared snapshots give the same scores as evaluating in
+    process, over multiple generations.
+    '''
+    def test_pool(self):
+        trainer = Trainer(actions=4, teamPopSize=12, inputSize=16)
+
+        with EvaluationPool(trainer, sum_actions, evalArgs=(20, 16), processes=2,
+                            shared=True) as pool:
+            for gen in range(3):
+                teams = [a.team for a in trainer.getAgents(skipTasks=['task'])]
+                results = pool.evaluate(teams)
+
+                expected = serial_scores(trainer, teams)
+                for result in results:
+                    self.assertEqual(result.outcomes['task'], expected[result.teamId])
+
+                trainer.applyScores(results)
+                trainer.evolve(['task'])
+
+        trainer.cleanup()
+
+    '''
+    Snapshots are kept until every worker they were sent to attached to them,
+    so teams handed out right before the next submit still get played.
+    '''
+    def test_pool_submit(self):
+        trainer = Trainer(actions=4, teamPopSize=12, inputSize=16)
+
+        with EvaluationPool(trainer, sum_actions, evalArgs=(20, 16), processes=2,
+                            shared=True) as pool:
+            for rt in trainer.rootTeams:
+                pool.submit([rt])
+            results = []
+            while pool.numPending() > 0:
+                results += pool.collect()
+
+            self.assertEqual([r.status for r in results], [COMPLETED]*len(results))
+            expected = serial_scores(trainer, trainer.rootTeams)
+            self.assertEqual({r.teamId: r.outcomes['task'] for r in results}, expected)
+
+        trainer.cleanup()
+
+    '''
+    A worker sent a snapshot that is gone by the time it attaches hands its
+    teams back to be retried rather than failing them.
+    '''
+    def test_worker_retry(self):
+        trainer = Trainer(actions=4, teamPopSize=12, inputSize=16)
+        snapshot = trainer.publishSnapshot()
+        descriptor = snapshot.descriptor
+        snapshot.close()
+
+        conn, workerConn = mp.Pipe()
+        worker = threading.Thread(target=workerLoop, args=(workerConn,))
+        worker.start()
+        teamIds = [rt.id for rt in trainer.rootTeams[:2]]
+        conn.send(("setup", trainer.functionsDict, trainer.actVars, sum_actions, (20, 16)))
+        conn.send(("snapshot", descriptor))
+        conn.send(("eval", teamIds))
+        conn.send(("stop",))
+        self.assertEqual(conn.recv(), ("attached", descriptor[0]))
+        self.assertEqual(conn.recv(), ("retry", teamIds))
+        worker.join()
+        trainer.cleanup()
+
+if __name__ == '__main__':
+    unittest.main(testRunner=xmlrunner.XMLTestRunner(output='test-reports'))
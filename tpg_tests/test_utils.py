@@ -6,6 +6,7 @@ from tpg.learner import Learner
 from tpg.action_object import ActionObject
 from tpg.program import Program
 from tpg.team import Team
+from tpg.trainer import Trainer
 
 
 dummy_init_params = {
@@ -123,3 +124,29 @@ def getStateALE(inState):
     # get RRRRRRRR GGGGGGGG BBBBBBBB
     return np.add(np.left_shift(rgbRows[0], 16),
         np.add(np.left_shift(rgbRows[1], 8), rgbRows[2]))
+
+'''
+Score each root team of the trainer at 'task' by its number of learners
+'''
+def score_teams(trainer):
+    for rt in trainer.rootTeams:
+        rt.outcomes['task'] = float(len(rt.learners))
+
+'''
+Create a small trainer evolved for some generations, scored by score_teams.
+Trainer arguments default to 4 actions, 20 teams and 16 inputs.
+'''
+def create_evolved_trainer(gens=4, **kwargs):
+    kwargs = dict({'actions': 4, 'teamPopSize': 20, 'inputSize': 16}, **kwargs)
+    trainer = Trainer(**kwargs)
+    for gen in range(gens):
+        score_teams(trainer)
+        trainer.evolve(['task'])
+    return trainer
+
+'''
+Zero the registers of every learner of the trainer
+'''
+def zero_registers(trainer):
+    for learner in trainer.learners:
+        learner.zeroRegisters()
@@ -0,0 +1,73 @@
+import unittest
+import xmlrunner
+import numpy as np
+import pickle
+from tpg.trainer import Trainer
+from tpg.timings import PhaseTimer
+from tpg_tests.test_utils import score_teams
+
+class TimingsTest(unittest.TestCase):
+
+    '''
+    Spans nest into phases and are summed up with a histogram per generation.
+    '''
+    def test_spans(self):
+        timer = PhaseTimer(maxHistory=2)
+        with timer.span('outer'):
+            pass
+        self.assertEqual(timer.current, {})
+
+        timer.enable()
+        for gen in range(3):
+            with timer.span('outer'):
+                for i in range(4):
+                    with timer.span('inner'):
+                        pass
+            timer.endGeneration(gen)
+        self.assertEqual([gen for gen, stats in timer.history], [1, 2])
+
+        gen, stats = timer.history[-1]
+        self.assertEqual(set(stats), {'outer', 'outer/inner'})
+        self.assertEqual(stats['outer/inner'].count, 4)
+        self.assertEqual(stats['outer/inner'].histogram.sum(), 4)
+        self.assertLessEqual(stats['outer/inner'].min, stats['outer/inner'].max)
+        self.assertGreaterEqual(stats['outer'].total, stats['outer/inner'].total)
+        self.assertEqual(timer.histogram('outer/inner').sum(), 8)
+        self.assertEqual(len(timer.phaseTotals()['outer']), 2)
+
+        # nothing timed, no generation recorded
+        timer.endGeneration(3)
+        self.assertEqual(len(timer.history), 2)
+
+    '''
+    The trainer times each phase of evolution once enabled, and still pickles.
+    '''
+    def test_trainer(self):
+        trainer = Trainer(actions=4, teamPopSize=20, inputSize=16)
+        score_teams(trainer)
+        trainer.evolve(['task'])
+        self.assertEqual(len(trainer.timings.history), 0)
+
+        trainer.timings.enable()
+        for gen in range(3):
+            score_teams(trainer)
+            trainer.evolve(['task'])
+        self.assertEqual([gen for gen, stats in trainer.timings.history], [1, 2, 3])
+        for gen, stats in trainer.timings.history:
+            self.assertTrue({'score', 'fitnessStats', 'select', 'select/orphans', 'generate',
+                             'generate/mutate', 'nextEpoch'} <= set(stats))
+            self.assertEqual(stats['generate/mutate'].count, stats['generate/mutate'].histogram.sum())
+            self.assertEqual(stats['score'].count, 1)
+
+        score_teams(trainer)
+        trainer.evolveSteadyState(['task'], numReplace=2)
+        self.assertEqual(trainer.timings.history[-1][0], 4)
+
+        loaded = pickle.loads(pickle.dumps(trainer))
+        self.assertEqual(len(loaded.timings.history), 4)
+        self.assertTrue(np.array_equal(loaded.timings.histogram('generate'),
+                                       trainer.timings.histogram('generate')))
+        trainer.cleanup()
+
+if __name__ == '__main__':
+    unittest.main(testRunner=xmlrunner.XMLTestRunner(output='test-reports'))
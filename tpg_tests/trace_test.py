@@ -0,0 +1,89 @@
+import unittest
+import xmlrunner
+import numpy as np
+import os
+import tempfile
+from tpg.trace import DecisionTracer
+from tpg.snapshot import idFromBytes
+from tpg_tests.test_utils import create_evolved_trainer, zero_registers
+
+class TraceTest(unittest.TestCase):
+
+    '''
+    Traced agents act the same as untraced ones, and the records follow the
+    same paths as path_trace dicts do.
+    '''
+    def test_records(self):
+        for traversal in ['team', 'learner']:
+            trainer = create_evolved_trainer(gens=5, traversal=traversal)
+            states = np.random.default_rng(0).random((30, 16))
+            for agent in trainer.getAgents():
+                tracer = DecisionTracer(allBids=True)
+                zero_registers(trainer)
+                actions = [agent.act(state, path_trace=tracer) for state in states]
+                zero_registers(trainer)
+                traces = [{} for state in states]
+                self.assertEqual([agent.act(state, path_trace=trace)
+                                  for state, trace in zip(states, traces)], actions)
+                zero_registers(trainer)
+                self.assertEqual([agent.act(state) for state in states], actions)
+
+                records = tracer.records()
+                for frame, trace in enumerate(traces):
+                    frameRecords = records[records['frame'] == frame]
+                    top = frameRecords[frameRecords['top']]
+                    self.assertEqual(len(top), trace['depth'])
+                    self.assertEqual(len(frameRecords),
+                                     sum(len(segment['bids']) for segment in trace['path']))
+                    for record, segment in zip(top, trace['path']):
+                        self.assertEqual(record['depth'], segment['depth'])
+                        self.assertEqual(str(tracer.teamIds[record['team']]), segment['team_id'])
+                        self.assertEqual(str(tracer.learnerIds[record['learner']]),
+                                         segment['top_learner'])
+                        self.assertEqual(record['bid'], segment['top_bid'])
+                    self.assertEqual(top[-1]['action'], actions[frame])
+                    self.assertEqual(top[-1]['actionTeam'], -1)
+            trainer.cleanup()
+
+    '''
+    Only sampled frames are recorded, the buffer keeps the newest records, and
+    the export maps slots back to ids.
+    '''
+    def test_ring(self):
+        trainer = create_evolved_trainer(gens=5)
+        agent = trainer.getAgents()[0]
+        states = np.random.default_rng(1).random((50, 16))
+
+        tracer = DecisionTracer(capacity=1000, sampleEvery=5)
+        zero_registers(trainer)
+        for state in states:
+            agent.act(state, path_trace=tracer)
+        records = tracer.records()
+        self.assertEqual(set(records['frame']), set(range(0, 50, 5)))
+        self.assertTrue(records['top'].all())
+
+        full = tracer.numWritten
+        small = DecisionTracer(capacity=4, sampleEvery=5)
+        zero_registers(trainer)
+        for state in states:
+            agent.act(state, path_trace=small)
+        self.assertEqual(small.numWritten, full)
+        self.assertEqual(len(small), 4)
+        tail = small.records()
+        for name in ['frame', 'depth', 'bid', 'action']:
+            self.assertTrue(np.array_equal(tail[name], records[name][-4:]))
+
+        with tempfile.TemporaryDirectory() as tmp:
+            fileName = os.path.join(tmp, 'trace.npz')
+            small.export(fileName)
+            with np.load(fileName) as exported:
+                self.assertTrue(np.array_equal(exported['frame'], tail['frame']))
+                self.assertEqual([idFromBytes(i) for i in exported['teamIds'][exported['team']]],
+                                 [small.teamIds[t] for t in tail['team']])
+
+        small.clear()
+        self.assertEqual(len(small.records()), 0)
+        trainer.cleanup()
+
+if __name__ == '__main__':
+    unittest.main(testRunner=xmlrunner.XMLTestRunner(output='test-reports'))